@@ -2,7 +2,7 @@ from flask import Flask
 import logging
 import os
 from config import config
-from extensions import db, migrate, login_manager, csrf, init_oauth, socketio
+from extensions import db, migrate, login_manager, csrf, init_oauth, socketio, init_sqlite_profile
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -21,6 +21,7 @@ def create_app(config_name='default'):
     
     # Initialize extensions
     db.init_app(app)
+    init_sqlite_profile(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)
@@ -54,6 +55,10 @@ def create_app(config_name='default'):
         logger.addHandler(logging.StreamHandler())
         logger.setLevel(logging.DEBUG)
     
+    # Payment logs go through a queue to a background writer, secrets redacted
+    from payment_providers.payment_logging import init_payment_logging
+    init_payment_logging(app)
+    
     # Register blueprints
     from routes.main import main_bp
     from routes.auth import auth_bp
@@ -100,6 +105,46 @@ def create_app(config_name='default'):
             return 0
         size_obj = next((s for s in sizes if s.size == size), None)
         return size_obj.stock if size_obj else 0
+
+    # Previous/next page links for page-number and cursor pagination
+    from models.pagination import page_args
+    app.add_template_global(page_args)
+    
+    # Full-text search index
+    from services.search import init_search
+    init_search(app)
+    
+    # Popular products ranking
+    from services.popularity import init_popularity
+    init_popularity(app)
+    
+    # Daily sales rollups for analytics
+    from services.sales_rollup import init_sales_rollup
+    init_sales_rollup(app)
+    
+    # In-memory admin dashboard counters
+    from services.dashboard_stats import init_dashboard_stats
+    init_dashboard_stats(app)
+    
+    # Unread notification counters and socket events
+    from services.unread_notifications import init_unread_notifications
+    init_unread_notifications(app)
+    
+    # Stock reservations
+    from services.inventory import init_inventory
+    init_inventory(app)
+    
+    # PayOS webhook inbox and its workers
+    from services.webhook_inbox import init_webhook_inbox
+    init_webhook_inbox(app)
+    
+    # Background settling of unpaid PayOS orders
+    from services.payment_reconciler import init_payment_reconciler
+    init_payment_reconciler(app)
+    
+    # Read replica routing
+    from services.replica import init_replica
+    init_replica(app)
     
     # Error handlers
     from error_handlers import init_error_handlers, ValidationError, handle_validation_error
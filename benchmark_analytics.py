@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Benchmark the NumPy analytics reports on a large order history
+
+Fills a temporary SQLite database with synthetic orders, then times loading
+the sales arrays with services.analytics and computing each admin report
+from them. It then adds and cancels some orders and times the incremental
+refresh that the background thread runs.
+
+Usage: python benchmark_analytics.py [order_items] [items_per_order]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+CUSTOMERS = 20000
+PRODUCTS = 2000
+CATEGORIES = 40
+HISTORY_DAYS = 730
+
+
+def seed(db, items, items_per_order):
+    from models import User, Category, Product, Order, OrderItem, OrderStatus
+    rng = random.Random(42)
+    start = datetime.utcnow() - timedelta(days=HISTORY_DAYS)
+    statuses = [OrderStatus.DELIVERED] * 8 + [OrderStatus.PROCESSING, OrderStatus.CANCELLED]
+
+    db.session.bulk_insert_mappings(Category, [
+        {'id': i + 1, 'name': f'Category {i}', 'slug': f'category-{i}'} for i in range(CATEGORIES)])
+    db.session.bulk_insert_mappings(User, [
+        {'id': i + 1, 'email': f'user{i}@example.com', 'username': f'user{i}'} for i in range(CUSTOMERS)])
+    db.session.bulk_insert_mappings(Product, [{
+        'id': i + 1, 'name': f'Product {i}', 'price': 1000 * (i % 500 + 1), 'category_id': i % CATEGORIES + 1,
+        'stock': rng.randint(0, 200), 'sku': f'BENCH-{i}', 'inventory_type': 'regular'
+    } for i in range(PRODUCTS)])
+    db.session.commit()
+
+    # Core inserts straight to the tables; the ORM is far too slow for millions of rows
+    order_table, item_table = Order.__table__, OrderItem.__table__
+    orders = items // items_per_order
+    batch = 50000
+    with db.engine.begin() as connection:
+        for first in range(0, orders, batch):
+            order_rows, item_rows = [], []
+            for order_id in range(first + 1, min(first + batch, orders) + 1):
+                lines = [(rng.randint(1, PRODUCTS), rng.randint(1, 3)) for _ in range(items_per_order)]
+                total = sum(1000 * (product_id % 500 + 1) * quantity for product_id, quantity in lines)
+                created_at = start + timedelta(seconds=rng.randint(0, HISTORY_DAYS * 86400))
+                order_rows.append({
+                    'id': order_id, 'user_id': rng.randint(1, CUSTOMERS), 'total_amount': total,
+                    'status': rng.choice(statuses).name, 'payment_method': 'cod', 'shipping_fee': 0,
+                    'created_at': created_at, 'updated_at': created_at, 'stock_reserved': False
+                })
+                item_rows.extend({
+                    'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                    'price': 1000 * (product_id % 500 + 1)
+                } for product_id, quantity in lines)
+            connection.execute(order_table.insert(), order_rows)
+            connection.execute(item_table.insert(), item_rows)
+    return orders
+
+
+def churn(db, orders, changes):
+    """Cancel some existing orders and add as many new ones, as a TTL's worth of traffic would"""
+    from models import Order, OrderItem, OrderStatus
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    order_table, item_table = Order.__table__, OrderItem.__table__
+    with db.engine.begin() as connection:
+        connection.execute(order_table.update().where(order_table.c.id.in_(rng.sample(range(1, orders + 1), changes)))
+                           .values(status=OrderStatus.CANCELLED.name, updated_at=now))
+        connection.execute(order_table.insert(), [{
+            'id': order_id, 'user_id': rng.randint(1, CUSTOMERS), 'total_amount': 1000,
+            'status': OrderStatus.PROCESSING.name, 'payment_method': 'cod', 'shipping_fee': 0,
+            'created_at': now, 'updated_at': now, 'stock_reserved': False
+        } for order_id in range(orders + 1, orders + changes + 1)])
+        connection.execute(item_table.insert(), [{
+            'order_id': order_id, 'product_id': rng.randint(1, PRODUCTS), 'quantity': 1, 'price': 1000
+        } for order_id in range(orders + 1, orders + changes + 1)])
+
+
+def timed(label, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    print(f'{label:>28}: {elapsed:.3f}s')
+    return result, elapsed
+
+
+def run(items, items_per_order):
+    db_path = os.path.join(tempfile.mkdtemp(), 'analytics.db')
+    from config import TestingConfig
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+
+    from app import create_app
+    from extensions import db
+    from services.analytics import (SalesFrame, since_days, revenue_by_period, order_value_summary,
+                                    repeat_purchase_cohorts, category_revenue_share, product_sell_through)
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        orders = seed(db, items, items_per_order)
+        print(f'Seeded {orders} orders / {orders * items_per_order} order items '
+              f'in {time.perf_counter() - started:.1f}s')
+
+        frame, load = timed('load arrays (one query)', SalesFrame.load)
+        print(f'{"":>28}  {len(frame)} sold lines, {len(frame.orders["order_id"])} orders')
+        reports = [
+            ('revenue by day', revenue_by_period, frame, 'day', None),
+            ('revenue by week', revenue_by_period, frame, 'week', None),
+            ('revenue by month, 90 days', revenue_by_period, frame, 'month', since_days(90)),
+            ('order value summary', order_value_summary, frame, None),
+            ('repeat-purchase cohorts', repeat_purchase_cohorts, frame, 24),
+            ('category revenue share', category_revenue_share, frame, None),
+            ('product sell-through', product_sell_through, frame, None, 20),
+        ]
+        compute = sum(timed(label, func, *args)[1] for label, func, *args in reports)
+
+        changes = max(orders // 1000, 1)
+        churn(db, orders, changes)
+        refreshed, refresh = timed(f'refresh ({changes} new, {changes} cancelled)', frame.refreshed)
+        full = SalesFrame.load()
+        assert all((refreshed.lines[name] == full.lines[name]).all() for name in full.lines), \
+            'refreshed arrays differ from a full load'
+    print(f'All reports from loaded arrays: {compute:.3f}s (load {load:.3f}s once per process, '
+          f'then a {refresh:.3f}s background refresh every ANALYTICS_FRAME_TTL seconds)')
+    return compute
+
+
+if __name__ == '__main__':
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    items_per_order = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    run(items, items_per_order)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Benchmark checkout throughput on SQLite with and without the engine profile
+
+Writer threads place COD orders through the real reservation path while
+reader threads page through the catalog, once with SQLite's defaults
+(rollback journal, no busy_timeout, default pool) and once with the
+SQLITE_PRAGMAS and SQLALCHEMY_ENGINE_OPTIONS profile from config.py.
+
+Usage: python benchmark_checkout.py [writers] [orders_per_writer] [readers]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PRODUCTS = 50
+STOCK = 1000000
+
+
+def run(profile, writers, orders_per_writer, readers):
+    db_path = os.path.join(tempfile.mkdtemp(), 'checkout.db')
+    from config import Config, TestingConfig, engine_options
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    if profile:
+        TestingConfig.SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS)
+        TestingConfig.SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+            TestingConfig.SQLALCHEMY_DATABASE_URI, pool_size=writers + readers, max_overflow=0)
+    else:
+        TestingConfig.SQLITE_PRAGMAS = None
+        TestingConfig.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from extensions import db
+    from models import User, Category, Product, Order, OrderItem, OrderStatus
+    from services.inventory import reserve_order_stock
+    from routes.products import get_filtered_query
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Benchmark', slug='benchmark')
+        user = User(email='bench@example.com', username='bench')
+        db.session.add_all([category, user])
+        db.session.flush()
+        db.session.bulk_insert_mappings(Product, [{
+            'name': f'Product {i}', 'price': 1000 * (i + 1), 'category_id': category.id,
+            'stock': STOCK, 'in_stock': True, 'sku': f'BENCH-{i}', 'inventory_type': 'regular'
+        } for i in range(PRODUCTS)])
+        db.session.commit()
+        user_id = user.id
+        product_ids = [p.id for p in Product.query.all()]
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    counts = {'orders': 0, 'retries': 0, 'reads': 0, 'read_errors': 0}
+    counts_lock = threading.Lock()
+    done = threading.Event()
+    start_gate = threading.Barrier(writers + readers)
+
+    def count(name):
+        with counts_lock:
+            counts[name] += 1
+
+    def writer(n):
+        start_gate.wait()
+        for i in range(orders_per_writer):
+            product_id = product_ids[(n * orders_per_writer + i) % len(product_ids)]
+            with app.app_context():
+                while True:
+                    try:
+                        order = Order(user_id=user_id, total_amount=1000, payment_method='cod',
+                                      status=OrderStatus.PROCESSING)
+                        db.session.add(order)
+                        db.session.flush()
+                        db.session.add(OrderItem(order_id=order.id, product_id=product_id,
+                                                 quantity=1, price=1000))
+                        reserve_order_stock(order)
+                        db.session.commit()
+                        break
+                    except OperationalError:
+                        # database is locked: the write lock wasn't free in time
+                        db.session.rollback()
+                        count('retries')
+                db.session.remove()
+            count('orders')
+
+    def reader():
+        start_gate.wait()
+        while not done.is_set():
+            with app.app_context():
+                try:
+                    get_filtered_query(min_price=1000).order_by(Product.id).limit(12).all()
+                    count('reads')
+                except OperationalError:
+                    db.session.rollback()
+                    count('read_errors')
+                db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads + reader_threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+
+    label = 'with profile' if profile else 'defaults'
+    print(f"{label:>12}: journal={journal_mode}, {counts['orders']} orders in {elapsed:.2f}s "
+          f"= {counts['orders'] / elapsed:.1f} orders/s, lock retries {counts['retries']}, "
+          f"catalog reads {counts['reads'] / elapsed:.1f}/s, read errors {counts['read_errors']}")
+    return counts['orders'] / elapsed
+
+
+if __name__ == '__main__':
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    orders_per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 25
+    readers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{writers} writers x {orders_per_writer} orders, {readers} catalog readers")
+    baseline = run(False, writers, orders_per_writer, readers)
+    tuned = run(True, writers, orders_per_writer, readers)
+    print(f"Checkout throughput: {tuned / baseline:.2f}x")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Benchmark PayOS checkouts against a local stub gateway
+
+Starts payos_stub_server.py in-process and runs the real checkout
+(/cart/checkout with payment_method=payos).
+
+reuse:   latency with a new connection per PayOS call, as module-level
+         requests.post made, and with the worker's pooled keep-alive session
+slow:    throughput of concurrent shoppers while the gateway is slow; a
+         checkout that held its database transaction across the PayOS call
+         would make every other checkout wait for it
+create:  time of PayOSAPI.create_payment against an instant stub, and the
+         part of it spent outside the HTTP call (signing and logging); run
+         it with stdout on a terminal to include the cost of console output
+
+Usage: python benchmark_payos.py reuse [--checkouts 50] [--handshake-ms 60] [--latency-ms 40]
+       python benchmark_payos.py slow [--shoppers 8] [--checkouts 5] [--latency-ms 500]
+       python benchmark_payos.py create [--checkouts 2000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+PORT = 8765
+
+
+class NewConnectionSession:
+    """Opens and closes a session per call, like module-level requests.post"""
+
+    def get(self, url, **kwargs):
+        with requests.Session() as session:
+            return session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        with requests.Session() as session:
+            return session.post(url, **kwargs)
+
+
+SHIPPING = {'first_name': 'Bench', 'last_name': 'Mark', 'address': '1 Street',
+            'city': 'Hanoi', 'state': 'HN', 'zip': '100000'}
+
+
+def setup(handshake_ms, latency_ms, shoppers=1, log_level='WARNING'):
+    """Start the stub and an app with a product and logged-in test clients"""
+    from payos_stub_server import make_server
+    server = make_server(PORT, handshake_ms, latency_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'payos.db')
+    from config import TestingConfig, Config, engine_options
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    TestingConfig.SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS)
+    TestingConfig.SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        TestingConfig.SQLALCHEMY_DATABASE_URI, pool_size=shoppers, max_overflow=0)
+    TestingConfig.WTF_CSRF_ENABLED = False
+    TestingConfig.PAYOS_BASE_URL = f'http://127.0.0.1:{PORT}/v2'
+    TestingConfig.PAYOS_CLIENT_ID = TestingConfig.PAYOS_API_KEY = TestingConfig.PAYOS_SECRET_KEY = 'stub'
+    TestingConfig.PAYMENT_LOG_LEVEL = log_level
+
+    from app import create_app
+    from extensions import db
+    from models import User, Category, Product
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Benchmark', slug='benchmark')
+        users = [User(email=f'bench{i}@example.com', username=f'bench{i}') for i in range(shoppers)]
+        db.session.add_all([category] + users)
+        db.session.flush()
+        product = Product(name='Benchmark product', price=10000, category_id=category.id,
+                          stock=1000000, sku='BENCH-PAYOS', inventory_type='regular')
+        db.session.add(product)
+        db.session.commit()
+        user_ids, product_id = [user.id for user in users], product.id
+
+    clients = []
+    for user_id in user_ids:
+        client = app.test_client()
+        with client.session_transaction() as flask_session:
+            flask_session['_user_id'] = str(user_id)
+        clients.append(client)
+    return server, app, clients, product_id
+
+
+def checkout(client, product_id):
+    """Add one item and check out with PayOS; returns (seconds, response)"""
+    client.post(f'/cart/add/{product_id}', data={'quantity': 1})
+    started = time.perf_counter()
+    response = client.post('/cart/checkout', json={'payment_method': 'payos', 'shipping_info': SHIPPING})
+    return time.perf_counter() - started, response
+
+
+def run_reuse(checkouts, handshake_ms, latency_ms):
+    from payment_providers.payos import PayOSAPI
+    server, app, (client,), product_id = setup(handshake_ms, latency_ms)
+
+    results = {}
+    for label, session in (('new connection per call', NewConnectionSession()), ('pooled keep-alive', None)):
+        with app.app_context():
+            app.extensions['payos'] = PayOSAPI(session=session)
+        connections_before = server.RequestHandlerClass.connections
+        timings = []
+        for _ in range(checkouts):
+            elapsed, response = checkout(client, product_id)
+            timings.append(elapsed)
+            if not (response.get_json() or {}).get('payment_url'):
+                raise SystemExit(f'Checkout failed: {response.status_code} {response.get_data(as_text=True)[:200]}')
+        connections = server.RequestHandlerClass.connections - connections_before
+        results[label] = statistics.median(timings)
+        timings.sort()
+        print(f'{label:>24}: median {statistics.median(timings) * 1000:.1f} ms, '
+              f'p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.1f} ms, '
+              f'{connections} connections for {checkouts} checkouts')
+
+    server.shutdown()
+    saved = results['new connection per call'] - results['pooled keep-alive']
+    print(f'Connection reuse saves {saved * 1000:.1f} ms per checkout (median)')
+    return results
+
+
+def run_slow(shoppers, checkouts, latency_ms):
+    server, app, clients, product_id = setup(0, latency_ms, shoppers)
+    counts = {'ok': 0, 'failed': 0}
+    timings = []
+    lock = threading.Lock()
+    gate = threading.Barrier(shoppers)
+
+    def shopper(client):
+        gate.wait()
+        for _ in range(checkouts):
+            elapsed, response = checkout(client, product_id)
+            with lock:
+                timings.append(elapsed)
+                counts['ok' if (response.get_json() or {}).get('payment_url') else 'failed'] += 1
+
+    threads = [threading.Thread(target=shopper, args=(client,)) for client in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    timings.sort()
+    print(f'{shoppers} shoppers x {checkouts} checkouts, gateway latency {latency_ms:.0f} ms: '
+          f'{counts["ok"]} ok, {counts["failed"]} failed in {elapsed:.2f}s = '
+          f'{counts["ok"] / elapsed:.2f} checkouts/s, median {statistics.median(timings) * 1000:.0f} ms, '
+          f'max {timings[-1] * 1000:.0f} ms')
+    return counts['ok'] / elapsed
+
+
+class TimedSession:
+    """Wraps a session and adds up the time spent in its HTTP calls"""
+
+    def __init__(self, session):
+        self.session = session
+        self.seconds = 0.0
+
+    def _timed(self, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            return getattr(self.session, method)(url, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def get(self, url, **kwargs):
+        return self._timed('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._timed('post', url, **kwargs)
+
+
+def run_create(calls):
+    from payment_providers.payos import PayOSAPI, get_session
+    # The default level, so the per-payment INFO line counts
+    server, app, _, _ = setup(0, 0, log_level='INFO')
+    with app.test_request_context():
+        session = TimedSession(get_session())
+        api = PayOSAPI(session=session)
+        api.create_payment('1', 10000, 'Warm-up')  # open the pooled connection
+        timings, overheads = [], []
+        for order_id in range(2, calls + 2):
+            http_before = session.seconds
+            started = time.perf_counter()
+            result = api.create_payment(str(order_id), 10000, f'Order #{order_id}')
+            elapsed = time.perf_counter() - started
+            timings.append(elapsed)
+            overheads.append(elapsed - (session.seconds - http_before))
+            if not result.get('success'):
+                raise SystemExit(f'create_payment failed: {result}')
+    server.shutdown()
+
+    timings.sort()
+    overheads.sort()
+    # stderr, so the report stands out from anything create_payment writes to stdout
+    print(f'create_payment x {calls}: median {statistics.median(timings) * 1000:.3f} ms, '
+          f'p99 {timings[int(len(timings) * 0.99) - 1] * 1000:.3f} ms; outside the HTTP call: '
+          f'median {statistics.median(overheads) * 1000:.3f} ms, '
+          f'p99 {overheads[int(len(overheads) * 0.99) - 1] * 1000:.3f} ms', file=sys.stderr)
+    return statistics.median(overheads)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark PayOS checkouts against a local stub gateway')
+    parser.add_argument('scenario', choices=('reuse', 'slow', 'create'))
+    parser.add_argument('--checkouts', type=int, help='checkouts (per shopper for slow)')
+    parser.add_argument('--shoppers', type=int, default=8)
+    parser.add_argument('--handshake-ms', type=float, default=60)
+    parser.add_argument('--latency-ms', type=float)
+    args = parser.parse_args()
+    if args.scenario == 'reuse':
+        run_reuse(args.checkouts or 50, args.handshake_ms, 40 if args.latency_ms is None else args.latency_ms)
+    elif args.scenario == 'slow':
+        run_slow(args.shoppers, args.checkouts or 5, 500 if args.latency_ms is None else args.latency_ms)
+    else:
+        run_create(args.checkouts or 2000)
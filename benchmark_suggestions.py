@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Benchmark /api/search/suggestions: ILIKE query path vs in-memory prefix index
+
+Usage: python benchmark_suggestions.py [product_count] [lookups]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+WORDS = ['Điện', 'thoại', 'Samsung', 'Galaxy', 'Áo', 'thun', 'Quần', 'jean', 'Giày',
+         'thể', 'thao', 'Nike', 'Adidas', 'Laptop', 'Dell', 'Tai', 'nghe', 'Sony',
+         'Đồng', 'hồ', 'Xe', 'đạp', 'Bàn', 'phím', 'Chuột', 'không', 'dây']
+
+
+def query_path(prefix):
+    """The original suggestion query: two ILIKE prefix patterns per keystroke"""
+    from sqlalchemy import and_, or_
+    from models import Product
+    products = Product.query.filter(
+        and_(
+            Product.is_active == True,
+            or_(
+                Product.name.ilike(f'{prefix}%'),
+                Product.name.ilike(f'% {prefix}%')
+            )
+        )
+    ).limit(10).all()
+    return [{
+        'id': p.id,
+        'name': p.name,
+        'price': p.price_display,
+        'image': p.image_url_or_placeholder,
+        'url': f'/products/{p.id}'
+    } for p in products]
+
+
+def run(product_count, lookups):
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    from config import TestingConfig
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+
+    from app import create_app
+    from extensions import db
+    from models import Category, Product
+    from services.suggestions import suggestion_index
+
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Benchmark', slug='benchmark')
+        db.session.add(category)
+        db.session.flush()
+        rng = random.Random(42)
+        db.session.bulk_insert_mappings(Product, [{
+            'name': ' '.join(rng.sample(WORDS, 4)) + f' {i}',
+            'price': rng.randint(10, 5000) * 1000,
+            'category_id': category.id,
+            'sku': f'BENCH-{i}',
+            'is_active': True
+        } for i in range(product_count)])
+        db.session.commit()
+
+        prefixes = [rng.choice(WORDS).lower()[:rng.randint(1, 4)] for _ in range(lookups)]
+
+        start = time.perf_counter()
+        for prefix in prefixes:
+            query_path(prefix)
+            db.session.remove()
+        query_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        suggestion_index.load()
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for prefix in prefixes:
+            suggestion_index.suggest(prefix)
+        index_time = time.perf_counter() - start
+
+    print(f"Products: {product_count}, lookups: {lookups}")
+    print(f"ILIKE query path: {query_time * 1000 / lookups:.3f} ms/lookup")
+    print(f"Prefix index:     {index_time * 1000 / lookups:.3f} ms/lookup "
+          f"(one-off load {load_time * 1000:.0f} ms)")
+    print(f"Speedup:          {query_time / index_time:.0f}x")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    run(count, lookups)
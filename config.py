@@ -5,11 +5,26 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-# Debug environment variables
-print("\n🔍 Debugging Environment Variables:")
-print(f"PAYOS_CLIENT_ID: {os.environ.get('PAYOS_CLIENT_ID', 'Not set')}")
-print(f"PAYOS_API_KEY: {os.environ.get('PAYOS_API_KEY', 'Not set')}")
-print(f"PAYOS_SECRET_KEY: {os.environ.get('PAYOS_SECRET_KEY', 'Not set')}\n")
+
+def engine_options(database_uri, pool_size=5, max_overflow=10):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS pool settings for a database URI
+
+    In-memory SQLite keeps SQLAlchemy's single-connection pool, which takes
+    no sizing arguments.
+    """
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    options = {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30
+    }
+    if not database_uri.startswith('sqlite'):
+        # Server connections can be dropped by the database or a proxy
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+    return options
+
 
 class Config:
     # Secret key for session management and security
@@ -22,10 +37,39 @@ class Config:
     PAYOS_CLIENT_ID = os.environ.get('PAYOS_CLIENT_ID')
     PAYOS_API_KEY = os.environ.get('PAYOS_API_KEY')
     PAYOS_SECRET_KEY = os.environ.get('PAYOS_SECRET_KEY')
+    # Point at payos_stub_server.py for local benchmarks
+    PAYOS_BASE_URL = os.environ.get('PAYOS_BASE_URL', 'https://api-merchant.payos.vn/v2')
+    # Keep-alive connections kept per worker, and connect/read timeouts in seconds
+    PAYOS_POOL_SIZE = int(os.environ.get('PAYOS_POOL_SIZE', 10))
+    PAYOS_CONNECT_TIMEOUT = float(os.environ.get('PAYOS_CONNECT_TIMEOUT', 3.05))
+    PAYOS_READ_TIMEOUT = float(os.environ.get('PAYOS_READ_TIMEOUT', 20))
+    PAYOS_RETRIES = int(os.environ.get('PAYOS_RETRIES', 3))
+    # Level of the queued, redacted payment logs (see payment_providers/payment_logging.py)
+    PAYMENT_LOG_LEVEL = os.environ.get('PAYMENT_LOG_LEVEL', 'INFO')
     
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///ecommerce.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    
+    # Read replica for read-only pages (see services/replica.py)
+    SQLALCHEMY_BINDS = {'replica': os.environ['REPLICA_DATABASE_URL']} if os.environ.get('REPLICA_DATABASE_URL') else {}
+    # Seconds a user keeps reading from the primary after writing
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    # SQLite replica only: copy the primary file to the replica every N seconds
+    REPLICA_SYNC_INTERVAL = float(os.environ['REPLICA_SYNC_INTERVAL']) if os.environ.get('REPLICA_SYNC_INTERVAL') else None
+    
+    # Pragmas run on every new SQLite connection (see extensions.init_sqlite_profile).
+    # WAL lets readers carry on while checkout writes; busy_timeout makes writers
+    # wait for the lock instead of failing with "database is locked".
+    SQLITE_PRAGMAS = {
+        'busy_timeout': 5000,            # ms
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',         # durable at checkpoints, safe with WAL
+        'cache_size': -20000,            # KiB (negative), about 20 MB per connection
+        'mmap_size': 256 * 1024 * 1024,  # bytes
+        'temp_store': 'MEMORY'
+    }
     
     # JWT configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key'
@@ -47,6 +91,35 @@ class Config:
     # Pagination
     PRODUCTS_PER_PAGE = 12
     ORDERS_PER_PAGE = 10
+    # 'keyset' pages listings by cursor unless a page number is asked for; 'offset' always uses page numbers
+    PAGINATION_MODE = os.environ.get('PAGINATION_MODE', 'keyset')
+    
+    # Popular products ranking: half-life in days for time decay, None to rank by all-time sales
+    POPULARITY_HALF_LIFE_DAYS = float(os.environ['POPULARITY_HALF_LIFE_DAYS']) if os.environ.get('POPULARITY_HALF_LIFE_DAYS') else None
+    
+    # Seconds before admin analytics refresh their order arrays in the background (see services/analytics.py)
+    ANALYTICS_FRAME_TTL = int(os.environ.get('ANALYTICS_FRAME_TTL', 300))
+    # Seconds between recounts of the in-memory dashboard statistics (see services/dashboard_stats.py)
+    DASHBOARD_STATS_RECONCILE_SECONDS = int(os.environ.get('DASHBOARD_STATS_RECONCILE_SECONDS', 300))
+    # Socket events for bursts of notifications to one user are merged over this many seconds
+    NOTIFICATION_EMIT_WINDOW = float(os.environ.get('NOTIFICATION_EMIT_WINDOW', 0.25))
+    
+    # Threads per process applying stored PayOS webhooks, and seconds between sweeps
+    # for ones left pending or failed (see services/webhook_inbox.py)
+    WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+    WEBHOOK_SWEEP_SECONDS = int(os.environ.get('WEBHOOK_SWEEP_SECONDS', 60))
+    
+    # Minutes an unpaid PayOS order holds its reserved stock
+    STOCK_RESERVATION_TTL_MINUTES = int(os.environ.get('STOCK_RESERVATION_TTL_MINUTES', 30))
+    # Unpaid PayOS orders checked with PayOS in the background (see services/payment_reconciler.py):
+    # seconds between passes (0 disables), age before an order is checked, orders per pass,
+    # parallel PayOS calls and PayOS calls per second. The last two apply per process;
+    # orders are claimed, so processes split the work instead of repeating it
+    PAYMENT_RECONCILE_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_SECONDS', 60))
+    PAYMENT_RECONCILE_AFTER_SECONDS = int(os.environ.get('PAYMENT_RECONCILE_AFTER_SECONDS', 600))
+    PAYMENT_RECONCILE_BATCH = int(os.environ.get('PAYMENT_RECONCILE_BATCH', 200))
+    PAYMENT_RECONCILE_CONCURRENCY = int(os.environ.get('PAYMENT_RECONCILE_CONCURRENCY', 4))
+    PAYMENT_RECONCILE_RATE = float(os.environ.get('PAYMENT_RECONCILE_RATE', 10))
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -65,13 +138,20 @@ class DevelopmentConfig(Config):
     TRAP_HTTP_EXCEPTIONS = True
     os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # Enable OAuth on http
     
+    # Database pool: a single developer
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(Config.SQLALCHEMY_DATABASE_URI, pool_size=5, max_overflow=5)
+    
 class ProductionConfig(Config):
     DEBUG = False
     # In production, ensure to set proper secret keys through environment variables
     
+    # Database pool: enough connections for concurrent eventlet greenlets
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(Config.SQLALCHEMY_DATABASE_URI, pool_size=20, max_overflow=30)
+    
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test.db'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     WTF_CSRF_ENABLED = False
 
 # Configuration dictionary
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""
+EXPLAIN QUERY PLAN report for the hot queries in the routes
+
+Builds each query the way its route does and prints SQLite's plan before
+and after the indexes added by migration 9d4e6b1a2f37. Indexes that the
+database didn't have to begin with are dropped again afterwards.
+
+Usage: python explain_query_plans.py [sqlite_database_url]
+
+Without a URL a temporary database is built from the models.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+# Indexes added by migration 9d4e6b1a2f37
+HOT_INDEXES = (
+    'ix_cart_items_user_active',
+    'ix_orders_user_created',
+    'ix_orders_status_created',
+    'ix_orders_created',
+    'ix_order_items_order_id',
+    'ix_order_items_product_id',
+    'ix_notifications_user_created',
+    'ix_notifications_user_read_created',
+    'ix_products_active_category_price',
+    'ix_products_active_created',
+    'ix_review_product_created',
+    'ix_product_images_product_id',
+    'ix_product_sizes_product_id',
+    'ix_product_colors_product_id',
+    'ix_product_variant_product_id',
+)
+
+
+def hot_queries():
+    """(label, statement) for each query, as built by the routes"""
+    from sqlalchemy import func
+    from extensions import db
+    from models import (CartItem, Order, OrderItem, OrderStatus, Notification,
+                        Product, ProductImage, ProductSize, Review)
+    from routes.products import get_filtered_query
+
+    since = datetime(2026, 1, 1)
+    return [
+        ('Cart for a user (CartItem.get_cart_for_user)',
+         CartItem.query.filter_by(user_id=1, deleted_at=None).statement),
+        ('Purchase history (auth.purchase_history, api.get_orders)',
+         Order.query.filter_by(user_id=1)
+         .order_by(Order.created_at.desc(), Order.id.desc()).limit(11).statement),
+        ('Orders by status and date (admin.manage_orders)',
+         Order.query.filter_by(status=OrderStatus.PAID).filter(Order.created_at >= since)
+         .order_by(Order.created_at.desc(), Order.id.desc()).limit(21).statement),
+        ('All orders newest first (admin.manage_orders, admin.dashboard)',
+         Order.query.order_by(Order.created_at.desc(), Order.id.desc()).limit(21).statement),
+        ('Latest notifications (api.get_notifications)',
+         Notification.query.filter_by(user_id=1)
+         .order_by(Notification.created_at.desc()).limit(10).statement),
+        ('Unread notification count (flask recount-unread-notifications)',
+         db.select(func.count()).select_from(Notification)
+         .where(Notification.user_id == 1, Notification.is_read == False)),
+        ('Catalog by category and price (products.index, products.category_view)',
+         get_filtered_query(categories=['Phones'], min_price=1000, max_price=50000)
+         .order_by(Product.id).limit(13).statement),
+        ('Newest active products (main.build_home_sections)',
+         Product.query.filter_by(is_active=True)
+         .order_by(Product.created_at.desc()).limit(8).statement),
+        ('Reviews for a product (reviews.get_product_reviews)',
+         Review.query.filter_by(product_id=1).order_by(Review.created_at.desc()).limit(10).statement),
+        ('Lines of an order (services.inventory)',
+         db.select(OrderItem.product_id, OrderItem.quantity).where(OrderItem.order_id == 1)),
+        ('Sales of a product (services.popularity)',
+         db.select(func.sum(OrderItem.quantity)).where(OrderItem.product_id == 1)),
+        ('Size stock total (Product.sync_stock)',
+         db.select(func.coalesce(func.sum(ProductSize.stock), 0)).where(ProductSize.product_id == 1)),
+        ('Images for a page of products (Product.preload)',
+         db.select(ProductImage).where(ProductImage.product_id.in_([1, 2, 3]))),
+    ]
+
+
+def explain(connection, statement):
+    sql = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def run(database_url=None):
+    from config import TestingConfig
+    fresh = database_url is None
+    if fresh:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'explain.db')
+    if not database_url.startswith('sqlite'):
+        print('EXPLAIN QUERY PLAN is SQLite only; use EXPLAIN on other databases.')
+        return False
+    TestingConfig.SQLALCHEMY_DATABASE_URI = database_url
+
+    from app import create_app
+    from extensions import db
+
+    app = create_app('testing')
+    with app.app_context():
+        if fresh:
+            db.create_all()
+        indexes = {index.name: index for table in db.metadata.tables.values()
+                   for index in table.indexes if index.name in HOT_INDEXES}
+        with db.engine.begin() as connection:
+            existing = {name for name in indexes
+                        if connection.exec_driver_sql(
+                            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                            (name,)).first()}
+
+        queries = hot_queries()
+        plans = {}
+        try:
+            for phase in ('before', 'after'):
+                with db.engine.begin() as connection:
+                    for index in indexes.values():
+                        if phase == 'before':
+                            index.drop(connection, checkfirst=True)
+                        else:
+                            index.create(connection, checkfirst=True)
+                    for label, statement in queries:
+                        plans[(label, phase)] = explain(connection, statement)
+        finally:
+            # Leave the database with the indexes it started with
+            with db.engine.begin() as connection:
+                for name, index in indexes.items():
+                    if name in existing:
+                        index.create(connection, checkfirst=True)
+                    else:
+                        index.drop(connection, checkfirst=True)
+
+    improved = 0
+    for label, _ in queries:
+        before, after = plans[(label, 'before')], plans[(label, 'after')]
+        improved += before != after
+        print(f'== {label}')
+        for phase, plan in (('before', before), ('after', after)):
+            print(f'  {phase}:')
+            for line in plan:
+                print(f'    {line}')
+        print()
+    print(f'{improved} of {len(queries)} plans changed')
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run(sys.argv[1] if len(sys.argv) > 1 else None) else 1)
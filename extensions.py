@@ -1,12 +1,35 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_migrate import Migrate
 from authlib.integrations.flask_client import OAuth
 from flask_socketio import SocketIO
+from sqlalchemy import event, Select
+
+
+class RoutingSession(Session):
+    """
+    db.session that sends plain SELECTs to the 'replica' bind when the
+    request has asked for it (see services/replica.py)
+
+    Flushes, Core statements and locking reads go to the primary, and so
+    does every read after them.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_replica') and not self.info.get('on_primary'):
+            if not self._flushing and isinstance(clause, Select) and clause._for_update_arg is None:
+                replica = self._db.engines.get('replica')
+                if replica is not None:
+                    return replica
+            else:
+                self.info['on_primary'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 csrf = CSRFProtect()
@@ -28,4 +51,27 @@ def init_oauth(app):
             'redirect_uri': 'http://127.0.0.1:5000/auth/google/google/authorized'
         }
     )
-    return oauth
\ No newline at end of file
+    return oauth
+
+def init_sqlite_profile(app):
+    """
+    Run SQLITE_PRAGMAS on every new connection of the app's SQLite engines
+
+    Must be called after db.init_app and before the first connection is made.
+    """
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    for engine in engines:
+        # In-memory databases have no journal or file to map
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', set_sqlite_pragmas)
@@ -0,0 +1,49 @@
+"""Add product_popularity ranking table
+
+Revision ID: 3f9a2c71b8d4
+Revises: 78941b5098e8
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a2c71b8d4'
+down_revision = '78941b5098e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_popularity',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('total_quantity', sa.Integer(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id'], ),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+    with op.batch_alter_table('product_popularity', schema=None) as batch_op:
+        batch_op.create_index('ix_product_popularity_score', ['score', 'order_count'], unique=False)
+        batch_op.create_index('ix_product_popularity_category_score', ['category_id', 'score', 'order_count'], unique=False)
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('popularity_recorded_at', sa.DateTime(), nullable=True))
+
+    # Fill the table with `flask rebuild-popularity` after upgrading
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('popularity_recorded_at')
+
+    with op.batch_alter_table('product_popularity', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_popularity_category_score')
+        batch_op.drop_index('ix_product_popularity_score')
+
+    op.drop_table('product_popularity')
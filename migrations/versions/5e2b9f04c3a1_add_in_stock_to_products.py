@@ -0,0 +1,38 @@
+"""Add maintained in_stock flag to Product model
+
+Revision ID: 5e2b9f04c3a1
+Revises: 8c41d0e5a7b2
+Create Date: 2026-10-18 11:52:09.604771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b9f04c3a1'
+down_revision = '8c41d0e5a7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('in_stock', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.create_index(batch_op.f('ix_products_in_stock'), ['in_stock'], unique=False)
+
+    # Bring option-stocked totals up to date, then set the flag
+    for inventory_type, table in (('size', 'product_sizes'),
+                                  ('color', 'product_colors'),
+                                  ('both', 'product_variant')):
+        op.execute(
+            f"UPDATE products SET stock = (SELECT COALESCE(SUM({table}.stock), 0) FROM {table} "
+            f"WHERE {table}.product_id = products.id) WHERE inventory_type = '{inventory_type}'"
+        )
+    op.execute("UPDATE products SET in_stock = (COALESCE(stock, 0) > 0)")
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_products_in_stock'))
+        batch_op.drop_column('in_stock')
@@ -0,0 +1,30 @@
+"""Add stock reservation fields to Order model
+
+Revision ID: 8c41d0e5a7b2
+Revises: 3f9a2c71b8d4
+Create Date: 2026-10-18 11:05:48.219364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d0e5a7b2'
+down_revision = '3f9a2c71b8d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock_reserved', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('reservation_expires_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_orders_reservation_expires_at'), ['reservation_expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_orders_reservation_expires_at'))
+        batch_op.drop_column('reservation_expires_at')
+        batch_op.drop_column('stock_reserved')
@@ -0,0 +1,87 @@
+"""Add composite and partial indexes for hot queries
+
+Revision ID: 9d4e6b1a2f37
+Revises: 5e2b9f04c3a1
+Create Date: 2026-10-18 16:20:41.318052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4e6b1a2f37'
+down_revision = '5e2b9f04c3a1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Cart lookups always filter on user_id and deleted_at IS NULL; soft-deleted
+    # rows pile up, so only live rows are indexed
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.create_index('ix_cart_items_user_active', ['user_id'], unique=False,
+                              sqlite_where=sa.text('deleted_at IS NULL'),
+                              postgresql_where=sa.text('deleted_at IS NULL'))
+
+    # Purchase history and /api/orders: a user's orders newest first.
+    # Admin order list: optional status filter, date range, newest first.
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_user_created', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_orders_status_created', ['status', 'created_at'], unique=False)
+        batch_op.create_index('ix_orders_created', ['created_at'], unique=False)
+
+    # Order lines are read by order (stock reservation, order detail) and by
+    # product (popularity rebuild, product deletion checks)
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_items_order_id'), ['order_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_order_items_product_id'), ['product_id'], unique=False)
+
+    # Notification dropdown (latest per user) and unread counter
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.create_index('ix_notifications_user_created', ['user_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_notifications_user_read_created', ['user_id', 'is_read', 'created_at'], unique=False)
+
+    # Catalog filters (is_active, category, price range) and newest products
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.create_index('ix_products_active_category_price', ['is_active', 'category_id', 'price'], unique=False)
+        batch_op.create_index('ix_products_active_created', ['is_active', 'created_at'], unique=False)
+
+    # Reviews on a product page, newest first
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.create_index('ix_review_product_created', ['product_id', 'created_at'], unique=False)
+
+    # Option and image rows are loaded and summed per product (preload,
+    # Product.sync_stock)
+    for table in ('product_images', 'product_sizes', 'product_colors', 'product_variant'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(batch_op.f(f'ix_{table}_product_id'), ['product_id'], unique=False)
+
+
+def downgrade():
+    for table in ('product_images', 'product_sizes', 'product_colors', 'product_variant'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_product_id'))
+
+    with op.batch_alter_table('review', schema=None) as batch_op:
+        batch_op.drop_index('ix_review_product_created')
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_active_created')
+        batch_op.drop_index('ix_products_active_category_price')
+
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_user_read_created')
+        batch_op.drop_index('ix_notifications_user_created')
+
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_items_product_id'))
+        batch_op.drop_index(batch_op.f('ix_order_items_order_id'))
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_created')
+        batch_op.drop_index('ix_orders_status_created')
+        batch_op.drop_index('ix_orders_user_created')
+
+    with op.batch_alter_table('cart_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_cart_items_user_active')
@@ -0,0 +1,26 @@
+"""Add reconcile_claimed_at to orders
+
+Revision ID: a7e2c94f1b60
+Revises: f3d8a1c5e627
+Create Date: 2026-10-18 21:24:51.107342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e2c94f1b60'
+down_revision = 'f3d8a1c5e627'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reconcile_claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('reconcile_claimed_at')
@@ -0,0 +1,40 @@
+"""Add daily_sales and daily_product_sales rollup tables
+
+Revision ID: b7c3e8f2d915
+Revises: 9d4e6b1a2f37
+Create Date: 2026-10-18 18:05:12.640391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c3e8f2d915'
+down_revision = '9d4e6b1a2f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('daily_sales',
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('order_count', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('date')
+    )
+    op.create_table('daily_product_sales',
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('date', 'product_id')
+    )
+
+    # Fill the tables with `flask backfill-sales-rollup` after upgrading
+
+
+def downgrade():
+    op.drop_table('daily_product_sales')
+    op.drop_table('daily_sales')
@@ -0,0 +1,28 @@
+"""Add unread_notifications counter to users
+
+Revision ID: c2a7d4e9b158
+Revises: b7c3e8f2d915
+Create Date: 2026-10-18 20:14:37.201846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2a7d4e9b158'
+down_revision = 'b7c3e8f2d915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('unread_notifications', sa.Integer(), nullable=False, server_default='0'))
+
+    # Fill the counters with `flask recount-unread-notifications` after upgrading
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('unread_notifications')
@@ -0,0 +1,27 @@
+"""Index orders.updated_at
+
+Revision ID: c5d1f7a2b946
+Revises: a7e2c94f1b60
+Create Date: 2026-10-18 22:05:13.482219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d1f7a2b946'
+down_revision = 'a7e2c94f1b60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The analytics refresh reads only orders changed since its last read
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.create_index('ix_orders_updated', ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_updated')
@@ -0,0 +1,44 @@
+"""Add webhook_events inbox for payment webhooks
+
+Revision ID: e4b19c6d3a72
+Revises: c2a7d4e9b158
+Create Date: 2026-10-18 21:02:48.517326
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b19c6d3a72'
+down_revision = 'c2a7d4e9b158'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_code', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('transaction_id', sa.String(length=100), nullable=False),
+        sa.Column('amount', sa.BigInteger(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('state', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('deliveries', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('order_code', 'status', 'transaction_id', name='uq_webhook_events_delivery')
+    )
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.create_index('ix_webhook_events_state_received', ['state', 'received_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_events_state_received')
+
+    op.drop_table('webhook_events')
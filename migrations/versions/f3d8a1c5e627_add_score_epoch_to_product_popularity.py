@@ -0,0 +1,30 @@
+"""Add score_epoch to product_popularity
+
+Revision ID: f3d8a1c5e627
+Revises: e4b19c6d3a72
+Create Date: 2026-10-18 21:02:14.583190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3d8a1c5e627'
+down_revision = 'e4b19c6d3a72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_popularity', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('score_epoch', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_product_popularity_score_epoch', ['score_epoch'], unique=False)
+
+    # Decayed scores are put on the new epoch scale with `flask rebuild-popularity`
+
+
+def downgrade():
+    with op.batch_alter_table('product_popularity', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_popularity_score_epoch')
+        batch_op.drop_column('score_epoch')
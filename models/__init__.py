@@ -6,9 +6,13 @@ from .category import Category
 from .cart import CartItem, Cart
 from .product_image import ProductImage
 from .notification import Notification
+from .popularity import ProductPopularity
+from .daily_sales import DailySales, DailyProductSales
+from .webhook_event import WebhookEvent
 
 __all__ = [
     'User', 'Product', 'ProductVariant', 'ProductSize', 'ProductColor',
     'Order', 'OrderItem', 'OrderStatus', 'Review', 'Category',
-    'CartItem', 'Cart', 'ProductImage', 'Notification'
+    'CartItem', 'Cart', 'ProductImage', 'Notification', 'ProductPopularity',
+    'DailySales', 'DailyProductSales', 'WebhookEvent'
 ]
\ No newline at end of file
@@ -5,6 +5,12 @@ from flask import current_app
 class CartItem(db.Model):
     """Cart model for storing user cart items"""
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        # Live cart rows per user; soft-deleted rows are left out of the index
+        db.Index('ix_cart_items_user_active', 'user_id',
+                 sqlite_where=db.text('deleted_at IS NULL'),
+                 postgresql_where=db.text('deleted_at IS NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -43,8 +49,12 @@ class CartItem(db.Model):
                 current_app.logger.error(f"Invalid user_id format: {user_id}")
                 raise ValueError(f"Invalid user ID format: {str(e)}")
 
-            # Get all active cart items for this user
-            cart_items = cls.query.filter_by(user_id=user_id, deleted_at=None).all()
+            # Get all active cart items for this user with their products
+            cart_items = cls.query.filter_by(user_id=user_id, deleted_at=None)\
+                .options(db.joinedload(cls.product)).all()
+            # Skip items whose product doesn't exist or is inactive
+            cart_items = [item for item in cart_items if item.product and item.product.is_active]
+            variants, colors, sizes = cls._load_item_options(cart_items)
             
             # Calculate totals and build cart dict
             items = []
@@ -52,10 +62,7 @@ class CartItem(db.Model):
             
             for item in cart_items:
                 product = item.product
-                # Skip if product doesn't exist or is inactive
-                if not product or not product.is_active:
-                    continue
-                    
+                
                 # Use discounted price if available
                 price = product.discount_price if product.discount_price else product.price
                 item_subtotal = price * item.quantity
@@ -73,13 +80,14 @@ class CartItem(db.Model):
                     'image_url': product.primary_image.image_url if product.primary_image else product.image_url,
                     'size': item.size,
                     'color_id': item.color_id,
+                    'variant_id': item.variant_id,
                     'sku': product.sku,
                     'inventory_type': product.inventory_type
                 }
                 
                 # Handle stock based on inventory type
                 if product.inventory_type == 'both' and item.variant_id:
-                    variant = next((v for v in product.variants if v.id == item.variant_id), None)
+                    variant = variants.get((product.id, item.variant_id))
                     if variant:
                         item_dict['stock'] = variant.stock
                         item_dict['variant'] = {
@@ -90,7 +98,7 @@ class CartItem(db.Model):
                             'stock': variant.stock
                         }
                 elif product.inventory_type == 'color' and item.color_id:
-                    color = next((c for c in product.colors if c.id == item.color_id), None)
+                    color = colors.get((product.id, item.color_id))
                     if color:
                         item_dict['stock'] = color.stock
                         item_dict['color'] = {
@@ -100,7 +108,7 @@ class CartItem(db.Model):
                             'stock': color.stock
                         }
                 elif product.inventory_type == 'size' and item.size:
-                    size_obj = next((s for s in product.sizes if s.size == item.size), None)
+                    size_obj = sizes.get((product.id, item.size))
                     if size_obj:
                         item_dict['stock'] = size_obj.stock
                         item_dict['size_info'] = {
@@ -144,6 +152,59 @@ class CartItem(db.Model):
                 'error': 'An error occurred while retrieving your cart'
             }
 
+    @staticmethod
+    def _load_item_options(cart_items):
+        """
+        Bulk load product images and the variants, colors and sizes the cart
+        items refer to, with a fixed number of queries
+        
+        Returns:
+            tuple: dicts keyed by (product_id, variant_id), (product_id, color_id)
+                   and (product_id, size)
+        """
+        from models.product import ProductVariant, ProductColor, ProductSize
+        from models.product_image import ProductImage
+        from models.loading import load_collection
+        
+        products = list({item.product.id: item.product for item in cart_items}.values())
+        load_collection(products, 'images', ProductImage, ProductImage.product_id,
+                        order_by=(ProductImage.is_primary.desc(), ProductImage.id))
+        
+        variant_ids = {item.variant_id for item in cart_items
+                       if item.product.inventory_type == 'both' and item.variant_id}
+        color_ids = {item.color_id for item in cart_items
+                     if item.product.inventory_type == 'color' and item.color_id}
+        size_product_ids = {item.product_id for item in cart_items
+                            if item.product.inventory_type == 'size' and item.size}
+        
+        variants = {}
+        if variant_ids:
+            for variant in ProductVariant.query.options(
+                    db.joinedload(ProductVariant.size),
+                    db.joinedload(ProductVariant.color)
+            ).filter(ProductVariant.id.in_(variant_ids)):
+                variants[(variant.product_id, variant.id)] = variant
+        
+        colors = {}
+        if color_ids:
+            for color in ProductColor.query.filter(ProductColor.id.in_(color_ids)):
+                colors[(color.product_id, color.id)] = color
+        
+        sizes = {}
+        if size_product_ids:
+            for size in ProductSize.query.filter(ProductSize.product_id.in_(size_product_ids))\
+                    .order_by(ProductSize.id):
+                # Keep the first row per size, as the linear scan did
+                sizes.setdefault((size.product_id, size.size), size)
+        
+        return variants, colors, sizes
+
+    @classmethod
+    def _refresh_summary(cls, user_id):
+        """Write the updated cart through to the cart summary cache"""
+        from services.cart_cache import cart_summaries
+        cart_summaries.refresh(user_id)
+
     @classmethod
     def clear_cart(cls, user_id):
         """
@@ -164,6 +225,9 @@ class CartItem(db.Model):
             for item in cart_items:
                 item.deleted_at = datetime.utcnow()
             db.session.commit()
+            
+            from services.cart_cache import cart_summaries
+            cart_summaries.set_empty(user_id)
             return True
         except Exception as e:
             current_app.logger.error(f"Error clearing cart: {str(e)}")
@@ -234,6 +298,7 @@ class CartItem(db.Model):
                 # Update quantity
                 cart_item.quantity += quantity
                 db.session.commit()
+                cls._refresh_summary(user_id)
                 return {"success": True, "message": "Cart updated"}
             else:
                 # Create new cart item
@@ -247,6 +312,7 @@ class CartItem(db.Model):
                 )
                 db.session.add(new_item)
                 db.session.commit()
+                cls._refresh_summary(user_id)
                 return {"success": True, "message": "Product added to cart"}
                 
         except Exception as e:
@@ -283,11 +349,13 @@ class CartItem(db.Model):
                 # Soft delete if quantity is zero or negative
                 cart_item.deleted_at = datetime.utcnow()
                 db.session.commit()
+                cls._refresh_summary(user_id)
                 return {"success": True, "message": "Item removed from cart"}
             else:
                 # Update quantity
                 cart_item.quantity = quantity
                 db.session.commit()
+                cls._refresh_summary(user_id)
                 return {"success": True, "message": "Cart updated"}
                 
         except Exception as e:
@@ -344,6 +412,7 @@ class CartItem(db.Model):
             # Soft delete the item
             cart_item.deleted_at = datetime.utcnow()
             db.session.commit()
+            cls._refresh_summary(user_id)
             return True
             
         except Exception as e:
@@ -0,0 +1,26 @@
+from extensions import db
+
+class DailySales(db.Model):
+    """Orders and revenue per day, maintained by services.sales_rollup"""
+    __tablename__ = 'daily_sales'
+    
+    date = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)  # Amount in VND
+    
+    def __repr__(self):
+        return f'<DailySales {self.date}: {self.order_count}>'
+
+class DailyProductSales(db.Model):
+    """Units and revenue per product per day, maintained by services.sales_rollup"""
+    __tablename__ = 'daily_product_sales'
+    
+    date = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)  # Amount in VND
+    
+    product = db.relationship('Product', lazy=True)
+    
+    def __repr__(self):
+        return f'<DailyProductSales {self.date} {self.product_id}: {self.quantity}>'
@@ -0,0 +1,59 @@
+"""
+Set-based relationship loading for lists of already-queried model instances
+
+These helpers do what selectinload does for a query, but for instances that
+were loaded elsewhere (e.g. a paginated page): one IN query per relationship,
+with the results stored as the relationship's loaded value.
+"""
+from collections import defaultdict
+from sqlalchemy.orm.attributes import set_committed_value
+from extensions import db
+
+
+def _needs_load(obj, attr):
+    state = db.inspect(obj)
+    return state.persistent and attr in state.unloaded
+
+
+def load_collection(instances, attr, model, foreign_key, order_by=()):
+    """
+    Populate a one-to-many relationship on many instances with one query
+
+    Args:
+        instances: Parent instances
+        attr: Name of the relationship on the parent
+        model: Child model class
+        foreign_key: Child column pointing at the parent's id
+        order_by: Ordering applied to each parent's children
+    """
+    pending = [obj for obj in instances if _needs_load(obj, attr)]
+    if not pending:
+        return
+    ids = {obj.id for obj in pending}
+    rows = model.query.filter(foreign_key.in_(ids)).order_by(*order_by).all()
+
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[getattr(row, foreign_key.key)].append(row)
+    for obj in pending:
+        set_committed_value(obj, attr, grouped.get(obj.id, []))
+
+
+def load_reference(instances, attr, model, foreign_key_attr):
+    """
+    Populate a many-to-one relationship on many instances with one query
+
+    Args:
+        instances: Child instances
+        attr: Name of the relationship on the child
+        model: Referenced model class
+        foreign_key_attr: Name of the child's foreign key attribute
+    """
+    pending = [obj for obj in instances
+               if _needs_load(obj, attr) and getattr(obj, foreign_key_attr) is not None]
+    if not pending:
+        return
+    ids = {getattr(obj, foreign_key_attr) for obj in pending}
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+    for obj in pending:
+        set_committed_value(obj, attr, rows.get(getattr(obj, foreign_key_attr)))
@@ -1,8 +1,13 @@
 from datetime import datetime
-from extensions import db, socketio
+from extensions import db
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Latest notifications per user, and unread ones per user
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notifications_user_read_created', 'user_id', 'is_read', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -22,19 +27,10 @@ class Notification(db.Model):
             link=link
         )
         db.session.add(notification)
+        # The unread counter and socket event follow the commit (services.unread_notifications)
         db.session.commit()
-
-        # Emit WebSocket event
-        socketio.emit('notification', {
-            'unreadCount': Notification.query.filter_by(user_id=user_id, is_read=False).count()
-        }, room=f'user_{user_id}')
         return notification
 
     def mark_as_read(self):
         self.is_read = True
-        db.session.commit()
-
-        # Emit WebSocket event with updated unread count
-        socketio.emit('notification', {
-            'unreadCount': Notification.query.filter_by(user_id=self.user_id, is_read=False).count()
-        }, room=f'user_{self.user_id}')
\ No newline at end of file
+        db.session.commit()
\ No newline at end of file
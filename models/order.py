@@ -44,6 +44,14 @@ class OrderStatus(Enum):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # A user's orders newest first; admin listing filtered by status and date
+        db.Index('ix_orders_user_created', 'user_id', 'created_at'),
+        db.Index('ix_orders_status_created', 'status', 'created_at'),
+        db.Index('ix_orders_created', 'created_at'),
+        # Orders changed since the analytics arrays were last read
+        db.Index('ix_orders_updated', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -69,6 +77,13 @@ class Order(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # When this order's items were added to the product popularity ranking
+    popularity_recorded_at = db.Column(db.DateTime, nullable=True)
+    # Stock taken at checkout; unpaid PayOS orders release it after expiry
+    stock_reserved = db.Column(db.Boolean, nullable=False, default=False)
+    reservation_expires_at = db.Column(db.DateTime, nullable=True, index=True)
+    # When a payment reconciler last took this order for a PayOS check
+    reconcile_claimed_at = db.Column(db.DateTime, nullable=True)
     
     # Add shipping information fields
     shipping_first_name = db.Column(db.String(100))
@@ -125,7 +140,29 @@ class Order(db.Model):
         self.status = new_status
         self.updated_at = datetime.utcnow()
     
+    @classmethod
+    def preload(cls, orders):
+        """
+        Load items, their products and the products' relationships for many
+        orders, with one set-based query per relationship
+        """
+        from models.product import Product
+        from models.loading import load_collection, load_reference
+        
+        orders = list(orders)
+        load_collection(orders, 'items', OrderItem, OrderItem.order_id, order_by=(OrderItem.id,))
+        items = [item for order in orders for item in order.items]
+        load_reference(items, 'product', Product, 'product_id')
+        Product.preload([item.product for item in items])
+        return orders
+    
+    @classmethod
+    def to_dict_many(cls, orders):
+        """Serialize many orders with a fixed number of queries"""
+        return [order.to_dict() for order in cls.preload(orders)]
+    
     def to_dict(self):
+        Order.preload([self])
         vietnam_created = to_vietnam_time(self.created_at)
         vietnam_updated = to_vietnam_time(self.updated_at)
         
@@ -158,7 +195,7 @@ class Order(db.Model):
             'checkout_url': self.checkout_url,
             'notes': self.notes,
             'item_count': self.item_count,
-            'items': [item.to_dict() for item in self.items],
+            'items': [item.to_dict(created_at=vietnam_created) for item in self.items],
             'created_at': vietnam_created.isoformat(),
             'updated_at': vietnam_updated.isoformat(),
             'created_at_local': vietnam_created.strftime('%B %d, %Y at %I:%M %p'),
@@ -172,8 +209,8 @@ class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Float, nullable=False)
     size = db.Column(db.String(20), nullable=True)
@@ -191,8 +228,9 @@ class OrderItem(db.Model):
         """Calculate subtotal in VND"""
         return self.quantity * self.price
     
-    def to_dict(self):
-        vietnam_created = to_vietnam_time(self.created_at)
+    def to_dict(self, created_at=None):
+        # Items have no timestamp of their own; they are created with the order
+        vietnam_created = created_at or to_vietnam_time(self.order.created_at)
         return {
             'id': self.id,
             'product': self.product.to_dict(),
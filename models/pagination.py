@@ -0,0 +1,243 @@
+"""
+Keyset (seek) pagination for listing queries
+
+paginate() counts every matching row and skips OFFSET rows, so deep pages
+get slower the further in they are. Keyset pagination instead remembers the
+sort key of the last row shown in an opaque cursor token and asks for the
+rows after it, which an index on the sort columns answers directly.
+
+The sort key must end in a unique column (normally the primary key) so that
+every row has a distinct position.
+
+Given a count_key, totals come from services.count_cache instead of a
+COUNT(*) per request, and may lag behind by up to the cache TTL.
+"""
+import base64
+import json
+import math
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+MAX_PER_PAGE = 100  # same cap as Flask-SQLAlchemy's paginate()
+
+
+def encode_cursor(direction, values):
+    """Pack a direction ('next' or 'prev') and sort key values into a token"""
+    payload = [direction[0]] + [
+        {'dt': value.isoformat()} if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, key_count):
+    """
+    Unpack a cursor token
+
+    Returns:
+        tuple: (direction, values), or (None, None) for a missing or
+               malformed token, which starts from the first page
+    """
+    if not token:
+        return None, None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+        direction = {'n': 'next', 'p': 'prev'}[payload[0]]
+        values = [datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value
+                  for value in payload[1:]]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None, None
+    if len(values) != key_count:
+        return None, None
+    return direction, values
+
+
+def _seek(keys, values, backwards):
+    """Rows strictly after (or before) the given key in the sort order"""
+    clauses = []
+    for i, (expr, descending) in enumerate(keys):
+        comparison = expr > values[i] if descending == backwards else expr < values[i]
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, comparison))
+    return or_(*clauses)
+
+
+class KeysetPage:
+    """
+    One page of keyset pagination
+
+    Mirrors the parts of Flask-SQLAlchemy's Pagination that the templates
+    use, with cursors in place of page numbers. The total is only counted
+    when asked for.
+    """
+
+    page = None
+    prev_num = None
+    next_num = None
+
+    def __init__(self, query, items, per_page, prev_cursor, next_cursor, count=None):
+        self._count = count or query.order_by(None).count
+        self.items = items
+        self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.total_estimated = count is not None
+        self._total = None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def total(self):
+        """Number of matching rows, counted or looked up on first access"""
+        if self._total is None:
+            self._total = self._count()
+        return self._total
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page))
+
+    def iter_pages(self, *args, **kwargs):
+        """Page numbers don't apply to cursors"""
+        return iter(())
+
+    def to_dict(self):
+        """Cursor fields for JSON responses"""
+        return {
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'per_page': self.per_page
+        }
+
+
+def keyset_paginate(query, keys, cursor=None, per_page=20, count=None):
+    """
+    Get one page of a query by seeking past a cursor
+
+    Args:
+        query: Filtered query; any existing ordering is replaced
+        keys: list of (column or expression, descending) pairs ending in a
+              unique column, e.g. [(Product.name, False), (Product.id, False)]
+        cursor: Token from a previous page's next_cursor or prev_cursor
+        per_page: Rows per page
+        count: Optional callable giving the total instead of a COUNT query
+    """
+    direction, values = decode_cursor(cursor, len(keys))
+    backwards = direction == 'prev'
+
+    ordered = query.order_by(None).order_by(*[
+        expr.desc() if descending != backwards else expr.asc()
+        for expr, descending in keys
+    ])
+    if values is not None:
+        ordered = ordered.filter(_seek(keys, values, backwards))
+
+    rows = ordered.add_columns(*[expr.label(f'_key{i}') for i, (expr, _) in enumerate(keys)])\
+        .limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    key_values = [list(row[1:]) for row in rows]
+    # Going forward there is more after this page if we over-fetched, and a
+    # previous page if we came from a cursor; going back it is the reverse
+    has_next = (values is not None) if backwards else more
+    has_prev = more if backwards else (values is not None)
+    return KeysetPage(
+        query,
+        items,
+        per_page,
+        prev_cursor=encode_cursor('prev', key_values[0]) if has_prev and rows else None,
+        next_cursor=encode_cursor('next', key_values[-1]) if has_next and rows else None,
+        count=count
+    )
+
+
+def _cached_count(query, key):
+    from services.count_cache import count_cache
+    return lambda: count_cache.get(key, query.order_by(None).count)
+
+
+def offset_paginate(query, page, per_page, count_key=None, error_out=True):
+    """
+    paginate() in the query's own order, with the total from the count cache
+    when a count_key is given
+    """
+    if count_key is None:
+        return query.paginate(page=page, per_page=per_page, max_per_page=MAX_PER_PAGE, error_out=error_out)
+    pagination = query.paginate(page=page, per_page=per_page, max_per_page=MAX_PER_PAGE,
+                                error_out=error_out, count=False)
+    pagination.total = _cached_count(query, count_key)()
+    pagination.total_estimated = True
+    return pagination
+
+
+def paginate(query, keys, per_page, count_key=None):
+    """
+    Paginate a listing by cursor or by page number
+
+    Requests with a cursor argument, or without a page argument when
+    PAGINATION_MODE is 'keyset', get a KeysetPage; requests with a page
+    number get the usual paginate() result, in the same order.
+
+    Args:
+        count_key: services.count_cache.count_key() for the listing's
+                   filters, to take the total from the cache
+    """
+    per_page = min(per_page, MAX_PER_PAGE)
+    cursor = request.args.get('cursor')
+    page = request.args.get('page', type=int)
+    if cursor is not None or (page is None and current_app.config.get('PAGINATION_MODE') == 'keyset'):
+        count = _cached_count(query, count_key) if count_key is not None else None
+        return keyset_paginate(query, keys, cursor=cursor, per_page=per_page, count=count)
+
+    ordered = query.order_by(None).order_by(*[
+        expr.desc() if descending else expr.asc() for expr, descending in keys
+    ])
+    return offset_paginate(ordered, page or 1, per_page, count_key, error_out=False)
+
+
+def page_args(pagination, direction):
+    """
+    URL arguments for the previous or next page, for either kind of page
+
+    Used in templates as url_for(..., **page_args(products, 'next')).
+    """
+    if isinstance(pagination, KeysetPage):
+        return {'cursor': pagination.prev_cursor if direction == 'prev' else pagination.next_cursor}
+    return {'page': pagination.prev_num if direction == 'prev' else pagination.next_num}
+
+
+def pagination_json(pagination):
+    """
+    Paging fields for JSON responses
+
+    Keyset pages include the total when it is cached or on ?total=1;
+    total_estimated marks totals that come from the count cache.
+    """
+    estimated = getattr(pagination, 'total_estimated', False)
+    if isinstance(pagination, KeysetPage):
+        data = pagination.to_dict()
+        if estimated or request.args.get('total') == '1':
+            data['total'] = pagination.total
+            data['total_estimated'] = estimated
+        return data
+    return {
+        'total': pagination.total,
+        'total_estimated': estimated,
+        'pages': pagination.pages,
+        'current_page': pagination.page
+    }
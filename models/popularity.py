@@ -0,0 +1,27 @@
+from extensions import db
+from datetime import datetime
+
+class ProductPopularity(db.Model):
+    """Precomputed sales ranking, maintained by services.popularity"""
+    __tablename__ = 'product_popularity'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    # Ranking score: quantity sold, time-weighted when decay is enabled
+    score = db.Column(db.Float, nullable=False, default=0)
+    # Decay epoch whose scale the score is on
+    score_epoch = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_product_popularity_score', 'score', 'order_count'),
+        db.Index('ix_product_popularity_category_score', 'category_id', 'score', 'order_count'),
+        db.Index('ix_product_popularity_score_epoch', 'score_epoch'),
+    )
+    
+    product = db.relationship('Product', lazy=True)
+    
+    def __repr__(self):
+        return f'<ProductPopularity {self.product_id}: {self.score}>'
@@ -1,5 +1,6 @@
 from extensions import db
 from datetime import datetime
+from sqlalchemy import event, func
 from sqlalchemy.ext.hybrid import hybrid_property
 
 class ProductVariant(db.Model):
@@ -7,7 +8,7 @@ class ProductVariant(db.Model):
     __table_args__ = {'extend_existing': True}
     
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
     size_id = db.Column(db.Integer, db.ForeignKey('product_sizes.id', ondelete='CASCADE'), nullable=False)
     color_id = db.Column(db.Integer, db.ForeignKey('product_colors.id', ondelete='CASCADE'), nullable=False)
     stock = db.Column(db.Integer, default=0)
@@ -22,7 +23,7 @@ class ProductSize(db.Model):
     __table_args__ = {'extend_existing': True}
     
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
     size = db.Column(db.String(20), nullable=False)
     stock = db.Column(db.Integer, nullable=False, default=0)
     
@@ -35,7 +36,7 @@ class ProductColor(db.Model):
     __table_args__ = {'extend_existing': True}
     
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True)
     color_name = db.Column(db.String(50), nullable=False)
     color_code = db.Column(db.String(20), nullable=True)
     stock = db.Column(db.Integer, nullable=False, default=0)
@@ -46,7 +47,13 @@ class ProductColor(db.Model):
 
 class Product(db.Model):
     __tablename__ = 'products'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Catalog filters: active products in a category within a price range
+        db.Index('ix_products_active_category_price', 'is_active', 'category_id', 'price'),
+        # Newest active products on the home page
+        db.Index('ix_products_active_created', 'is_active', 'created_at'),
+        {'extend_existing': True}
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -55,6 +62,8 @@ class Product(db.Model):
     price = db.Column(db.BigInteger, nullable=False)
     discount_price = db.Column(db.BigInteger, nullable=True)  # Price after discount in VND
     stock = db.Column(db.Integer, default=0)  # Total stock across all sizes for sized products
+    # Kept in step with stock (and option rows) by sync_stock on every flush
+    in_stock = db.Column(db.Boolean, nullable=False, default=False, index=True)
     image_url = db.Column(db.String(500))  # Kept for backward compatibility
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False)
     sku = db.Column(db.String(50), unique=True)
@@ -100,47 +109,55 @@ class Product(db.Model):
             return self.image_url
         return 'images/placeholder.jpg'  # Default placeholder
     
+    @classmethod
+    def sync_stock(cls, connection, product_ids):
+        """
+        Recompute stock and in_stock for products with set-based UPDATEs
+        
+        Products stocked per size, color or variant get the sum of those rows;
+        every product gets in_stock = stock > 0. Runs on the given connection
+        so it can be used inside a flush or a Core transaction.
+        """
+        product_ids = set(product_ids)
+        if not product_ids:
+            return
+        products = cls.__table__
+        # Option table whose rows make up the stock of each inventory type
+        sources = {
+            'size': ProductSize.__table__,
+            'color': ProductColor.__table__,
+            'both': ProductVariant.__table__
+        }
+        for inventory_type, table in sources.items():
+            total = db.select(func.coalesce(func.sum(table.c.stock), 0))\
+                .where(table.c.product_id == products.c.id).scalar_subquery()
+            connection.execute(
+                products.update()
+                .where(products.c.id.in_(product_ids), products.c.inventory_type == inventory_type)
+                .values(stock=total)
+            )
+        connection.execute(
+            products.update()
+            .where(products.c.id.in_(product_ids))
+            .values(in_stock=func.coalesce(products.c.stock, 0) > 0)
+        )
+    
     def recalculate_stock(self):
         """
         Recalculate total stock based on inventory type and variants
-        Should be called after modifying variants
+        
+        Stock is recomputed on every flush that touches the product or its
+        options; this flushes pending changes and returns the result.
         """
-        if self.inventory_type == 'regular':
-            # Regular products use direct stock field, no calculation needed
-            return self.stock
-            
-        if self.inventory_type == 'size':
-            # Sum stock from all size variants
-            total = sum(size.stock for size in self.sizes)
-            self.stock = total
-            return total
-            
-        if self.inventory_type == 'color':
-            # Sum stock from all color variants
-            total = sum(color.stock for color in self.colors)
-            self.stock = total
-            return total
-            
-        if self.inventory_type == 'both':
-            # Sum stock from all size/color combinations
-            total = sum(variant.stock for variant in self.variants)
-            self.stock = total
-            return total
-            
-        return 0  # Default to 0 for unknown inventory types
+        db.session.flush()
+        Product.sync_stock(db.session.connection(), [self.id])
+        db.session.expire(self, ['stock', 'in_stock'])
+        return self.stock
     
     @hybrid_property
     def is_in_stock(self):
-        """
-        Check if product has any stock available based on inventory type
-        """
-        if self.inventory_type == 'size':
-            return any(size.stock > 0 for size in self.sizes)
-        elif self.inventory_type == 'color':
-            return any(color.stock > 0 for color in self.colors)
-        elif self.inventory_type == 'both':
-            return any(variant.stock > 0 for variant in self.variants)
-        return self.stock > 0
+        """Check if product has any stock available, from the maintained flag"""
+        return self.in_stock
     
     def update_stock(self, quantity, size=None, color_id=None):
         """
@@ -201,8 +218,53 @@ class Product(db.Model):
             discount = self.price - self.discount_price
             return int((discount / self.price) * 100)
         return 0
+
+    @classmethod
+    def sort_keys(cls, sort=None):
+        """
+        Sort key for the product listings, as (expression, descending) pairs
+        ending in the primary key so keyset pagination has a unique position
+
+        'category' sorts by Category.name, so the query must join categories.
+        """
+        from models.category import Category
+        leading = {
+            'name': [(cls.name, False)],
+            'price': [(cls.price, False)],
+            'stock': [(func.coalesce(cls.stock, 0), False)],
+            'category': [(Category.name, False)]
+        }.get(sort, [])
+        return leading + [(cls.id, False)]
+
+    @classmethod
+    def preload(cls, products):
+        """
+        Load the relationships used by to_dict for many products at once
+        
+        Issues at most one query per relationship, however many products are
+        passed, instead of lazy loading them product by product.
+        """
+        from models.category import Category
+        from models.product_image import ProductImage
+        from models.loading import load_collection, load_reference
+        
+        products = [p for p in products if p is not None]
+        load_collection(products, 'images', ProductImage, ProductImage.product_id,
+                        order_by=(ProductImage.is_primary.desc(), ProductImage.id))
+        load_reference(products, 'category', Category, 'category_id')
+        load_collection(products, 'colors', ProductColor, ProductColor.product_id,
+                        order_by=(ProductColor.id,))
+        load_collection([p for p in products if p.has_sizes or p.inventory_type == 'size'],
+                        'sizes', ProductSize, ProductSize.product_id, order_by=(ProductSize.id,))
+        return products
+    
+    @classmethod
+    def to_dict_many(cls, products):
+        """Serialize many products with a fixed number of queries"""
+        return [product.to_dict() for product in cls.preload(products)]
     
     def to_dict(self):
+        primary_image = self.primary_image
         data = {
             'id': self.id,
             'name': self.name,
@@ -212,14 +274,8 @@ class Product(db.Model):
             'has_discount': self.has_discount,
             'discount_price': self.discount_price,
             'original_price_display': self.original_price_display,
-            'stock': (
-                sum(v.stock for v in self.variants) if self.inventory_type == 'both' else (
-                    sum(c.stock for c in self.colors) if self.inventory_type == 'color' else (
-                        sum(s.stock for s in self.sizes) if self.inventory_type == 'size' else self.stock
-                    )
-                )
-            ),
-            'image_url': self.primary_image.image_url if self.primary_image else self.image_url,
+            'stock': self.stock,
+            'image_url': primary_image.image_url if primary_image else self.image_url,
             'images': [{'id': img.id, 'url': img.image_url, 'is_primary': img.is_primary}
                       for img in self.images] if self.images else [],
             'category_id': self.category_id,
@@ -260,4 +316,36 @@ class Product(db.Model):
         return Review.query.filter_by(product_id=self.id, user_id=user_id).first() is not None
     
     def __repr__(self):
-        return f'<Product {self.name}>'
\ No newline at end of file
+        return f'<Product {self.name}>'
+
+
+# Option rows and product fields that feed Product.stock / in_stock
+_STOCK_ATTRS = ('stock', 'inventory_type')
+
+
+@event.listens_for(db.session, 'after_flush')
+def sync_flushed_stock(session, flush_context):
+    """Recompute stock for products whose stock or option rows were flushed"""
+    product_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (ProductVariant, ProductSize, ProductColor)):
+            product_ids.add(obj.product_id)
+        elif isinstance(obj, Product) and obj not in session.deleted:
+            state = db.inspect(obj)
+            if obj in session.new or any(state.attrs[attr].history.has_changes() for attr in _STOCK_ATTRS):
+                product_ids.add(obj.id)
+    product_ids.discard(None)
+    if product_ids:
+        Product.sync_stock(session.connection(), product_ids)
+        session.info.setdefault('stock_synced', set()).update(product_ids)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def expire_synced_stock(session, flush_context):
+    """Make products reload the stock written by sync_stock"""
+    product_ids = session.info.pop('stock_synced', None)
+    if not product_ids:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Product) and db.inspect(obj).identity[0] in product_ids:
+            session.expire(obj, ['stock', 'in_stock'])
@@ -18,6 +18,8 @@ class Review(db.Model):
     # Ensure one review per product per order per user
     __table_args__ = (
         db.UniqueConstraint('user_id', 'product_id', 'order_id', name='unique_review_per_order'),
+        # A product's reviews newest first
+        db.Index('ix_review_product_created', 'product_id', 'created_at'),
     )
 
     def __init__(self, user_id, product_id, order_id, rating, comment):
@@ -35,6 +35,8 @@ class User(UserMixin, db.Model):
 
     # Administrative
     is_admin = db.Column(db.Boolean, default=False)
+    # Unread notifications, kept in step by services.unread_notifications
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
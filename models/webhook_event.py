@@ -0,0 +1,33 @@
+from extensions import db
+from datetime import datetime
+
+class WebhookEvent(db.Model):
+    """Payment webhook received from PayOS, processed by services.webhook_inbox"""
+    __tablename__ = 'webhook_events'
+    
+    PENDING = 'pending'      # Waiting for a worker
+    PROCESSED = 'processed'  # Order status changed by this event
+    SKIPPED = 'skipped'      # Nothing to change: order missing or already moved on
+    FAILED = 'failed'        # Raised an error; retried until MAX_ATTEMPTS
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_code = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    # '' rather than NULL so deliveries without one still collide on the unique key
+    transaction_id = db.Column(db.String(100), nullable=False, default='')
+    amount = db.Column(db.BigInteger)
+    payload = db.Column(db.Text, nullable=False)  # Raw JSON body as delivered
+    state = db.Column(db.String(20), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    deliveries = db.Column(db.Integer, nullable=False, default=1)  # Including duplicates
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.UniqueConstraint('order_code', 'status', 'transaction_id', name='uq_webhook_events_delivery'),
+        db.Index('ix_webhook_events_state_received', 'state', 'received_at'),
+    )
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.id}: {self.order_code} {self.status} {self.state}>'
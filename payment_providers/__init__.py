@@ -4,4 +4,4 @@ Currently supports:
 - PayOS
 """
 
-from .payos import PayOSAPI
\ No newline at end of file
+from .payos import PayOSAPI, get_payos_api
\ No newline at end of file
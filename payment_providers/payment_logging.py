@@ -0,0 +1,113 @@
+"""
+Non-blocking, redacted logging for the payment code
+
+The payment loggers hand their records to an in-memory queue through a
+QueueHandler. A QueueListener on its own thread writes them out, so a
+request only pays for merging the message and putting it on the queue.
+Under eventlet the listener gets a real OS thread and an unpatched queue,
+so a slow terminal or log file can't block the hub.
+
+Records are redacted before they are queued: the configured PayOS keys are
+masked wherever they appear, and so are the values of signature and API key
+fields.
+"""
+import atexit
+import logging
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# Loggers routed through the queue; their records don't propagate to the root logger
+PAYMENT_LOGGERS = (
+    'payment_providers',
+    'services.webhook_inbox',
+    'services.payment_reconciler'
+)
+SECRET_SETTINGS = ('PAYOS_SECRET_KEY', 'PAYOS_API_KEY')
+DEFAULT_LEVEL = 'INFO'
+FORMAT = '%(asctime)s %(levelname)s %(name)s %(threadName)s %(message)s'
+
+REDACTED = '[REDACTED]'
+# signature=..., 'x-api-key': '...', "secret_key": "..." in messages, reprs and JSON
+_SENSITIVE_FIELD = re.compile(
+    r"""(?P<key>["']?(?:x-)?(?:signature|api[-_]key|secret[-_]key|checksum[-_]key)["']?\s*[:=]\s*["']?)[^"',&\s}]+""",
+    re.IGNORECASE
+)
+
+_listener = None
+
+
+def _original(module_name):
+    """A stdlib module as it was before any eventlet monkey-patching"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return __import__(module_name)
+    return patcher.original(module_name)
+
+
+def redact(text, secrets=()):
+    text = _SENSITIVE_FIELD.sub(lambda match: match.group('key') + REDACTED, text)
+    for secret in secrets:
+        text = text.replace(secret, REDACTED)
+    return text
+
+
+class RedactingQueueHandler(QueueHandler):
+    """QueueHandler that masks secrets once the message and traceback are merged"""
+
+    def __init__(self, queue, secrets=()):
+        super().__init__(queue)
+        self.secrets = [secret for secret in secrets if secret]
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.msg = redact(record.msg, self.secrets)
+        return record
+
+
+class _Listener(QueueListener):
+    def start(self):
+        self._thread = _original('threading').Thread(target=self._monitor, name='payment-log', daemon=True)
+        self._thread.start()
+
+
+def stop_payment_logging():
+    """Write out what is still queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def init_payment_logging(app):
+    """
+    Route the payment loggers through the queue
+
+    Output goes to stderr at PAYMENT_LOG_LEVEL and to the app logger's own
+    handlers (app.log in production) at their levels.
+    """
+    global _listener
+    stop_payment_logging()
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter(FORMAT))
+    from flask.logging import default_handler
+    handlers = [stream] + [handler for handler in app.logger.handlers if handler is not default_handler]
+
+    log_queue = _original('queue').SimpleQueue()
+    queue_handler = RedactingQueueHandler(log_queue, [app.config.get(name) for name in SECRET_SETTINGS])
+    level = str(app.config.get('PAYMENT_LOG_LEVEL') or DEFAULT_LEVEL).upper()
+    for name in PAYMENT_LOGGERS:
+        logger = logging.getLogger(name)
+        for handler in [h for h in logger.handlers if isinstance(h, RedactingQueueHandler)]:
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+    _listener = _Listener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(stop_payment_logging)
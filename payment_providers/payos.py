@@ -1,15 +1,82 @@
 import hmac
 import hashlib
-import json
+import logging
+import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from flask import current_app
 
+DEFAULT_BASE_URL = "https://api-merchant.payos.vn/v2"
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session(config):
+    """
+    HTTP session with a bounded keep-alive pool and retries
+
+    Connection failures are retried for every call since nothing reached
+    PayOS. Read errors and 429/5xx answers are only retried for GET, the one
+    call that is safe to repeat.
+    """
+    retry = Retry(
+        total=config.get('PAYOS_RETRIES', 3),
+        backoff_factor=config.get('PAYOS_RETRY_BACKOFF', 0.25),
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,  # one host
+        pool_maxsize=config.get('PAYOS_POOL_SIZE', 10),
+        max_retries=retry
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept': 'application/json'})
+    return session
+
+
+def get_session():
+    """The worker's shared PayOS session, rebuilt after a fork"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                # A pool inherited from the parent process shares its sockets
+                _session = _build_session(current_app.config)
+                _session_pid = pid
+    return _session
+
+
+def get_payos_api():
+    """PayOSAPI for the current app, created once per app"""
+    api = current_app.extensions.get('payos')
+    if api is None:
+        api = current_app.extensions['payos'] = PayOSAPI()
+    return api
+
+
 class PayOSAPI:
     """PayOS payment integration"""
     
-    def __init__(self):
-        """Initialize PayOS payment with config validation"""
+    def __init__(self, session=None):
+        """
+        Initialize PayOS payment with config validation
+
+        Args:
+            session: requests session to use instead of the worker's shared one
+        """
         required_configs = [
             'PAYOS_CLIENT_ID',
             'PAYOS_API_KEY',
@@ -22,14 +89,29 @@ class PayOSAPI:
         
         if missing_configs:
             error_msg = f"Missing PayOS configurations: {', '.join(missing_configs)}"
-            current_app.logger.error(error_msg)
+            logger.error(error_msg)
             raise ValueError(error_msg)
             
         self.client_id = current_app.config['PAYOS_CLIENT_ID']
         self.api_key = current_app.config['PAYOS_API_KEY']
         self.secret_key = current_app.config['PAYOS_SECRET_KEY']
-        self.base_url = "https://api-merchant.payos.vn/v2"  # Changed back to correct endpoint
+        self._secret = self.secret_key.encode('utf-8')
+        self.base_url = current_app.config.get('PAYOS_BASE_URL') or DEFAULT_BASE_URL
         self.api_endpoint = f"{self.base_url}/payment-requests"
+        self._session = session
+        # (connect, read): fail fast when PayOS is unreachable, wait longer for an answer
+        self.timeout = (current_app.config.get('PAYOS_CONNECT_TIMEOUT', 3.05),
+                        current_app.config.get('PAYOS_READ_TIMEOUT', 20))
+
+    @property
+    def session(self):
+        """
+        The session given to the constructor, else the worker's shared one
+
+        Looked up per call: the instance is cached on the app and may have
+        been created before the worker forked.
+        """
+        return self._session or get_session()
 
     def create_payment(self, order_id: str, amount: int, description: str) -> dict:
         """
@@ -65,15 +147,23 @@ class PayOSAPI:
                 
             request_id = f"REQ_{datetime.now().strftime('%Y%m%d%H%M%S')}_{order_id}"
             
-            # Prepare consistent description
             # Use consistent description format
             description = f"Order #{order_id}"
             cancel_url = f"{current_app.config['BASE_URL']}/payment/cancel"
             return_url = f"{current_app.config['BASE_URL']}/payment/success"
             
+            # Signed once; sent in the payload and the x-signature header
+            signature = self._sign({
+                'amount': amount,
+                'cancelUrl': cancel_url,
+                'description': description,
+                'orderCode': order_id_int,
+                'returnUrl': return_url
+            })
+            
             # Prepare payment data with required fields
             payment_data = {
-                "orderCode": int(order_id),  # PayOS requires this to be a number
+                "orderCode": order_id_int,  # PayOS requires this to be a number
                 "amount": amount,
                 "description": description,
                 "returnUrl": return_url,
@@ -82,68 +172,14 @@ class PayOSAPI:
                     "name": description,
                     "price": amount,
                     "quantity": 1
-                }]
+                }],
+                "signature": signature
             }
+            logger.debug("PayOS create_payment request order=%s payload=%s", order_id, payment_data)
 
-            # Create string for signature in specific order
-            # Create dictionary of fields to ensure consistent sorting
-            fields = {
-                'amount': str(amount),
-                'cancelUrl': cancel_url,
-                'description': description,
-                'orderCode': int(order_id),  # Convert to number for signature generation
-                'returnUrl': return_url
-            }
-            # Sort by keys and concatenate values
-            # Build signature string with key=value pairs in alphabetical order, separated by &
-            signature_string = '&'.join(f"{key}={str(fields[key])}" for key in sorted(fields))
-            
-            print("\n🔍 Chi tiết tạo chữ ký:")
-            print("1. Các trường theo thứ tự:")
-            print(f"   - amount: {amount}")
-            print(f"   - cancelUrl: {cancel_url}")
-            print(f"   - description: {description}")
-            print(f"   - orderCode: {order_id}")
-            print(f"   - returnUrl: {return_url}")
-            print("2. Chuỗi ký sau khi sắp xếp:", signature_string)
-            print("   Thứ tự trường:", ", ".join(sorted(fields.keys())))
-            print("3. Secret key:", self.secret_key)
-            
-            # Generate signature using concatenated string
-            signature = hmac.new(
-                self.secret_key.encode('utf-8'),
-                signature_string.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
-            
-            print("4. Chữ ký tạo ra:", signature)
-            
-            # Add signature to payload
-            payment_data["signature"] = signature
-            
-            print("\n🔍 Payload gửi lên PayOS:")
-            print(json.dumps(payment_data, indent=2, ensure_ascii=False))
-
+            started = time.perf_counter()
             try:
-                # Make API request with updated headers
-                # Print request details
-                print("\n🔍 Gửi request đến PayOS:")
-                print(f"URL: {self.api_endpoint}")
-                print("Headers:", {
-                    'x-client-id': self.client_id,
-                    'x-api-key': self.api_key,
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                })
-
-                # Create signature
-                signature = hmac.new(
-                    self.secret_key.encode('utf-8'),
-                    signature_string.encode('utf-8'),
-                    hashlib.sha256
-                ).hexdigest()
-
-                response = requests.post(
+                response = self.session.post(
                     self.api_endpoint,
                     json=payment_data,
                     headers={
@@ -153,22 +189,16 @@ class PayOSAPI:
                         'Content-Type': 'application/json',
                         'Accept': 'application/json'
                     },
-                    timeout=30
+                    timeout=self.timeout
                 )
             except requests.exceptions.RequestException as e:
-                print(f"\n❌ Lỗi kết nối đến PayOS: {str(e)}")
+                logger.warning("PayOS create_payment connection error order=%s error=%s", order_id, e)
                 raise
-
-            # Log response from PayOS
-            print("\n🔍 Phản hồi từ PayOS:", response.json())
+            elapsed_ms = (time.perf_counter() - started) * 1000
 
             if not response.ok:
-                current_app.logger.error(f"""
-                PayOS API HTTP Error:
-                Status Code: {response.status_code}
-                Response: {response.text}
-                Request Payload: {json.dumps(payment_data, indent=2)}
-                """)
+                logger.error("PayOS create_payment HTTP error order=%s status=%s ms=%.0f response=%.500s",
+                             order_id, response.status_code, elapsed_ms, response.text)
                 return {
                     "success": False,
                     "error": f"Payment system error (HTTP {response.status_code})"
@@ -176,30 +206,23 @@ class PayOSAPI:
             
             try:
                 result = response.json()
-            except json.JSONDecodeError as e:
-                current_app.logger.error(f"""
-                Failed to parse PayOS response:
-                Error: {str(e)}
-                Response Text: {response.text}
-                Request Payload: {json.dumps(payment_data, indent=2)}
-                """)
+            except ValueError as e:
+                logger.error("PayOS create_payment unreadable response order=%s error=%s response=%.500s",
+                             order_id, e, response.text)
                 return {
                     "success": False,
                     "error": "Invalid response from payment server"
                 }
 
             if not isinstance(result, dict):
-                current_app.logger.error(f"""
-                Invalid PayOS response format:
-                Response: {json.dumps(result, indent=2)}
-                Request Payload: {json.dumps(payment_data, indent=2)}
-                """)
+                logger.error("PayOS create_payment unexpected response order=%s response=%.500r", order_id, result)
                 return {
                     "success": False,
                     "error": "Invalid response format from payment server"
                 }
             
             if result.get('code') == '00' and result.get('data', {}).get('checkoutUrl'):
+                logger.info("PayOS payment link created order=%s amount=%s ms=%.0f", order_id, amount, elapsed_ms)
                 return {
                     "success": True,
                     "payment_url": result['data']['checkoutUrl'],
@@ -211,11 +234,7 @@ class PayOSAPI:
             
             # Handle specific PayOS error codes
             if error_code == '231':  # PayOS error code for duplicate order
-                current_app.logger.warning(f"""
-                PayOS Duplicate Order:
-                Order ID: {order_id}
-                Error Message: {error_msg}
-                """)
+                logger.warning("PayOS duplicate order order=%s desc=%s", order_id, error_msg)
                 return {
                     "success": False,
                     "error": error_msg,
@@ -223,24 +242,15 @@ class PayOSAPI:
                     "is_duplicate": True
                 }
                 
-            current_app.logger.error(f"""
-            PayOS API Error:
-            Error Message: {error_msg}
-            Response Code: {error_code}
-            Full Response: {json.dumps(result, indent=2)}
-            Request Payload: {json.dumps(payment_data, indent=2)}
-            Signature Details:
-            - Fields Order: {", ".join(sorted(fields.keys()))}
-            - Raw String: {signature_string}
-            - Generated Signature: {signature}
-            """)
+            logger.error("PayOS create_payment rejected order=%s code=%s desc=%s ms=%.0f response=%.500r",
+                         order_id, error_code, error_msg, elapsed_ms, result)
             return {
                 "success": False,
                 "error": f"PayOS error ({error_code}): {error_msg}"
             }
 
         except Exception as e:
-            current_app.logger.error(f"PayOS payment creation error: {str(e)}")
+            logger.exception("PayOS create_payment failed order=%s error=%s", order_id, e)
             return {
                 "success": False,
                 "error": "An error occurred while creating the payment"
@@ -258,13 +268,13 @@ class PayOSAPI:
         """
         try:
             # Make API request
-            response = requests.get(
+            response = self.session.get(
                 f"{self.api_endpoint}/{payment_id}",
                 headers={
                     'x-client-id': self.client_id,
                     'x-api-key': self.api_key
                 },
-                timeout=30
+                timeout=self.timeout
             )
 
             if response.status_code == 200:
@@ -276,20 +286,20 @@ class PayOSAPI:
                     }
                 else:
                     error_msg = result.get('desc', 'Unknown PayOS error')
-                    current_app.logger.error(f"PayOS API error: {error_msg}")
+                    logger.error("PayOS get_payment_info error payment=%s desc=%s", payment_id, error_msg)
                     return {
                         "success": False,
                         "error": f"PayOS error: {error_msg}"
                     }
 
-            current_app.logger.error(f"PayOS API request failed: {response.status_code}")
+            logger.error("PayOS get_payment_info HTTP error payment=%s status=%s", payment_id, response.status_code)
             return {
                 "success": False,
                 "error": "Payment information request failed"
             }
 
         except Exception as e:
-            current_app.logger.error(f"PayOS payment info error: {str(e)}")
+            logger.error("PayOS get_payment_info failed payment=%s error=%s", payment_id, e)
             return {
                 "success": False,
                 "error": "Error retrieving payment information"
@@ -307,14 +317,14 @@ class PayOSAPI:
         """
         try:
             # Make API request
-            response = requests.post(
+            response = self.session.post(
                 f"{self.api_endpoint}/{payment_id}/cancel",
                 headers={
                     'x-client-id': self.client_id,
                     'x-api-key': self.api_key,
                     'Content-Type': 'application/json'
                 },
-                timeout=30
+                timeout=self.timeout
             )
 
             if response.status_code == 200:
@@ -326,20 +336,20 @@ class PayOSAPI:
                     }
                 else:
                     error_msg = result.get('desc', 'Unknown PayOS error')
-                    current_app.logger.error(f"PayOS API error: {error_msg}")
+                    logger.error("PayOS cancel_payment error payment=%s desc=%s", payment_id, error_msg)
                     return {
                         "success": False,
                         "error": f"PayOS error: {error_msg}"
                     }
 
-            current_app.logger.error(f"PayOS API request failed: {response.status_code}")
+            logger.error("PayOS cancel_payment HTTP error payment=%s status=%s", payment_id, response.status_code)
             return {
                 "success": False,
                 "error": "Payment cancellation failed"
             }
 
         except Exception as e:
-            current_app.logger.error(f"PayOS payment cancellation error: {str(e)}")
+            logger.error("PayOS cancel_payment failed payment=%s error=%s", payment_id, e)
             return {
                 "success": False,
                 "error": "Error cancelling payment"
@@ -371,54 +381,22 @@ class PayOSAPI:
             return hmac.compare_digest(signature, calculated_signature)
             
         except Exception as e:
-            current_app.logger.error(f"PayOS webhook verification error: {str(e)}")
+            logger.error("PayOS webhook verification failed error=%s", e)
             return False
 
+    def _sign(self, fields: dict) -> str:
+        """HMAC-SHA256 of the fields as key=value pairs in key order, joined by &"""
+        data = '&'.join(f"{key}={fields[key]}" for key in sorted(fields))
+        return hmac.new(self._secret, data.encode('utf-8'), hashlib.sha256).hexdigest()
+
     def _generate_signature(self, order_id: str, amount: int) -> str:
         """
         Generate signature for payment request according to PayOS specification
-        using JSON-based signature generation
         """
-        try:
-            cancel_url = f"{current_app.config['BASE_URL']}/payment/payment-result"
-            return_url = f"{current_app.config['BASE_URL']}/payment/payment-result"
-            description = f"Payment for order {order_id}"
-            
-            # Create string for signature in specific order
-            # Create dictionary of fields to ensure consistent sorting
-            fields = {
-                'amount': str(amount),
-                'cancelUrl': cancel_url,
-                'description': description,
-                'orderCode': int(order_id),  # Convert to number for signature generation
-                'returnUrl': return_url
-            }
-            # Sort by keys and concatenate values
-            # Build signature string with key=value pairs in alphabetical order, separated by &
-            signature_string = '&'.join(f"{key}={str(fields[key])}" for key in sorted(fields))
-            
-            print("\n🔍 Chi tiết tạo chữ ký:")
-            print("1. Các trường theo thứ tự:")
-            print(f"   - amount: {amount}")
-            print(f"   - cancelUrl: {cancel_url}")
-            print(f"   - description: {description}")
-            print(f"   - orderCode: {order_id}")
-            print(f"   - returnUrl: {return_url}")
-            print("2. Chuỗi ký sau khi sắp xếp:", signature_string)
-            print("   Thứ tự trường:", ", ".join(sorted(fields.keys())))
-            print("3. Secret key:", self.secret_key)
-            
-            # Generate HMAC SHA256 signature
-            signature = hmac.new(
-                self.secret_key.encode('utf-8'),
-                signature_string.encode('utf-8'),
-                hashlib.sha256
-            ).hexdigest()
-
-            print("4. Chữ ký tạo ra:", signature)
-            
-            return signature
-            
-        except Exception as e:
-            current_app.logger.error(f"Error generating PayOS signature: {str(e)}")
-            raise
\ No newline at end of file
+        return self._sign({
+            'amount': amount,
+            'cancelUrl': f"{current_app.config['BASE_URL']}/payment/payment-result",
+            'description': f"Payment for order {order_id}",
+            'orderCode': int(order_id),
+            'returnUrl': f"{current_app.config['BASE_URL']}/payment/payment-result"
+        })
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the PayOS merchant API
+
+Answers the three calls PayOSAPI makes (create, get and cancel payment
+requests) with PayOS-shaped JSON. HTTP/1.1 keep-alive is supported, so
+clients can reuse connections. Every new connection waits --handshake-ms
+first, standing in for the TCP and TLS round trips to
+api-merchant.payos.vn. Every request waits --latency-ms.
+
+Usage: python payos_stub_server.py [--port 8765] [--handshake-ms 60] [--latency-ms 40]
+
+Then run the app with PAYOS_BASE_URL=http://127.0.0.1:8765/v2
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PAYMENT_PATH = re.compile(r'^/v2/payment-requests/(?P<id>[^/]+)(?P<cancel>/cancel)?$')
+
+
+class PayOSStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections open between requests
+    # Headers and body go out as separate writes; with Nagle on, every
+    # keep-alive response waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+    handshake_seconds = 0.0
+    latency_seconds = 0.0
+    payments = {}
+    lock = threading.Lock()
+    connections = 0
+    requests = 0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            type(self).connections += 1
+        time.sleep(self.handshake_seconds)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _start(self):
+        with self.lock:
+            type(self).requests += 1
+        time.sleep(self.latency_seconds)
+
+    def do_POST(self):
+        self._start()
+        if self.path == '/v2/payment-requests':
+            payload = self._read_json()
+            code = payload.get('orderCode')
+            payment = {
+                'orderCode': code,
+                'amount': payload.get('amount'),
+                'status': 'PENDING',
+                'paymentLinkId': f'stub{code}',
+                'checkoutUrl': f'http://{self.headers.get("Host")}/web/stub{code}'
+            }
+            with self.lock:
+                self.payments[str(code)] = payment
+            return self._reply(200, {'code': '00', 'desc': 'success', 'data': payment})
+
+        match = _PAYMENT_PATH.match(self.path)
+        if match and match.group('cancel'):
+            self._read_json()
+            with self.lock:
+                payment = self.payments.get(match.group('id'))
+                if payment is not None:
+                    payment['status'] = 'CANCELLED'
+            if payment is None:
+                return self._reply(200, {'code': '101', 'desc': 'Payment request not found'})
+            return self._reply(200, {'code': '00', 'desc': 'success', 'data': payment})
+        self._reply(404, {'code': '404', 'desc': 'Not found'})
+
+    def do_GET(self):
+        self._start()
+        match = _PAYMENT_PATH.match(self.path)
+        payment = self.payments.get(match.group('id')) if match and not match.group('cancel') else None
+        if payment is None:
+            return self._reply(200, {'code': '101', 'desc': 'Payment request not found'})
+        self._reply(200, {'code': '00', 'desc': 'success', 'data': payment})
+
+
+def make_server(port=8765, handshake_ms=60, latency_ms=40):
+    """Stub server bound to 127.0.0.1; call serve_forever() to run it"""
+    handler = type('Handler', (PayOSStubHandler,), {
+        'handshake_seconds': handshake_ms / 1000,
+        'latency_seconds': latency_ms / 1000,
+        'payments': {},
+        'connections': 0,
+        'requests': 0
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the PayOS merchant API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--handshake-ms', type=float, default=60,
+                        help='delay for each new connection (TCP + TLS to PayOS)')
+    parser.add_argument('--latency-ms', type=float, default=40, help='delay for each request')
+    args = parser.parse_args()
+    server = make_server(args.port, args.handshake_ms, args.latency_ms)
+    print(f'PayOS stub listening on http://127.0.0.1:{args.port}/v2')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
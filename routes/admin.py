@@ -1,8 +1,21 @@
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, current_app, abort
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, current_app, abort, make_response
 from flask_login import login_required
 from extensions import db
 from models import User, Product, Order, OrderItem, Category, OrderStatus, ProductImage, ProductSize, ProductColor, ProductVariant, Notification
 from routes.auth import admin_required
+from services.category_counts import category_counts
+from services.popularity import record_order
+from services.home_cache import home_cache
+from services.cart_cache import cart_summaries
+from services.inventory import consume_order_stock
+from models.pagination import paginate
+from services.count_cache import count_cache, count_key
+from services.replica import replica_reads
+from services.sales_rollup import sales_by_day, top_products, MAX_DAYS
+from services.dashboard_stats import dashboard_stats
+from services.payment_reconciler import payment_reconciler
+from services.analytics import (sales_frames, since_days, PERIODS, revenue_by_period, order_value_summary,
+                                repeat_purchase_cohorts, category_revenue_share, product_sell_through)
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
@@ -152,13 +165,8 @@ def handle_cancellation(order_id):
 @login_required
 @admin_required
 def dashboard():
-    # Get summary statistics
-    total_users = User.query.count()
-    total_products = Product.query.count()
-    total_orders = Order.query.count()
-    
-    # Calculate total revenue
-    revenue = db.session.query(func.sum(Order.total_amount)).filter(Order.status != OrderStatus.CANCELLED).scalar() or 0
+    # Summary statistics, kept in memory by services.dashboard_stats
+    stats = dashboard_stats.get()
     
     # Get recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
@@ -170,10 +178,11 @@ def dashboard():
     ).all()
     
     return render_template('admin/dashboard.html',
-                        total_users=total_users,
-                        total_products=total_products,
-                        total_orders=total_orders,
-                        revenue=revenue,
+                        total_users=stats['total_users'],
+                        total_products=stats['total_products'],
+                        total_orders=stats['total_orders'],
+                        revenue=stats['revenue'],
+                        stats_age=stats['stale_seconds'],
                         recent_orders=recent_orders,
                         low_stock=low_stock)
 
@@ -181,8 +190,7 @@ def dashboard():
 @login_required
 @admin_required
 def manage_users():
-    page = request.args.get('page', 1, type=int)
-    users = User.query.paginate(page=page, per_page=20)
+    users = paginate(User.query, [(User.id, False)], 20, count_key=count_key('users'))
     return render_template('admin/users.html', users=users)
 
 @admin_bp.route('/users/<int:id>/toggle-status', methods=['POST'])
@@ -201,44 +209,14 @@ def toggle_user_status(id):
 @admin_bp.route('/analytics')
 @login_required
 @admin_required
+@replica_reads
 def analytics():
-    # Get date range from query parameters or default to last 30 days
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=30)
-    
-    # Sales over time
-    sales_data = db.session.query(
-        func.date(Order.created_at).label('date'),
-        func.count(Order.id).label('order_count'),
-        func.sum(Order.total_amount).label('revenue')
-    ).filter(
-        Order.created_at.between(start_date, end_date)
-    ).group_by(
-        func.date(Order.created_at)
-    ).all()
-    
-    # Top selling products
-    top_products = db.session.query(
-        Product.name,
-        func.sum(OrderItem.quantity).label('total_quantity'),
-        func.sum(OrderItem.quantity * OrderItem.price).label('total_revenue')
-    ).join(
-        OrderItem
-    ).group_by(
-        Product.id
-    ).order_by(
-        func.sum(OrderItem.quantity).desc()
-    ).limit(10).all()
+    # Sales over the last 30 days, from the daily rollups
+    sales_data = sales_by_day(30)
+    top_selling = top_products(30, limit=10)
     
     # Category distribution
-    category_data = db.session.query(
-        Category.name.label('category_name'),
-        func.count(Product.id).label('product_count')
-    ).join(
-        Product, Product.category_id == Category.id
-    ).group_by(
-        Category.id, Category.name
-    ).all()
+    category_data = [row for row in category_counts.get() if row['total_count'] > 0]
     
     # Format data for charts
     sales_chart_data = {
@@ -248,14 +226,14 @@ def analytics():
     }
     
     products_chart_data = {
-        'labels': [row.name for row in top_products],
-        'quantities': [row.total_quantity for row in top_products],
-        'revenue': [float(row.total_revenue) for row in top_products]
+        'labels': [row.name for row in top_selling],
+        'quantities': [row.total_quantity for row in top_selling],
+        'revenue': [float(row.total_revenue) for row in top_selling]
     }
     
     category_chart_data = {
-        'labels': [row.category_name for row in category_data],
-        'counts': [row.product_count for row in category_data]
+        'labels': [row['name'] for row in category_data],
+        'counts': [row['total_count'] for row in category_data]
     }
     
     return render_template('admin/analytics.html',
@@ -267,7 +245,6 @@ def analytics():
 @login_required
 @admin_required
 def manage_orders():
-    page = request.args.get('page', 1, type=int)
     status = request.args.get('status')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
@@ -291,7 +268,8 @@ def manage_orders():
         except ValueError:
             pass
     
-    orders = query.order_by(Order.created_at.desc()).paginate(page=page, per_page=20)
+    orders = paginate(query, [(Order.created_at, True), (Order.id, True)], 20,
+                      count_key=count_key('orders', status=status, start_date=start_date, end_date=end_date))
     return render_template('admin/orders.html', orders=orders, statuses=OrderStatus)
 
 @admin_bp.route('/orders/<int:id>')
@@ -312,51 +290,14 @@ def update_order_status(id):
         new_status = OrderStatus.from_string(status)
         old_status = order.status
         
-        # Check if status is changing to DELIVERED
-        if new_status == OrderStatus.DELIVERED and old_status != OrderStatus.DELIVERED:
-            # Reduce stock for each item
-            for item in order.items:
-                product = item.product
-                if product.inventory_type == 'regular':
-                    if product.stock >= item.quantity:
-                        product.stock -= item.quantity
-                        current_app.logger.info(f"Reduced stock for product {product.id} by {item.quantity}")
-                    else:
-                        product.stock = 0
-                        current_app.logger.warning(f"Product {product.id} stock reduced to 0 (requested: {item.quantity}, available: {product.stock})")
-                elif product.inventory_type == 'size':
-                    variant = ProductSize.query.get(item.size_id)
-                    if variant:
-                        if variant.stock >= item.quantity:
-                            variant.stock -= item.quantity
-                            current_app.logger.info(f"Reduced stock for product {product.id} size {variant.name} by {item.quantity}")
-                        else:
-                            variant.stock = 0
-                            current_app.logger.warning(f"Product {product.id} size {variant.name} stock reduced to 0")
-                elif product.inventory_type == 'color':
-                    variant = ProductColor.query.get(item.color_id)
-                    if variant:
-                        if variant.stock >= item.quantity:
-                            variant.stock -= item.quantity
-                            current_app.logger.info(f"Reduced stock for product {product.id} color {variant.name} by {item.quantity}")
-                        else:
-                            variant.stock = 0
-                            current_app.logger.warning(f"Product {product.id} color {variant.name} stock reduced to 0")
-                elif product.inventory_type == 'both':
-                    variant = ProductVariant.query.filter_by(
-                        product_id=product.id,
-                        size_id=item.size_id,
-                        color_id=item.color_id
-                    ).first()
-                    if variant:
-                        if variant.stock >= item.quantity:
-                            variant.stock -= item.quantity
-                            current_app.logger.info(f"Reduced stock for product {product.id} variant (size: {item.size_id}, color: {item.color_id}) by {item.quantity}")
-                        else:
-                            variant.stock = 0
-                            current_app.logger.warning(f"Product {product.id} variant stock reduced to 0")
+        # Orders placed before stock reservation take their stock on delivery
+        if new_status == OrderStatus.DELIVERED and old_status != OrderStatus.DELIVERED \
+                and not order.stock_reserved:
+            rows = consume_order_stock(order)
+            current_app.logger.info(f"Reduced stock for order {order.id} across {rows} stock rows")
 
         order.status = new_status
+        record_order(order)
         
         if status.lower() == OrderStatus.SHIPPED.value:
             order.tracking_number = request.form.get('tracking_number')
@@ -392,35 +333,36 @@ def update_order_status(id):
 @login_required
 @admin_required
 def api_stats():
-    total_users = User.query.count()
-    total_products = Product.query.count()
-    total_orders = Order.query.count()
-    revenue = db.session.query(func.sum(Order.total_amount)).scalar() or 0
-    
+    """Dashboard counters with the time and age of their last recount"""
+    stats = dashboard_stats.get()
+    stats['total_revenue'] = stats.pop('revenue')  # Revenue is already in VND
+    return jsonify(stats)
+
+@admin_bp.route('/api/cache-stats')
+@login_required
+@admin_required
+def api_cache_stats():
+    """Hit and miss counters of this worker's caches"""
     return jsonify({
-        'total_users': total_users,
-        'total_products': total_products,
-        'total_orders': total_orders,
-        'total_revenue': int(revenue)  # Revenue is already in VND
+        'home': home_cache.stats(),
+        'cart': cart_summaries.stats(),
+        'counts': count_cache.stats(),
+        'analytics': sales_frames.stats()
     })
 
+@admin_bp.route('/api/payment-reconciler')
+@login_required
+@admin_required
+def api_payment_reconciler():
+    """Lag, throughput and error rate of this worker's payment reconciler"""
+    return jsonify(payment_reconciler.stats())
+
 @admin_bp.route('/api/sales-data')
 @login_required
 @admin_required
 def api_sales_data():
-    days = request.args.get('days', 30, type=int)
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales_data = db.session.query(
-        func.date(Order.created_at).label('date'),
-        func.count(Order.id).label('order_count'),
-        func.sum(Order.total_amount).label('revenue')
-    ).filter(
-        Order.created_at.between(start_date, end_date)
-    ).group_by(
-        func.date(Order.created_at)
-    ).all()
+    days = min(max(request.args.get('days', 30, type=int), 1), MAX_DAYS)
+    sales_data = sales_by_day(days)
     
     return jsonify([{
         'date': str(row.date),
@@ -428,6 +370,72 @@ def api_sales_data():
         'revenue': float(row.revenue)
     } for row in sales_data])
 
+def _analytics_response(frame, data):
+    return jsonify({'loaded_at': frame.loaded_at.isoformat(), 'data': data})
+
+def _analytics_error(message):
+    return jsonify({'status': 'error', 'message': message}), 400
+
+def _analytics_since():
+    """Start of ?days= of history, None without it; aborts with 400 if it isn't a number"""
+    days = request.args.get('days')
+    if not days:
+        return None
+    try:
+        return since_days(int(days))
+    except ValueError:
+        abort(make_response(*_analytics_error('days must be a whole number')))
+
+@admin_bp.route('/api/analytics/revenue')
+@login_required
+@admin_required
+@replica_reads
+def api_analytics_revenue():
+    """Orders, revenue and AOV per day, week or month; ?days= limits the history"""
+    period = request.args.get('period', 'day')
+    if period not in PERIODS:
+        return _analytics_error(f"period must be one of {', '.join(PERIODS)}")
+    since = _analytics_since()
+    frame = sales_frames.get()
+    return _analytics_response(frame, revenue_by_period(frame, period, since))
+
+@admin_bp.route('/api/analytics/order-value')
+@login_required
+@admin_required
+@replica_reads
+def api_analytics_order_value():
+    since = _analytics_since()
+    frame = sales_frames.get()
+    return _analytics_response(frame, order_value_summary(frame, since))
+
+@admin_bp.route('/api/analytics/cohorts')
+@login_required
+@admin_required
+@replica_reads
+def api_analytics_cohorts():
+    months = min(max(request.args.get('months', 12, type=int), 1), 120)
+    frame = sales_frames.get()
+    return _analytics_response(frame, repeat_purchase_cohorts(frame, months))
+
+@admin_bp.route('/api/analytics/category-share')
+@login_required
+@admin_required
+@replica_reads
+def api_analytics_category_share():
+    since = _analytics_since()
+    frame = sales_frames.get()
+    return _analytics_response(frame, category_revenue_share(frame, since))
+
+@admin_bp.route('/api/analytics/sell-through')
+@login_required
+@admin_required
+@replica_reads
+def api_analytics_sell_through():
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 500)
+    since = _analytics_since()
+    frame = sales_frames.get()
+    return _analytics_response(frame, product_sell_through(frame, since, limit))
+
 @admin_bp.route('/users/<int:id>/update-password', methods=['POST'])
 @login_required
 @admin_required
@@ -559,7 +567,6 @@ def remove_discount():
 @login_required
 @admin_required
 def manage_products():
-    page = request.args.get('page', 1, type=int)
     category = request.args.get('category')
     sort = request.args.get('sort', 'name')
     search = request.args.get('search', '')
@@ -583,7 +590,6 @@ def manage_products():
         search_term = f"%{search}%"
         current_app.logger.info(f"Searching with term: '{search}', SQL LIKE pattern: '{search_term}'")
         query = query.filter(Product.name.ilike(search_term))
-        current_app.logger.info(f"Found {query.count()} products matching search term")
 
     # Apply category filter if provided
     if category:
@@ -591,22 +597,9 @@ def manage_products():
             db.func.lower(Category.name) == db.func.lower(category)
         )
         
-    # Apply sorting
-    if sort == 'name':
-        query = query.order_by(Product.name)
-    elif sort == 'price':
-        query = query.order_by(Product.price)
-    elif sort == 'stock':
-        query = query.order_by(Product.stock)
-    elif sort == 'category':
-        query = query.order_by(Category.name)
-
-    # Paginate results
-    products = query.paginate(
-        page=page,
-        per_page=current_app.config['PRODUCTS_PER_PAGE'],
-        error_out=False
-    )
+    # Sort and paginate results
+    products = paginate(query, Product.sort_keys(sort), current_app.config['PRODUCTS_PER_PAGE'],
+                        count_key=count_key('products:admin', search=search, category=category))
     
     # Get categories for filter dropdown
     categories = Category.query.order_by(Category.name).all()
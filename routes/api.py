@@ -8,6 +8,13 @@ from werkzeug.exceptions import BadRequest
 from extensions import db
 from models import Product, Cart, Order, OrderStatus, ProductColor, Review, Notification, Category
 from sqlalchemy.orm import joinedload
+from services.search import apply_search
+from models.pagination import paginate, offset_paginate, pagination_json
+from services.count_cache import count_key
+from services.replica import replica_reads
+from services.cart_cache import cart_summaries
+from services.inventory import reserve_order_stock, InsufficientStockError
+from services.unread_notifications import unread_count, mark_all_read
 from datetime import datetime
 
 api_bp = Blueprint('api', __name__)
@@ -59,6 +66,7 @@ def get_product_stock(product_id):
         return jsonify({'error': 'Error getting product stock'}), 500
 
 @api_bp.route('/products')
+@replica_reads
 def get_products():
     """Get products with optional search filter"""
     try:
@@ -80,10 +88,8 @@ def get_products():
 
         # Apply filters
         if search:
-            # Split search into terms and search each term independently
-            search_terms = search.split()
-            for term in search_terms:
-                query = query.filter(Product.name.ilike(f'%{term}%'))
+            # Ranked full-text search, best matches first
+            query = apply_search(query, search)
 
         if min_price is not None:
             query = query.filter(Product.price >= min_price)
@@ -91,21 +97,21 @@ def get_products():
             query = query.filter(Product.price <= max_price)
         if in_stock is not None:
             if in_stock == '1':
-                query = query.filter(Product.stock > 0)
+                query = query.filter(Product.in_stock == True)
             elif in_stock == '0':
-                query = query.filter(Product.stock == 0)
+                query = query.filter(Product.in_stock == False)
         if category:
             query = query.filter(Product.category == category)
 
         try:
             # Try pagination first
-            paginated = query.paginate(page=page, per_page=per_page)
+            paginated = offset_paginate(query, page, per_page, count_key(
+                'products:search', view='admin' if is_authenticated and is_admin else None, search=search,
+                min_price=min_price, max_price=max_price, in_stock=in_stock, category=category))
             return jsonify({
                 'success': True,
-                'products': [product.to_dict() for product in paginated.items],
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'current_page': paginated.page
+                'products': Product.to_dict_many(paginated.items),
+                **pagination_json(paginated)
             })
         except Exception as e:
             # If pagination fails, return first page of results
@@ -113,7 +119,7 @@ def get_products():
             products = query.limit(per_page).all()
             return jsonify({
                 'success': True,
-                'products': [product.to_dict() for product in products],
+                'products': Product.to_dict_many(products),
                 'total': len(products),
                 'pages': 1,
                 'current_page': 1
@@ -159,7 +165,8 @@ def get_cart():
         else:
             user_id = get_anonymous_user_id()
 
-        cart = Cart.get_cart_for_user(user_id)
+        # Served from the per-user summary cache when possible
+        cart = cart_summaries.get(user_id)
         
         # Handle cart items safely with nested product information
         cart_data = {
@@ -306,7 +313,7 @@ def create_order():
         # Create new order with shipping address
         order = Order(
             user_id=user_id,  # Using already extracted user_id
-            status=OrderStatus.PENDING,
+            status=OrderStatus.PENDING_PAYMENT if data.get('payment_method', 'payos') != 'cod' else OrderStatus.PROCESSING,
             total_amount=total_amount,
             shipping_address=json.dumps({
                 'first_name': shipping_address['first_name'],
@@ -337,10 +344,20 @@ def create_order():
             order_item = order.add_item(
                 product_id=item.get('product_id'),
                 quantity=item.get('quantity', 0),
-                price=item.get('price', 0)
+                price=item.get('price', 0),
+                size=item.get('size')
             )
+            order_item.color_id = item.get('color_id')
+            order_item.variant_id = item.get('variant_id')
             db.session.add(order_item)
 
+        # Take stock for the items, all or nothing
+        try:
+            reserve_order_stock(order)
+        except InsufficientStockError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e), 'product_id': e.product_id}), 409
+
         # Only clear the cart for COD payments initially
         payment_method = data.get('payment_method', 'payos')
         if payment_method == 'cod':
@@ -374,27 +391,23 @@ def get_order(order_id):
 @api_bp.route('/orders')
 @login_required
 def get_orders():
-    """Get user's orders"""
-    page = request.args.get('page', 1, type=int)
+    """Get user's orders, newest first"""
     per_page = request.args.get('per_page', 10, type=int)
     
     # Admin can see all orders, users see only their own
     # Check admin status safely for both dict and object current_user
     is_admin = getattr(current_user, 'is_admin', False) if not isinstance(current_user, dict) else current_user.get('is_admin', False)
-    if is_admin:
-        orders = Order.query.paginate(page=page, per_page=per_page)
-    else:
+    query = Order.query
+    if not is_admin:
         # Handle both object and dict current_user
         user_id = current_user['id'] if isinstance(current_user, dict) else current_user.id
-        orders = Order.query.filter_by(user_id=user_id).paginate(
-            page=page, per_page=per_page
-        )
+        query = query.filter_by(user_id=user_id)
+    orders = paginate(query, [(Order.created_at, True), (Order.id, True)], per_page,
+                      count_key=count_key('orders', user_id=None if is_admin else user_id))
     
     return jsonify({
-        'orders': [order.to_dict() for order in orders.items],
-        'total': orders.total,
-        'pages': orders.pages,
-        'current_page': orders.page
+        'orders': Order.to_dict_many(orders.items),
+        **pagination_json(orders)
     })
 
 @api_bp.route('/orders/<int:order_id>/items')
@@ -521,11 +534,7 @@ def get_notifications():
 def get_unread_count():
     """Get count of unread notifications"""
     try:
-        count = Notification.query.filter_by(
-            user_id=current_user.id,
-            is_read=False
-        ).count()
-        return jsonify({'count': count})
+        return jsonify({'count': unread_count(current_user.id)})
     except Exception as e:
         current_app.logger.error(f"Error getting unread count: {str(e)}")
         return jsonify({'error': 'Error getting unread count'}), 500
@@ -540,11 +549,23 @@ def mark_notification_read(notification_id):
             return jsonify({'error': 'Unauthorized'}), 403
             
         notification.mark_as_read()
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'unreadCount': unread_count(current_user.id)})
     except Exception as e:
         current_app.logger.error(f"Error marking notification as read: {str(e)}")
         return jsonify({'error': 'Error marking notification as read'}), 500
 
+@api_bp.route('/notifications/read-all', methods=['POST'])
+@login_required
+def mark_all_notifications_read():
+    """Mark all of the user's notifications as read"""
+    try:
+        marked = mark_all_read(current_user.id)
+        return jsonify({'success': True, 'marked': marked, 'unreadCount': 0})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error marking notifications as read: {str(e)}")
+        return jsonify({'error': 'Error marking notifications as read'}), 500
+
 
 @api_bp.route('/admin/products')
 @login_required
@@ -578,10 +599,10 @@ def get_admin_products():
         query = query.order_by(Category.name)
         
     # Paginate
-    products = query.paginate(page=page, per_page=20)
+    products = offset_paginate(query, page, 20, count_key('products:admin', search=search, category=category))
     
     return jsonify({
-        'items': [p.to_dict() for p in products.items],
+        'items': Product.to_dict_many(products.items),
         'total': products.total,
         'pages': products.pages,
         'page': products.page
@@ -618,10 +639,10 @@ def admin_products():
         query = query.order_by(Category.name)
         
     # Paginate
-    products = query.paginate(page=page, per_page=20)
+    products = offset_paginate(query, page, 20, count_key('products:admin', search=search, category=category))
     
     return jsonify({
-        'items': [p.to_dict() for p in products.items],
+        'items': Product.to_dict_many(products.items),
         'total': products.total,
         'pages': products.pages,
         'page': products.page
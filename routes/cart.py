@@ -3,6 +3,9 @@ from flask_login import login_required, current_user
 from flask_wtf.csrf import CSRFProtect
 from extensions import db
 from models import Cart, CartItem, Product, Order, OrderItem, OrderStatus
+from services.cart_cache import cart_summaries
+from services.inventory import reserve_order_stock, InsufficientStockError
+from services.payment_reconciler import supersede_pending_orders
 from datetime import datetime
 import json
 import uuid
@@ -132,11 +135,12 @@ def view_cart():
     try:
         # Ensure we get the correct user ID whether current_user is an object or dict
         user_id = current_user['id'] if isinstance(current_user, dict) else current_user.id
-        cart_data = Cart.get_cart_for_user(user_id)
         
-        # Return JSON for API requests
+        # Return JSON for API requests, served from the per-user summary cache
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.path.startswith('/api/'):
-            return jsonify(cart_data)
+            return jsonify(cart_summaries.get(user_id))
+        
+        cart_data = Cart.get_cart_for_user(user_id)
             
         # Return HTML for browser requests
         return render_template('cart/cart.html',
@@ -311,18 +315,10 @@ def checkout():
                 if not cart or not cart['items']:
                     return jsonify({'success': False, 'error': 'Your cart is empty'}), 400
                 
-                # For PayOS payments, delete all pending payment orders first
+                # For PayOS payments, hand earlier unpaid orders to the payment
+                # reconciler, which checks them with PayOS and releases their stock
                 if payment_method == 'payos':
-                    pending_orders = Order.query.filter_by(
-                        user_id=user_id, 
-                        status=OrderStatus.PENDING_PAYMENT
-                    ).all()
-                    
-                    for pending_order in pending_orders:
-                        db.session.delete(pending_order)
-                    
-                    # Commit deletions before creating new order
-                    db.session.commit()
+                    supersede_pending_orders(user_id)
                 
                 # Prepare shipping address
                 shipping_address = f"{shipping_info.get('address', '')}"
@@ -363,6 +359,15 @@ def checkout():
                     )
                     db.session.add(order_item)
                 
+                # Take stock for the items, all or nothing
+                try:
+                    reserve_order_stock(order)
+                except InsufficientStockError as e:
+                    db.session.rollback()
+                    product = Product.query.get(e.product_id)
+                    name = product.name if product else f"#{e.product_id}"
+                    return jsonify({'success': False, 'error': f"{e}: {name}"}), 409
+                
                 # Process payment based on method
                 if payment_method == 'payos':
                     # Handle PayOS payment
@@ -402,9 +407,9 @@ def checkout():
 
 # Helper function to process PayOS payments
 def process_payos_payment(order, cart, user_id):
+    order_id = order.id
     try:
-        from payment_providers.payos import PayOSAPI
-        payos = PayOSAPI()
+        from services.payment import create_payment_link
         
         # Validate required parameters before calling API
         if not order.id:
@@ -419,15 +424,9 @@ def process_payos_payment(order, cart, user_id):
                 'error': 'Invalid payment amount'
             }), 400
             
-        # Ensure amount is an integer
-        amount = int(order.total_amount)
-        
-        # Create payment request with the order
-        payment_result = payos.create_payment(
-            order_id=str(order.id),
-            amount=amount,
-            description=f"Order #{order.id}"
-        )
+        # Commits the order and its stock first, then calls PayOS with no
+        # transaction open so a slow gateway doesn't hold database locks
+        order, payment_result = create_payment_link(order)
         
         # Log entire payment result for debugging
         current_app.logger.info(f"PayOS payment response: {payment_result}")
@@ -471,8 +470,8 @@ def process_payos_payment(order, cart, user_id):
             payos_desc = payment_result.get('desc', 'No description')
             current_app.logger.error(f"PayOS payment error: {error_msg}, Code={payos_code}, Desc={payos_desc}")
             
-            # Rollback the transaction
-            db.session.rollback()
+            # The order is already committed; delete it, which returns its stock
+            _discard_unpaid_order(order_id)
             
             # Return detailed error to frontend
             return jsonify({
@@ -482,9 +481,25 @@ def process_payos_payment(order, cart, user_id):
             }), 400
     except Exception as e:
         db.session.rollback()
+        _discard_unpaid_order(order_id)
         current_app.logger.error(f"PayOS payment error: {str(e)}")
         current_app.logger.exception("Full exception details:")
         return jsonify({
             'success': False,
             'error': f"Payment processing error: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+def _discard_unpaid_order(order_id):
+    """Delete an order whose payment link was never created"""
+    if order_id is None:
+        return
+    try:
+        order = db.session.get(Order, order_id)
+        if order is not None and order.status == OrderStatus.PENDING_PAYMENT and not order.checkout_url:
+            db.session.delete(order)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Left for the payment reconciler to clean up
+        current_app.logger.error(f"Failed to discard order {order_id}: {str(e)}")
@@ -1,11 +1,13 @@
 from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash
 from flask_login import current_user, login_required
 from flask_wtf.csrf import CSRFProtect
-from extensions import db
+from extensions import db, csrf as csrf_protect
 from models.order import Order, OrderStatus
 from models.cart import Cart
+from services.webhook_inbox import record_event, apply_payment_status, webhook_workers
 import json
-from payment_providers.payos import PayOSAPI
+from payment_providers.payos import get_payos_api
+from services.payment import create_payment_link
 from datetime import datetime
 from dotenv import load_dotenv
 from error_handlers import handle_errors
@@ -16,12 +18,6 @@ load_dotenv()
 payment_bp = Blueprint('payment', __name__, url_prefix='/payment')
 csrf = CSRFProtect()
 
-def get_payos_api():
-    """Get or create PayOSAPI instance"""
-    if not hasattr(get_payos_api, '_api'):
-        get_payos_api._api = PayOSAPI()
-    return get_payos_api._api
-
 @payment_bp.route('/process', methods=['POST'])
 @login_required
 @handle_errors
@@ -44,12 +40,11 @@ def process_payment():
         # Handle different payment methods
         if payment_method == 'payos':
             # Create PayOS payment using calculated total
-            api = get_payos_api()
             amount = order.total  # Use the total property that includes shipping
-            description = f"Order #{order.id}"  # Match format in PayOS class
             
             current_app.logger.info(f"Creating PayOS payment for order {order_id} with amount {amount} VND")
-            result = api.create_payment(str(order_id), amount, description)
+            # No transaction stays open while PayOS answers; order is reloaded after
+            order, result = create_payment_link(order, amount)
             
             if not result.get('success'):
                 current_app.logger.error(f"PayOS payment creation failed: {result.get('error')}")
@@ -107,14 +102,12 @@ def payment_success():
     
     try:
         if order_id:
+            # Payment was successful; a no-op if the webhook got here first
+            apply_payment_status(int(order_id), 'success', transaction_id)
+            db.session.commit()
             order = Order.query.get(int(order_id))
             
             if order:
-                # Payment was successful
-                order.status = OrderStatus.PAID
-                order.payment_id = transaction_id
-                db.session.commit()
-                
                 # Clear user's cart
                 Cart.clear_cart(order.user_id)
                 
@@ -153,44 +146,39 @@ def payment_cancel():
                         error=error_code)
 
 @payment_bp.route('/webhook', methods=['POST'])
+@csrf_protect.exempt
 def webhook():
-    """Handle PayOS webhook notifications"""
+    """Verify a PayOS webhook and store it for the webhook workers"""
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         
         if not data:
             return jsonify({'success': False, 'message': 'No data received'}), 400
         
         api = get_payos_api()
-        if not api.verify_webhook(data):
+        # verify_webhook pops the signature; keep the delivery intact for the inbox
+        if not api.verify_webhook(dict(data)):
             current_app.logger.warning('Invalid webhook signature')
             return jsonify({'success': False, 'message': 'Invalid signature'}), 400
         
-        order_code = data.get('orderCode')
-        status = data.get('status')
-        
-        if not order_code or not status:
+        if not data.get('orderCode') or not data.get('status'):
             return jsonify({'success': False, 'message': 'Missing required fields'}), 400
         
-        order = Order.query.get(int(order_code))
-        if not order:
-            return jsonify({'success': False, 'message': 'Order not found'}), 404
+        try:
+            event_id, first_delivery = record_event(data, request.get_data(as_text=True))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid orderCode'}), 400
         
-        # Update order status based on webhook data
-        if status == 'success':
-            order.status = OrderStatus.PAID
-            order.payment_id = data.get('transactionId')
-            # Clear user's cart
-            Cart.clear_cart(order.user_id)
-            db.session.commit()
-            
-        elif status == 'failed' or status == 'cancel':
-            order.status = OrderStatus.CANCELLED
-            db.session.commit()
-            
-        current_app.logger.info(f"Webhook processed for order {order_code} with status {status}")
-        return jsonify({'success': True, 'message': 'Webhook processed successfully'})
+        if first_delivery:
+            webhook_workers.submit(event_id)
+            current_app.logger.info("Webhook for order %s queued as event %s", data.get('orderCode'), event_id)
+        else:
+            current_app.logger.info("Duplicate webhook for order %s (event %s)", data.get('orderCode'), event_id)
+        
+        # Acknowledge duplicates too, so PayOS stops retrying them
+        return jsonify({'success': True, 'message': 'Webhook received', 'duplicate': not first_delivery})
         
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Webhook processing error: {str(e)}")
-        return jsonify({'success': False, 'message': 'Error processing webhook'}), 500
\ No newline at end of file
+        return jsonify({'success': False, 'message': 'Error processing webhook'}), 500
@@ -3,6 +3,10 @@ from flask_login import login_required, current_user
 from extensions import db
 from models import Product, Category, ProductImage, ProductSize, Review
 from routes.auth import admin_required
+from services.category_counts import category_counts
+from models.pagination import paginate, pagination_json
+from services.count_cache import count_key
+from services.replica import replica_reads
 from werkzeug.utils import secure_filename
 from sqlalchemy import or_
 import os
@@ -85,13 +89,13 @@ def get_filtered_query(
 
     if categories:
         if isinstance(categories, str):
-            query = query.join(Product.category).filter(
-                db.func.lower(Category.name) == db.func.lower(categories)
-            )
+            matching = db.func.lower(Category.name) == db.func.lower(categories)
         else:
-            query = query.join(Product.category).filter(
-                db.func.lower(Category.name).in_([cat.lower() for cat in categories])
-            )
+            matching = db.func.lower(Category.name).in_([cat.lower() for cat in categories])
+        # Filter on category_id so the (is_active, category_id, price) index applies
+        query = query.join(Product.category).filter(
+            Product.category_id.in_(db.select(Category.id).where(matching))
+        )
         query = query.options(db.contains_eager(Product.category))
     else:
         query = query.options(db.joinedload(Product.category))
@@ -103,15 +107,15 @@ def get_filtered_query(
         query = query.filter(Product.price <= max_price)
     if in_stock is not None:
         if str(in_stock) == '1':
-            query = query.filter(Product.stock > 0)
+            query = query.filter(Product.in_stock == True)
         elif str(in_stock) == '0':
-            query = query.filter(Product.stock == 0)
+            query = query.filter(Product.in_stock == False)
 
     return query.options(db.joinedload(Product.images))
 
 @products_bp.route('/products')
+@replica_reads
 def index():
-    page = request.args.get('page', 1, type=int)
     categories = request.args.getlist('categories')
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
@@ -124,18 +128,14 @@ def index():
         in_stock=in_stock
     )
     
-    products = query.paginate(
-        page=page,
-        per_page=current_app.config['PRODUCTS_PER_PAGE'],
-        error_out=False
-    )
-    
-    all_categories = Category.query.all()
+    products = paginate(query, Product.sort_keys(), current_app.config['PRODUCTS_PER_PAGE'],
+                        count_key=count_key('products', categories=categories, min_price=min_price,
+                                            max_price=max_price, in_stock=in_stock))
     
     return render_template(
         'products/index.html',
         products=products,
-        categories=all_categories,
+        categories=category_counts.get(),
         selected_categories=categories,
         min_price=min_price,
         max_price=max_price,
@@ -148,7 +148,6 @@ def category_view(category_name):
         db.func.lower(Category.name) == db.func.lower(category_name)
     ).first_or_404()
     
-    page = request.args.get('page', 1, type=int)
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     in_stock = request.args.get('in_stock', type=int)
@@ -160,18 +159,14 @@ def category_view(category_name):
         in_stock=in_stock
     )
     
-    products = query.paginate(
-        page=page,
-        per_page=current_app.config['PRODUCTS_PER_PAGE'],
-        error_out=False
-    )
-    
-    all_categories = Category.query.order_by(Category.name).all()
+    products = paginate(query, Product.sort_keys(), current_app.config['PRODUCTS_PER_PAGE'],
+                        count_key=count_key('products', categories=[category_name], min_price=min_price,
+                                            max_price=max_price, in_stock=in_stock))
     
     return render_template(
         'products/category.html',
         products=products,
-        categories=all_categories,
+        categories=category_counts.get(),
         selected_category=category.name,
         category=category,
         min_price=min_price,
@@ -208,7 +203,6 @@ def detail(id):
 @login_required
 @admin_required
 def manage_products():
-    page = request.args.get('page', 1, type=int)
     category = request.args.get('category')
     sort = request.args.get('sort', 'name')
     search = request.args.get('search', '')
@@ -232,7 +226,6 @@ def manage_products():
         search_term = f"%{search}%"
         current_app.logger.info(f"Searching with term: '{search}', SQL LIKE pattern: '{search_term}'")
         query = query.filter(Product.name.ilike(search_term))
-        current_app.logger.info(f"Found {query.count()} products matching search term")
 
     # Apply category filter if provided
     if category:
@@ -240,28 +233,14 @@ def manage_products():
             db.func.lower(Category.name) == db.func.lower(category)
         )
 
-    if sort == 'name':
-        query = query.order_by(Product.name)
-    elif sort == 'price':
-        query = query.order_by(Product.price)
-    elif sort == 'stock':
-        query = query.order_by(Product.stock)
-    elif sort == 'category':
-        query = query.join(Product.category).order_by(Category.name)
-
-    products = query.paginate(
-        page=page,
-        per_page=current_app.config['PRODUCTS_PER_PAGE'],
-        error_out=False
-    )
+    products = paginate(query, Product.sort_keys(sort), current_app.config['PRODUCTS_PER_PAGE'],
+                        count_key=count_key('products:admin', search=search, category=category))
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify({
             'success': True,
-            'products': [p.to_dict() for p in products.items],
-            'total': products.total,
-            'pages': products.pages,
-            'current_page': products.page
+            'products': Product.to_dict_many(products.items),
+            **pagination_json(products)
         })
 
     return render_template('admin/products.html',
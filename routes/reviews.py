@@ -5,6 +5,7 @@ from models import Review, Product, Order
 from models.order import OrderStatus
 from datetime import datetime
 from sqlalchemy.exc import IntegrityError
+from services.replica import replica_reads
 
 reviews_bp = Blueprint('reviews', __name__)
 
@@ -70,6 +71,7 @@ def create_review(product_id):
         return jsonify({'error': 'Error creating review'}), 500
 
 @reviews_bp.route('/api/products/<int:product_id>/reviews', methods=['GET'])
+@replica_reads
 def get_product_reviews(product_id):
     """Get all reviews for a product"""
     try:
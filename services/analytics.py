@@ -0,0 +1,399 @@
+"""
+Vectorized sales analytics for the admin API
+
+All sold order lines are read with one streaming query into NumPy column
+arrays, and every report is computed on those arrays instead of row by row:
+revenue per day, week or month, average order value, repeat-purchase
+cohorts, category revenue share and product sell-through.
+
+The arrays are loaded once per process. Once they are ANALYTICS_FRAME_TTL
+seconds old, a background thread reads only the orders created or updated
+since the last read and merges them in, while requests keep using the
+current arrays; each response says when its data was loaded. Every
+FULL_RELOAD_SECONDS the arrays are read again in full instead, which also
+picks up edits that don't touch the order row, such as a product moving
+to another category. Orders count the same way as in
+services.sales_rollup: everything except cancelled and refunded orders.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import BigInteger, Float, cast, extract, func, or_
+from extensions import db
+from models.product import Product
+from models.category import Category
+from models.order import Order, OrderItem
+from services.sales_rollup import NOT_SOLD, MAX_DAYS
+
+FRAME_TTL = 300  # seconds
+FULL_RELOAD_SECONDS = 3600
+# Orders updated this long before the last read are read again, in case
+# their transaction committed after it
+CHANGE_MARGIN = timedelta(seconds=60)
+FETCH_ROWS = 100000  # rows per streamed batch while loading
+PERIODS = ('day', 'week', 'month')
+
+# One row per order line; an order without lines has product_id -1
+LINE_DTYPE = np.dtype([
+    ('order_id', np.int64),
+    ('user_id', np.int64),
+    ('placed_at', np.int64),  # Unix seconds
+    ('order_total', np.int64),
+    ('product_id', np.int64),
+    ('category_id', np.int64),
+    ('quantity', np.int64),
+    ('revenue', np.float64)
+])
+ORDER_FIELDS = ('order_id', 'user_id', 'placed_at', 'order_total')
+
+logger = logging.getLogger(__name__)
+
+
+def _lines_query():
+    return db.select(
+        Order.id,
+        Order.user_id,
+        cast(extract('epoch', Order.created_at), BigInteger),
+        Order.total_amount,
+        func.coalesce(OrderItem.product_id, -1),
+        func.coalesce(Product.category_id, -1),
+        func.coalesce(OrderItem.quantity, 0),
+        cast(func.coalesce(OrderItem.quantity * OrderItem.price, 0), Float)
+    ).select_from(Order).outerjoin(
+        OrderItem, OrderItem.order_id == Order.id
+    ).outerjoin(
+        Product, Product.id == OrderItem.product_id
+    ).where(
+        Order.status.notin_(NOT_SOLD),
+        Order.created_at.isnot(None)
+    ).order_by(Order.id)
+
+
+def _read_lines(stmt):
+    """Run a lines query as one streaming read into a structured array"""
+    connection = db.session.connection(bind_arguments={'clause': stmt})
+    result = connection.execution_options(yield_per=FETCH_ROWS).execute(stmt)
+    chunks = [np.fromiter(map(tuple, rows), dtype=LINE_DTYPE, count=len(rows))
+              for rows in result.partitions()]
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=LINE_DTYPE)
+
+
+class SalesFrame:
+    """Sold order lines and orders as contiguous column arrays"""
+
+    def __init__(self, lines, loaded_at):
+        self.loaded_at = loaded_at
+        self.lines = {name: np.ascontiguousarray(lines[name]) for name in LINE_DTYPE.names}
+        order_ids = self.lines['order_id']
+        # Lines arrive ordered by order, so each order starts where the id changes
+        starts = np.flatnonzero(np.r_[True, order_ids[1:] != order_ids[:-1]]) if len(order_ids) else np.empty(0, np.int64)
+        self.orders = {name: self.lines[name][starts] for name in ORDER_FIELDS}
+
+    @classmethod
+    def load(cls):
+        """Read every sold order line with a single streaming query"""
+        loaded_at = datetime.utcnow()
+        return cls(_read_lines(_lines_query()), loaded_at)
+
+    def refreshed(self):
+        """
+        A new frame with the orders created or updated since this one was
+        loaded read again; the rest of the arrays are reused
+
+        Returns:
+            SalesFrame
+        """
+        loaded_at = datetime.utcnow()
+        since = self.loaded_at - CHANGE_MARGIN
+        order_ids = self.lines['order_id']
+        last_id = int(order_ids[-1]) if len(order_ids) else 0
+        # Orders already in the arrays whose status or total may have changed
+        changed = np.fromiter(db.session.execute(
+            db.select(Order.id).where(Order.id <= last_id, Order.updated_at >= since)
+        ).scalars(), dtype=np.int64)
+        lines = _read_lines(_lines_query().where(or_(Order.id > last_id, Order.updated_at >= since)))
+
+        keep = ~np.isin(order_ids, changed) if len(changed) else slice(None)
+        merged = {name: np.concatenate((self.lines[name][keep], lines[name])) for name in LINE_DTYPE.names}
+        if len(changed):
+            # Changed orders were appended after newer ones; restore the order
+            position = np.argsort(merged['order_id'], kind='stable')
+            merged = {name: values[position] for name, values in merged.items()}
+        return SalesFrame(merged, loaded_at)
+
+    def __len__(self):
+        return len(self.lines['order_id'])
+
+    def orders_since(self, since=None):
+        if since is None:
+            return self.orders
+        mask = self.orders['placed_at'] >= since
+        return {name: values[mask] for name, values in self.orders.items()}
+
+    def items_since(self, since=None):
+        """Order lines with a product, optionally placed since a Unix time"""
+        mask = self.lines['product_id'] >= 0
+        if since is not None:
+            mask &= self.lines['placed_at'] >= since
+        return {name: values[mask] for name, values in self.lines.items()}
+
+
+class SalesFrameCache:
+    """
+    Per-process SalesFrame. Only the first request waits for it to load;
+    once it is older than the TTL it is refreshed in a background thread.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._frame = None
+        self._loaded = 0.0
+        self._full_loaded = 0.0
+        self._refreshing = False
+        self.load_seconds = None
+        self.refresh_seconds = None
+        self.refreshes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        ttl = self.ttl if self.ttl is not None else current_app.config.get('ANALYTICS_FRAME_TTL', FRAME_TTL)
+        with self._lock:
+            frame = self._frame
+            if frame is not None:
+                self.hits += 1
+                if time.monotonic() - self._loaded >= ttl and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh, args=(current_app._get_current_object(), frame),
+                                     name='analytics-refresh', daemon=True).start()
+                return frame
+            self.misses += 1
+
+        # One load at a time; requests that waited get the frame it produced
+        with self._load_lock:
+            with self._lock:
+                if self._frame is not None:
+                    return self._frame
+            started = time.perf_counter()
+            frame = SalesFrame.load()
+            with self._lock:
+                self._frame = frame
+                self._loaded = self._full_loaded = time.monotonic()
+                self.load_seconds = round(time.perf_counter() - started, 3)
+            return frame
+
+    def _refresh(self, app, frame):
+        full = time.monotonic() - self._full_loaded >= FULL_RELOAD_SECONDS
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                try:
+                    fresh = SalesFrame.load() if full else frame.refreshed()
+                finally:
+                    db.session.remove()
+        except Exception as e:
+            # Keep serving the current frame; try again after another TTL
+            logger.warning("Analytics refresh failed: %s", e)
+            fresh = None
+        with self._lock:
+            self._refreshing = False
+            self._loaded = time.monotonic()
+            if fresh is None or self._frame is not frame:
+                return
+            self._frame = fresh
+            seconds = round(time.perf_counter() - started, 3)
+            if full:
+                self._full_loaded = self._loaded
+                self.load_seconds = seconds
+            else:
+                self.refreshes += 1
+                self.refresh_seconds = seconds
+
+    def invalidate(self):
+        """Read the arrays again in full, in the background, on next use"""
+        with self._lock:
+            self._loaded = self._full_loaded = 0.0
+
+    def stats(self):
+        """Hit and miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'rows': len(self._frame) if self._frame is not None else 0,
+                'load_seconds': self.load_seconds,
+                'refreshes': self.refreshes,
+                'refresh_seconds': self.refresh_seconds
+            }
+
+
+sales_frames = SalesFrameCache()
+
+
+def since_days(days):
+    """Unix time N days ago (at most MAX_DAYS), or None for all history"""
+    if not days:
+        return None
+    days = min(max(days, 1), MAX_DAYS)
+    return int((datetime.utcnow() - timedelta(days=days) - datetime(1970, 1, 1)).total_seconds())
+
+
+def _period_keys(placed_at, period):
+    days = placed_at // 86400
+    dates = days.astype('datetime64[D]')
+    if period == 'week':
+        # 1970-01-01 was a Thursday; weeks start on Monday
+        return dates - ((days + 3) % 7)
+    if period == 'month':
+        return dates.astype('datetime64[M]')
+    return dates
+
+
+def revenue_by_period(frame, period='day', since=None):
+    """Orders, revenue and average order value per day, week or month"""
+    orders = frame.orders_since(since)
+    keys, inverse = np.unique(_period_keys(orders['placed_at'], period), return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    revenue = np.bincount(inverse, weights=orders['order_total'], minlength=len(keys))
+    return [{
+        'period': str(key),
+        'order_count': int(count),
+        'revenue': int(total),
+        'average_order_value': round(float(total) / int(count))
+    } for key, count, total in zip(keys, counts, revenue)]
+
+
+def order_value_summary(frame, since=None):
+    """Average, median and 90th percentile order value"""
+    orders = frame.orders_since(since)
+    totals = orders['order_total']
+    if not len(totals):
+        return {'order_count': 0, 'revenue': 0, 'average_order_value': 0,
+                'median_order_value': 0, 'p90_order_value': 0, 'items_per_order': 0}
+    items = frame.items_since(since)
+    median, p90 = np.percentile(totals, [50, 90])
+    return {
+        'order_count': int(len(totals)),
+        'revenue': int(totals.sum()),
+        'average_order_value': round(float(totals.mean())),
+        'median_order_value': round(float(median)),
+        'p90_order_value': round(float(p90)),
+        'items_per_order': round(float(items['quantity'].sum()) / len(totals), 2)
+    }
+
+
+def repeat_purchase_cohorts(frame, months=12):
+    """
+    Customers grouped by the month of their first order
+
+    retention[n] is the share of a cohort that ordered again n months after
+    its first month (retention[0] is always 1).
+    """
+    orders = frame.orders
+    if not len(orders['user_id']):
+        return {'customers': 0, 'repeat_customers': 0, 'repeat_rate': 0.0, 'cohorts': []}
+
+    month = (orders['placed_at'] // 86400).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    users, user_index = np.unique(orders['user_id'], return_inverse=True)
+    first = np.full(len(users), np.iinfo(np.int64).max)
+    np.minimum.at(first, user_index, month)
+    order_counts = np.bincount(user_index, minlength=len(users))
+
+    cohort = first[user_index]
+    offset = month - cohort
+    # One entry per customer per month they ordered in
+    span = int(offset.max()) + 1
+    active = np.unique(user_index * span + offset)
+    active_cohort = first[active // span]
+    active_offset = active % span
+
+    latest = int(month.max())
+    oldest = latest - months + 1
+    cohorts = []
+    for start in range(max(oldest, int(first.min())), latest + 1):
+        size = int((first == start).sum())
+        if not size:
+            continue
+        in_cohort = active_cohort == start
+        retained = np.bincount(active_offset[in_cohort], minlength=latest - start + 1)[:latest - start + 1]
+        cohorts.append({
+            'cohort': str(np.datetime64(start, 'M')),
+            'customers': size,
+            'retention': [round(int(n) / size, 4) for n in retained]
+        })
+
+    repeat = int((order_counts >= 2).sum())
+    return {
+        'customers': int(len(users)),
+        'repeat_customers': repeat,
+        'repeat_rate': round(repeat / len(users), 4),
+        'cohorts': cohorts
+    }
+
+
+def category_revenue_share(frame, since=None):
+    """Revenue and units per category with each category's share of revenue"""
+    items = frame.items_since(since)
+    categories, inverse = np.unique(items['category_id'], return_inverse=True)
+    revenue = np.bincount(inverse, weights=items['revenue'], minlength=len(categories))
+    units = np.bincount(inverse, weights=items['quantity'], minlength=len(categories))
+    total = revenue.sum()
+
+    names = dict(db.session.execute(
+        db.select(Category.id, Category.name).where(Category.id.in_(categories.tolist()))
+    ).all()) if len(categories) else {}
+    rows = [{
+        'category_id': int(category_id),
+        'name': names.get(int(category_id), 'Uncategorized'),
+        'revenue': int(amount),
+        'units': int(count),
+        'share': round(float(amount / total), 4) if total else 0.0
+    } for category_id, amount, count in zip(categories, revenue, units)]
+    rows.sort(key=lambda row: row['revenue'], reverse=True)
+    return rows
+
+
+def product_sell_through(frame, since=None, limit=20):
+    """
+    Units sold against units still in stock, per product
+
+    sell_through = sold / (sold + current stock); products that sold out
+    score 1.
+    """
+    items = frame.items_since(since)
+    sold_ids, inverse = np.unique(items['product_id'], return_inverse=True)
+    sold = np.bincount(inverse, weights=items['quantity'], minlength=len(sold_ids))
+    revenue = np.bincount(inverse, weights=items['revenue'], minlength=len(sold_ids))
+
+    stock_rows = db.session.execute(
+        db.select(Product.id, Product.name, func.coalesce(Product.stock, 0)).order_by(Product.id)
+    ).all()
+    product_ids = np.fromiter((row[0] for row in stock_rows), dtype=np.int64, count=len(stock_rows))
+    stock_levels = np.fromiter((row[2] for row in stock_rows), dtype=np.int64, count=len(stock_rows))
+    names = [row[1] for row in stock_rows]
+
+    # Lines of products that have since been deleted have no stock to compare
+    position = np.searchsorted(product_ids, sold_ids)
+    known = (position < len(product_ids)) & (product_ids[np.minimum(position, len(product_ids) - 1)] == sold_ids) \
+        if len(product_ids) else np.zeros(len(sold_ids), dtype=bool)
+    position, sold, revenue, sold_ids = position[known], sold[known], revenue[known], sold_ids[known]
+    stock = np.maximum(stock_levels[position], 0)
+    available = sold + stock
+    rate = np.divide(sold, available, out=np.zeros(len(sold)), where=available > 0)
+
+    top = np.lexsort((-sold, -rate))[:limit]
+    return [{
+        'product_id': int(sold_ids[i]),
+        'name': names[position[i]],
+        'units_sold': int(sold[i]),
+        'stock': int(stock[i]),
+        'revenue': int(revenue[i]),
+        'sell_through': round(float(rate[i]), 4)
+    } for i in top]
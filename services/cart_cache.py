@@ -0,0 +1,176 @@
+"""
+Per-user cart summary cache for the e-commerce application
+
+/api/cart is polled by the header badge and the checkout page, so each
+process keeps the last computed cart per user. The cart methods write
+through to it, and committed changes to cart rows drop the user's entry.
+Committed changes to a product's price, stock or options drop the entries
+of every user whose cart holds that product, found through a reverse index.
+The TTL bounds staleness across worker processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from extensions import db
+from models.cart import CartItem
+from models.product import Product, ProductVariant, ProductSize, ProductColor
+from models.product_image import ProductImage
+from services.session_hooks import on_commit, collect
+
+CACHE_TTL = 30  # seconds
+MAX_ENTRIES = 10000  # carts kept per process
+
+
+def _cart_key(user_id):
+    """Match the user_id normalization done by the CartItem methods"""
+    if isinstance(user_id, str) and user_id.isdigit():
+        return int(user_id)
+    return user_id
+
+
+def empty_cart():
+    return {
+        'items': [],
+        'subtotal': 0,
+        'shipping_cost': 0,
+        'total': 0,
+        'item_count': 0
+    }
+
+
+class CartSummaryCache:
+    """Per-process cache of get_cart_for_user results with a product reverse index"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (loaded_at, cart)
+        self._product_users = {}       # product_id -> set of user_ids
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """
+        Get a user's cart, computing it only on a cache miss
+
+        Returns:
+            dict: Same shape as CartItem.get_cart_for_user
+        """
+        key = _cart_key(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        cart = CartItem.get_cart_for_user(key)
+        self._store(key, cart, generation)
+        return cart
+
+    def refresh(self, user_id):
+        """Recompute a user's cart after a write"""
+        key = _cart_key(user_id)
+        with self._lock:
+            generation = self._generation
+        self._store(key, CartItem.get_cart_for_user(key), generation)
+
+    def set_empty(self, user_id):
+        """Record a cleared cart without querying it"""
+        key = _cart_key(user_id)
+        with self._lock:
+            generation = self._generation
+        self._store(key, empty_cart(), generation)
+
+    def _store(self, key, cart, generation):
+        if 'error' in cart:
+            return
+        with self._lock:
+            # Don't cache a cart that an invalidation raced past
+            if generation != self._generation:
+                return
+            self._drop(key)
+            self._entries[key] = (time.monotonic(), cart)
+            for item in cart['items']:
+                self._product_users.setdefault(item['product_id'], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for item in entry[1]['items']:
+            users = self._product_users.get(item['product_id'])
+            if users is not None:
+                users.discard(key)
+                if not users:
+                    del self._product_users[item['product_id']]
+
+    def invalidate_users(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._drop(_cart_key(user_id))
+
+    def invalidate_products(self, product_ids):
+        """Drop the carts of every user holding one of the products"""
+        with self._lock:
+            self._generation += 1
+            for product_id in product_ids:
+                for user_id in list(self._product_users.get(product_id, ())):
+                    self._drop(user_id)
+
+    def stats(self):
+        """Hit and miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+
+
+cart_summaries = CartSummaryCache()
+
+# Product attributes copied into a cart line
+_CART_PRODUCT_ATTRS = ('price', 'discount_price', 'stock', 'is_active', 'name',
+                       'sku', 'inventory_type', 'image_url')
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_cart_changes(session, flush_context):
+    """Remember which carts and products a flush touched"""
+    users = collect(session, 'cart_users')
+    products = collect(session, 'cart_products')
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    for obj in changed:
+        if isinstance(obj, CartItem):
+            users.add(obj.user_id)
+        elif isinstance(obj, Product):
+            if obj in session.new:
+                continue
+            state = db.inspect(obj)
+            if obj in session.deleted or any(
+                    state.attrs[attr].history.has_changes() for attr in _CART_PRODUCT_ATTRS):
+                products.add(obj.id)
+        elif isinstance(obj, (ProductVariant, ProductSize, ProductColor, ProductImage)):
+            if obj.product_id:
+                products.add(obj.product_id)
+
+
+@on_commit('cart_users')
+def invalidate_cart_users(session, users):
+    cart_summaries.invalidate_users(users)
+
+
+@on_commit('cart_products')
+def invalidate_cart_products(session, products):
+    cart_summaries.invalidate_products(products)
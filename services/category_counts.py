@@ -0,0 +1,111 @@
+"""
+Cached category product counts for the e-commerce application
+
+All counts come from one GROUP BY query and are cached per process until a
+committed change adds, removes, (de)activates or recategorizes a product, or
+changes a category. The TTL bounds staleness across worker processes.
+"""
+import threading
+import time
+from sqlalchemy import event, func, case
+from extensions import db
+from models.product import Product
+from models.category import Category
+from services.session_hooks import on_commit, mark
+from services.replica import primary_reads
+
+CACHE_TTL = 300  # seconds
+
+
+class CategoryCounts:
+    """Per-process cache of product counts per category"""
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows = None
+        self._loaded_at = 0
+        self._generation = 0
+
+    def get(self):
+        """
+        Get every category with its product counts, ordered by name
+
+        Returns:
+            list: dicts with id, name, slug, product_count (active products)
+                  and total_count (all products)
+        """
+        rows = self._rows
+        if rows is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return rows
+
+        generation = self._generation
+        with primary_reads():
+            result = db.session.query(
+                Category.id,
+                Category.name,
+                Category.slug,
+                func.coalesce(func.sum(case((Product.is_active == True, 1), else_=0)), 0).label('product_count'),
+                func.count(Product.id).label('total_count')
+            ).outerjoin(
+                Product, Product.category_id == Category.id
+            ).group_by(
+                Category.id, Category.name, Category.slug
+            ).order_by(Category.name).all()
+
+        rows = [{
+            'id': row.id,
+            'name': row.name,
+            'slug': row.slug,
+            'product_count': int(row.product_count),
+            'total_count': row.total_count
+        } for row in result]
+        with self._lock:
+            # Don't cache a result that an invalidation raced past
+            if generation == self._generation:
+                self._rows = rows
+                self._loaded_at = time.monotonic()
+        return rows
+
+    def active(self):
+        """Categories that have at least one active product"""
+        return [row for row in self.get() if row['product_count'] > 0]
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self._generation += 1
+
+
+category_counts = CategoryCounts()
+
+# Product attributes that move a product between counts
+_COUNTED_ATTRS = ('is_active', 'category_id')
+
+
+def _affects_counts(session):
+    for obj in session.new:
+        if isinstance(obj, (Product, Category)):
+            return True
+    for obj in session.deleted:
+        if isinstance(obj, (Product, Category)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, Category):
+            return True
+        if isinstance(obj, Product):
+            state = db.inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in _COUNTED_ATTRS):
+                return True
+    return False
+
+
+@event.listens_for(db.session, 'after_flush')
+def mark_category_counts_stale(session, flush_context):
+    if _affects_counts(session):
+        mark(session, 'category_counts')
+
+
+@on_commit('category_counts')
+def invalidate_category_counts(session, stale):
+    category_counts.invalidate()
@@ -0,0 +1,144 @@
+"""
+Cached listing totals for the e-commerce application
+
+Paginated listings need a total for their page links, which costs a
+COUNT(*) over the whole filtered query on every request. Totals are kept per
+process, keyed by the listing and its normalized filter parameters, so a
+listing shows "about N results" without counting each time.
+
+Committed writes to products, orders or users drop the totals of that kind
+of listing; the TTL bounds staleness across worker processes. Listings of
+one kind that filter differently are told apart by a suffix, e.g.
+'products:search' and 'products:admin', and are dropped together.
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from extensions import db
+from models.product import Product, ProductVariant, ProductSize, ProductColor
+from models.category import Category
+from models.order import Order
+from models.user import User
+from services.session_hooks import on_commit, collect
+from services.replica import primary_reads
+
+CACHE_TTL = 120  # seconds
+MAX_ENTRIES = 2048  # filter combinations kept per process
+
+# Listing kind ('products', 'orders', 'users') invalidated by each model
+_LISTINGS = (
+    ((Product, ProductVariant, ProductSize, ProductColor, Category), 'products'),
+    ((Order,), 'orders'),
+    ((User,), 'users')
+)
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(_normalize(v) for v in value if v not in (None, '')))
+    return value
+
+
+def _kind(listing):
+    """'products' for 'products:search'"""
+    return listing.split(':', 1)[0]
+
+
+def count_key(listing, **params):
+    """
+    Cache key for a listing's total
+
+    Listings whose filters mean different things, like a full-text search
+    and a name match, need their own listing name.
+
+    Empty parameters are dropped, whitespace in strings is collapsed and
+    lists are sorted, so equivalent filters share one count. Case is kept
+    since SQLite only folds ASCII case.
+    """
+    return listing, tuple(sorted(
+        (name, _normalize(value)) for name, value in params.items()
+        if value not in (None, '', [], ())
+    ))
+
+
+class CountCache:
+    """Per-process cache of listing totals keyed by count_key()"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (counted_at, total)
+        self._generations = {}          # listing kind -> generation
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, count):
+        """
+        Get a listing's total, running count() only on a cache miss
+
+        Args:
+            key: Result of count_key()
+            count: Callable returning the exact total
+        """
+        kind = _kind(key[0])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generations.get(kind, 0)
+
+        with primary_reads():
+            total = count()
+        with self._lock:
+            # Don't cache a total that an invalidation raced past
+            if generation == self._generations.get(kind, 0):
+                self._entries[key] = (time.monotonic(), total)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return total
+
+    def invalidate(self, listings):
+        """Drop every cached total for the given listing kinds"""
+        listings = set(listings)
+        with self._lock:
+            for listing in listings:
+                self._generations[listing] = self._generations.get(listing, 0) + 1
+            for key in [key for key in self._entries if _kind(key[0]) in listings]:
+                del self._entries[key]
+
+    def stats(self):
+        """Hit and miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries)
+            }
+
+
+count_cache = CountCache()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_count_changes(session, flush_context):
+    """Remember which kinds of listing a flush changed"""
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    listings = {listing for obj in changed for models, listing in _LISTINGS
+                if isinstance(obj, models)}
+    if listings:
+        collect(session, 'listing_counts').update(listings)
+
+
+@on_commit('listing_counts')
+def invalidate_counts(session, listings):
+    count_cache.invalidate(listings)
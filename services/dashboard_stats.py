@@ -0,0 +1,184 @@
+"""
+Admin dashboard statistics for the e-commerce application
+
+Users, products, orders and revenue are held in memory per process. Each
+commit adds what it changed, so the dashboard and /admin/api/stats read
+them without counting the tables.
+
+Writes made by other worker processes, bulk query updates and raw SQL
+bypass the session events. A background thread therefore recounts
+everything every DASHBOARD_STATS_RECONCILE_SECONDS. Each read reports how
+old the last recount is.
+
+Revenue sums every order that isn't cancelled or refunded, the same rule
+the sales rollups use.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event, func
+from extensions import db
+from models.user import User
+from models.product import Product
+from models.order import Order
+from services.sales_rollup import is_sold, committed_value, NOT_SOLD
+from services.session_hooks import on_commit, collect
+
+DEFAULT_RECONCILE_SECONDS = 300
+
+COUNTERS = ('total_users', 'total_products', 'total_orders', 'revenue')
+
+# Counter changed by creating or deleting each model
+_COUNTED_MODELS = ((User, 'total_users'), (Product, 'total_products'), (Order, 'total_orders'))
+
+logger = logging.getLogger(__name__)
+
+
+def count_everything():
+    """Exact counters from the database"""
+    return {
+        'total_users': db.session.query(func.count(User.id)).scalar(),
+        'total_products': db.session.query(func.count(Product.id)).scalar(),
+        'total_orders': db.session.query(func.count(Order.id)).scalar(),
+        'revenue': int(db.session.query(func.coalesce(func.sum(Order.total_amount), 0))
+                       .filter(Order.status.notin_(NOT_SOLD)).scalar())
+    }
+
+
+class DashboardStats:
+    """Per-process dashboard counters, adjusted on commit and recounted periodically"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = None
+        self._reconciled_at = None  # time.time() of the last recount
+        self._updated_at = None     # time.time() of the last change
+        self._app = None
+        self._interval = DEFAULT_RECONCILE_SECONDS
+        self._thread = None
+        self._stop = threading.Event()
+        self.reconciliations = 0
+        self.drift = {}  # correction made by the last recount
+
+    def init_app(self, app):
+        self._app = app
+        self._interval = app.config.get('DASHBOARD_STATS_RECONCILE_SECONDS') or DEFAULT_RECONCILE_SECONDS
+
+    def get(self):
+        """
+        Current counters plus their age
+
+        The first call counts the tables and starts the background recount.
+        """
+        with self._lock:
+            loaded = self._counters is not None
+        if not loaded:
+            self.reconcile()
+            self._start()
+
+        now = time.time()
+        with self._lock:
+            stats = dict(self._counters)
+            stats['reconciled_at'] = datetime.utcfromtimestamp(self._reconciled_at).isoformat()
+            stats['stale_seconds'] = round(now - self._reconciled_at, 1)
+            stats['updated_at'] = datetime.utcfromtimestamp(self._updated_at).isoformat()
+        return stats
+
+    def apply(self, changes):
+        """Add committed changes; ignored until the first recount has run"""
+        with self._lock:
+            if self._counters is None:
+                return
+            for name, delta in changes.items():
+                self._counters[name] += delta
+            self._updated_at = time.time()
+
+    def reconcile(self):
+        """Recount from the database and replace the in-memory counters"""
+        counters = count_everything()
+        with self._lock:
+            if self._counters is not None:
+                self.drift = {name: counters[name] - self._counters[name]
+                              for name in COUNTERS if counters[name] != self._counters[name]}
+            self._counters = counters
+            self._reconciled_at = self._updated_at = time.time()
+            self.reconciliations += 1
+        if self.drift:
+            logger.info(f"Dashboard stats corrected by {self.drift}")
+        return counters
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or self._app is None:
+                return
+            self._thread = threading.Thread(target=self._run, name='dashboard-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            with self._app.app_context():
+                try:
+                    self.reconcile()
+                except Exception as e:
+                    # Keep serving the counters we have; try again next interval
+                    logger.warning(f"Dashboard stats reconciliation failed: {e}")
+                finally:
+                    db.session.remove()
+
+
+dashboard_stats = DashboardStats()
+
+
+@event.listens_for(db.session, 'before_flush')
+def collect_dashboard_changes(session, flush_context, instances):
+    """Work out how this flush moves the counters; applied on commit"""
+    changes = {}
+
+    def add(name, delta):
+        if delta:
+            changes[name] = changes.get(name, 0) + delta
+
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            for model, name in _COUNTED_MODELS:
+                if isinstance(obj, model):
+                    add(name, sign)
+
+    for obj in session.new:
+        if isinstance(obj, Order) and is_sold(obj.status):
+            add('revenue', obj.total_amount or 0)
+
+    connection = None
+    for obj in (*session.dirty, *session.deleted):
+        if not isinstance(obj, Order):
+            continue
+        attrs = db.inspect(obj).attrs
+        if obj in session.dirty and not (attrs.status.history.has_changes()
+                                         or attrs.total_amount.history.has_changes()):
+            continue
+        connection = connection or session.connection()
+        old = (committed_value(connection, obj, 'total_amount') or 0) \
+            if is_sold(committed_value(connection, obj, 'status')) else 0
+        new = (obj.total_amount or 0) if obj not in session.deleted and is_sold(obj.status) else 0
+        add('revenue', new - old)
+
+    if changes:
+        pending = collect(session, 'dashboard_stats', dict)
+        for name, delta in changes.items():
+            pending[name] = pending.get(name, 0) + delta
+
+
+@on_commit('dashboard_stats')
+def apply_dashboard_changes(session, changes):
+    dashboard_stats.apply(changes)
+
+
+def init_dashboard_stats(app):
+    """Configure the background recount; it starts with the first read"""
+    dashboard_stats.init_app(app)
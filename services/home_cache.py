@@ -0,0 +1,142 @@
+"""
+Home page section cache for the e-commerce application
+
+The product grids on the home page (on sale, popular, featured) are rendered
+once per category filter and kept as HTML fragments per process. Committed
+changes to anything a product card shows drop the cache; the TTL bounds
+staleness across worker processes and for the popularity ranking, which
+changes with every paid order.
+
+Fragments are rendered with a placeholder instead of the per-session CSRF
+token, which is filled in on every request.
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import render_template
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+from sqlalchemy import event
+from extensions import db
+from models.product import Product, ProductVariant, ProductSize, ProductColor
+from models.product_image import ProductImage
+from services.session_hooks import on_commit, mark
+from services.replica import primary_reads
+
+CACHE_TTL = 60  # seconds
+MAX_ENTRIES = 64  # category filters kept per process
+
+CSRF_PLACEHOLDER = '__HOME_CACHE_CSRF_TOKEN__'
+
+
+def render_product_grid(products, empty_message=None):
+    """Render product cards as a cacheable fragment"""
+    return render_template('products/_product_grid.html',
+                           products=products,
+                           empty_message=empty_message,
+                           csrf_token=lambda: CSRF_PLACEHOLDER)
+
+
+class HomeCache:
+    """Per-process cache of rendered home page sections keyed by category_id"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # category_id -> (loaded_at, sections)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, category_id, build):
+        """
+        Get the rendered sections for a category filter
+
+        Args:
+            category_id: Category filter, or None for all categories
+            build: Callable returning a dict of section name -> HTML fragment
+
+        Returns:
+            dict: section name -> Markup ready to be placed in home.html
+        """
+        with self._lock:
+            entry = self._entries.get(category_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(category_id)
+                self.hits += 1
+                sections = entry[1]
+            else:
+                self.misses += 1
+                sections = None
+            generation = self._generation
+
+        if sections is None:
+            with primary_reads():
+                sections = build()
+            with self._lock:
+                # Don't cache sections that an invalidation raced past
+                if generation == self._generation:
+                    self._entries[category_id] = (time.monotonic(), sections)
+                    self._entries.move_to_end(category_id)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+
+        token = generate_csrf()
+        return {name: Markup(html.replace(CSRF_PLACEHOLDER, token))
+                for name, html in sections.items()}
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        """Hit and miss counters for this process"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries)
+            }
+
+
+home_cache = HomeCache()
+
+# Product attributes shown on a home page product card
+_DISPLAYED_ATTRS = ('price', 'discount_price', 'stock', 'is_active',
+                    'name', 'description', 'image_url')
+
+# Rows whose changes reach a product card, including option rows that
+# make up Product.stock
+_CARD_ROWS = (ProductImage, ProductVariant, ProductSize, ProductColor)
+
+
+def _affects_home(session):
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, (Product,) + _CARD_ROWS):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, _CARD_ROWS):
+            return True
+        if isinstance(obj, Product):
+            state = db.inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in _DISPLAYED_ATTRS):
+                return True
+    return False
+
+
+@event.listens_for(db.session, 'after_flush')
+def mark_home_cache_stale(session, flush_context):
+    if _affects_home(session):
+        mark(session, 'home_cache')
+
+
+@on_commit('home_cache')
+def invalidate_home_cache(session, stale):
+    home_cache.invalidate()
@@ -0,0 +1,320 @@
+"""
+Stock reservation for the e-commerce application
+
+Checkout takes stock with conditional UPDATEs (stock = stock - q WHERE
+stock >= q) in the same transaction that creates the order, so two buyers
+can never both get the last unit and no stock is read into Python first.
+If any line cannot be taken the caller rolls back, which undoes the lines
+already taken.
+
+Stock is returned when a reserved order is cancelled or deleted before it
+is delivered; delivered goods have left and don't come back. Unpaid
+PayOS orders hold their reservation for STOCK_RESERVATION_TTL_MINUTES and
+are then settled by services.payment_reconciler, which cancels the
+payment link before giving the stock back.
+"""
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import event, case, func, bindparam
+from extensions import db
+from models.product import Product, ProductVariant, ProductSize, ProductColor
+from models.order import Order, OrderItem, OrderStatus
+from services.session_hooks import on_commit, collect
+
+DEFAULT_TTL_MINUTES = 30
+
+
+class InsufficientStockError(ValueError):
+    """Raised when a reservation line cannot be taken from stock"""
+
+    def __init__(self, product_id, message='Not enough stock available'):
+        super().__init__(message)
+        self.product_id = product_id
+
+
+def _resolve_lines(connection, lines, strict=True):
+    """
+    Work out which stock row each line draws from, with one query per
+    inventory type however many lines there are
+
+    Args:
+        lines: iterable of dicts with product_id, quantity and optional
+               size, color_id and variant_id
+        strict: Raise for lines whose stock row doesn't exist; otherwise
+                skip them (used when giving stock back)
+
+    Returns:
+        list: (table, row_id, product_id, quantity) sorted by table and row,
+              with duplicate rows merged and row_id None for products
+              stocked on the product itself
+    """
+    lines = [line for line in lines if line.get('quantity', 0) > 0]
+    if not lines:
+        return []
+
+    products = Product.__table__
+    sizes = ProductSize.__table__
+    colors = ProductColor.__table__
+    variants = ProductVariant.__table__
+
+    inventory_types = dict(connection.execute(
+        db.select(products.c.id, products.c.inventory_type)
+        .where(products.c.id.in_({line['product_id'] for line in lines}))
+    ).all())
+
+    def kind(line):
+        inventory_type = inventory_types.get(line['product_id'])
+        if inventory_type == 'both':
+            return 'variant'
+        # Option-stocked products never draw from the product row, whose
+        # stock is the sum of the options
+        if inventory_type in ('size', 'color'):
+            return inventory_type
+        return 'product'
+
+    # Size rows by (product_id, size), first row per size
+    size_ids = {}
+    size_products = {line['product_id'] for line in lines if kind(line) == 'size'}
+    if size_products:
+        for row in connection.execute(
+                db.select(sizes.c.id, sizes.c.product_id, sizes.c.size)
+                .where(sizes.c.product_id.in_(size_products)).order_by(sizes.c.id)):
+            size_ids.setdefault((row.product_id, row.size), row.id)
+
+    # Variant rows by (product_id, color_id, size) for lines without variant_id
+    variant_ids = {}
+    variant_products = {line['product_id'] for line in lines
+                        if kind(line) == 'variant' and not line.get('variant_id')}
+    if variant_products:
+        for row in connection.execute(
+                db.select(variants.c.id, variants.c.product_id, variants.c.color_id, sizes.c.size)
+                .join(sizes, sizes.c.id == variants.c.size_id)
+                .where(variants.c.product_id.in_(variant_products)).order_by(variants.c.id)):
+            variant_ids.setdefault((row.product_id, row.color_id, row.size), row.id)
+
+    totals = {}
+    for line in lines:
+        product_id = line['product_id']
+        line_kind = kind(line)
+        if product_id not in inventory_types:
+            table, row_id, missing = products, None, 'Product not found'
+        elif line_kind == 'variant':
+            row_id = line.get('variant_id') or variant_ids.get(
+                (product_id, line.get('color_id'), line.get('size')))
+            table, missing = variants, 'Selected variant not available'
+        elif line_kind == 'color':
+            table, row_id, missing = colors, line.get('color_id'), 'Select a color'
+        elif line_kind == 'size':
+            row_id = size_ids.get((product_id, line.get('size')))
+            table = sizes
+            missing = 'Selected size not available' if line.get('size') else 'Select a size'
+        else:
+            table, row_id, missing = products, None, None
+
+        if missing and (row_id is None or product_id not in inventory_types):
+            if strict:
+                raise InsufficientStockError(product_id, missing)
+            continue
+        key = (table, row_id, product_id)
+        totals[key] = totals.get(key, 0) + line['quantity']
+
+    # Take rows in a fixed order so concurrent checkouts can't deadlock
+    return sorted(((table, row_id, product_id, quantity)
+                   for (table, row_id, product_id), quantity in totals.items()),
+                  key=lambda r: (r[0].name, r[1] or r[2]))
+
+
+def _sync_totals(connection, resolved):
+    """Recompute Product.stock and in_stock for the products that were changed"""
+    Product.sync_stock(connection, {product_id for _, _, product_id, _ in resolved})
+
+
+def _take(connection, resolved):
+    """Conditionally take each row, raising on the first one that is short"""
+    for table, row_id, product_id, quantity in resolved:
+        if row_id is None:
+            condition = table.c.id == product_id
+        else:
+            condition = db.and_(table.c.id == row_id, table.c.product_id == product_id)
+        result = connection.execute(
+            table.update()
+            .where(condition, table.c.stock >= quantity)
+            .values(stock=table.c.stock - quantity)
+        )
+        if result.rowcount != 1:
+            raise InsufficientStockError(product_id)
+    _sync_totals(connection, resolved)
+
+
+def _apply(connection, resolved, sign):
+    """
+    Add (sign=1) or remove (sign=-1) stock with one executemany UPDATE per
+    table, never going below zero
+    """
+    by_table = {}
+    for table, row_id, product_id, quantity in resolved:
+        by_table.setdefault(table, []).append({
+            'row_id': row_id if row_id is not None else product_id,
+            'delta': sign * quantity
+        })
+    for table, params in by_table.items():
+        new_stock = table.c.stock + bindparam('delta')
+        connection.execute(
+            table.update()
+            .where(table.c.id == bindparam('row_id'))
+            .values(stock=case((new_stock > 0, new_stock), else_=0)),
+            params
+        )
+    _sync_totals(connection, resolved)
+
+
+def _short_lines(connection, resolved):
+    """Products of the lines whose stock row holds less than the line needs"""
+    by_table = {}
+    for table, row_id, product_id, quantity in resolved:
+        by_table.setdefault(table, {})[row_id if row_id is not None else product_id] = (product_id, quantity)
+    short = set()
+    for table, rows in by_table.items():
+        for row_id, stock in connection.execute(
+                db.select(table.c.id, table.c.stock).where(table.c.id.in_(rows)).with_for_update()):
+            product_id, quantity = rows[row_id]
+            if (stock or 0) < quantity:
+                short.add(product_id)
+    return short
+
+
+def _order_lines(connection, order_id):
+    items = OrderItem.__table__
+    return [dict(row._mapping) for row in connection.execute(
+        db.select(items.c.product_id, items.c.quantity, items.c.size,
+                  items.c.color_id, items.c.variant_id)
+        .where(items.c.order_id == order_id)
+    )]
+
+
+def _stock_changed(session, product_ids):
+    """Expire stale stock in the session and remember it for the caches"""
+    product_ids = set(product_ids)
+    for obj in list(session.identity_map.values()):
+        if not isinstance(obj, (Product, ProductVariant, ProductSize, ProductColor)):
+            continue
+        # Read loaded values only; expired objects reload fresh stock anyway
+        state = db.inspect(obj)
+        loaded = state.dict
+        product_id = state.identity[0] if isinstance(obj, Product) else loaded.get('product_id')
+        if product_id not in product_ids or 'stock' not in loaded:
+            continue
+        # Leave pending edits alone; they are written by the flush
+        if not state.attrs.stock.history.has_changes():
+            session.expire(obj, ['stock', 'in_stock'] if isinstance(obj, Product) else ['stock'])
+    collect(session, 'stock').update(product_ids)
+
+
+def reserve_lines(lines):
+    """
+    Take stock for a set of lines in the current transaction
+
+    Raises:
+        InsufficientStockError: if any line is short; the caller rolls back
+    """
+    connection = db.session.connection()
+    resolved = _resolve_lines(connection, lines)
+    _take(connection, resolved)
+    _stock_changed(db.session, {r[2] for r in resolved})
+
+
+def reserve_order_stock(order):
+    """
+    Reserve stock for a new order's items
+
+    Unpaid PayOS orders hold the reservation until it expires. The caller
+    commits, or rolls back on InsufficientStockError.
+    """
+    db.session.flush()
+    reserve_lines(_order_lines(db.session.connection(), order.id))
+    order.stock_reserved = True
+    if order.status == OrderStatus.PENDING_PAYMENT:
+        ttl = current_app.config.get('STOCK_RESERVATION_TTL_MINUTES', DEFAULT_TTL_MINUTES)
+        order.reservation_expires_at = datetime.utcnow() + timedelta(minutes=ttl)
+
+
+def consume_order_stock(order):
+    """
+    Take stock on delivery for an order that reserved none at checkout
+
+    Applies all lines with one UPDATE per inventory table, clamping at zero
+    since the goods have already left, and recomputes the product totals.
+    Only an order that got its full quantities holds them afterwards, so
+    one moved back out of DELIVERED and cancelled returns nothing rather
+    than stock that was never there.
+
+    Returns:
+        int: Number of stock rows updated
+    """
+    connection = db.session.connection()
+    resolved = _resolve_lines(connection, _order_lines(connection, order.id), strict=False)
+    short = _short_lines(connection, resolved)
+    _apply(connection, resolved, -1)
+    _stock_changed(db.session, {r[2] for r in resolved})
+    if short:
+        current_app.logger.warning("Order %s delivered more than the stock of products %s",
+                                   order.id, sorted(short))
+    else:
+        # Stock is now held by this order; delivering it again doesn't take more
+        order.stock_reserved = True
+    return len(resolved)
+
+
+@event.listens_for(db.session, 'before_flush')
+def release_cancelled_orders(session, flush_context, instances):
+    """Return stock when a reserved order is cancelled or deleted before delivery"""
+    releasing = [obj for obj in session.deleted
+                 if isinstance(obj, Order) and obj.stock_reserved]
+    for obj in session.dirty:
+        if isinstance(obj, Order) and obj.stock_reserved and obj.status == OrderStatus.CANCELLED \
+                and db.inspect(obj).attrs.status.history.has_changes():
+            releasing.append(obj)
+    if not releasing:
+        return
+
+    connection = session.connection()
+    # The row still has the status from before this flush; goods that were
+    # delivered have left, so cancelling or deleting the order keeps its stock
+    orders = Order.__table__
+    delivered = set(connection.execute(
+        db.select(orders.c.id).where(orders.c.id.in_([order.id for order in releasing]),
+                                     orders.c.status == OrderStatus.DELIVERED)
+    ).scalars())
+    touched = set()
+    for order in releasing:
+        if order.id in delivered:
+            continue
+        resolved = _resolve_lines(connection, _order_lines(connection, order.id), strict=False)
+        _apply(connection, resolved, 1)
+        touched.update(r[2] for r in resolved)
+        order.stock_reserved = False
+        order.reservation_expires_at = None
+    _stock_changed(session, touched)
+
+
+@on_commit('stock')
+def invalidate_stock_caches(session, touched):
+    from services.cart_cache import cart_summaries
+    from services.home_cache import home_cache
+    from services.count_cache import count_cache
+    cart_summaries.invalidate_products(touched)
+    home_cache.invalidate()
+    # in_stock filters count differently once stock runs out or returns
+    count_cache.invalidate(['products'])
+
+
+def init_inventory(app):
+    """Register the stock reservation CLI command"""
+    @app.cli.command('release-expired-reservations')
+    def release_expired_reservations_command():
+        """Settle unpaid orders whose stock reservation has expired, via the payment reconciler."""
+        # Cancelling without PayOS would leave the payment link open
+        from services.payment_reconciler import payment_reconciler
+        run = payment_reconciler.run_once()
+        click.echo(f"Released stock for {run['cancelled']} expired orders.")
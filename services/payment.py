@@ -5,7 +5,36 @@ import hmac
 import hashlib
 from datetime import datetime
 from flask import current_app
-from payment_providers.payos import PayOSAPI
+from extensions import db
+from models.order import Order
+from payment_providers.payos import PayOSAPI, get_payos_api
 
 # Re-export PayOSAPI from payment_providers
-__all__ = ['PayOSAPI']
\ No newline at end of file
+__all__ = ['PayOSAPI', 'create_payment_link']
+
+
+def create_payment_link(order, amount=None):
+    """
+    Create a PayOS payment link for an order outside any database transaction
+
+    Whatever the session holds is committed first, so the order (and its
+    stock reservation) is saved and the connection goes back to the pool
+    while PayOS answers; a slow gateway then holds no locks or connections.
+
+    Args:
+        order: Order to pay for
+        amount: Amount in VND (default: order.total_amount)
+
+    Returns:
+        tuple: (order reloaded in a new transaction, create_payment() result)
+    """
+    order_id = order.id
+    amount = int(order.total_amount if amount is None else amount)
+    db.session.commit()
+
+    result = get_payos_api().create_payment(
+        order_id=str(order_id),
+        amount=amount,
+        description=f"Order #{order_id}"
+    )
+    return db.session.get(Order, order_id), result
@@ -0,0 +1,337 @@
+"""
+Background reconciliation of unpaid PayOS orders
+
+Orders whose webhook never arrives would otherwise stay in PENDING_PAYMENT,
+holding their reserved stock. Every PAYMENT_RECONCILE_SECONDS a thread per
+process picks orders that have waited longer than
+PAYMENT_RECONCILE_AFTER_SECONDS, or whose reservation has run out, and asks
+PayOS what became of them:
+
+- paid: the order becomes PAID, as if the webhook had arrived
+- cancelled or expired at PayOS: the order is cancelled and its stock released
+- still pending after the reservation ran out: the payment link is cancelled
+  first, so it can't be paid for an order that no longer holds stock
+
+Orders that never got a payment link are cancelled without asking. PayOS
+calls run outside any database transaction, at most
+PAYMENT_RECONCILE_CONCURRENCY at a time and PAYMENT_RECONCILE_RATE per
+second. Each order is then updated in its own transaction through
+apply_payment_status(), so a webhook arriving meanwhile still wins cleanly.
+
+Every worker process runs a reconciler. A pass first claims its orders by
+setting reconcile_claimed_at with a conditional UPDATE, and the others skip
+them for PAYMENT_RECONCILE_SECONDS, so each order is checked about once per
+interval however many processes there are. The concurrency and rate limits
+are per process, though: with N workers PayOS can see up to
+N x PAYMENT_RECONCILE_RATE calls per second. For a global cap, set
+PAYMENT_RECONCILE_SECONDS=0 on the web workers and run
+`flask reconcile-payments` from a single cron job.
+
+Checkout hands a user's earlier unpaid orders over with
+supersede_pending_orders() and leaves the cleanup to the next pass.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import or_
+from extensions import db
+from models.order import Order, OrderStatus
+from models.cart import Cart
+from services.webhook_inbox import apply_payment_status
+
+DEFAULT_INTERVAL_SECONDS = 60
+DEFAULT_AFTER_SECONDS = 600
+DEFAULT_BATCH = 200
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE = 10.0  # PayOS calls per second
+
+# PayOS payment request status -> webhook status with the same effect
+PAYOS_OUTCOMES = {'PAID': 'success', 'CANCELLED': 'cancel', 'EXPIRED': 'cancel'}
+
+CANCEL_NOTE = 'Payment not received in time; stock released.'
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket shared by the reconciler's PayOS calls"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(self._next, now) + 1 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def supersede_pending_orders(user_id):
+    """
+    Expire a user's unpaid orders now, for the reconciler to settle
+
+    One UPDATE instead of cancelling each order during checkout; the
+    reconciler is woken to deal with them straight away.
+
+    Returns:
+        int: Number of orders handed over
+    """
+    now = datetime.utcnow()
+    handed_over = Order.query.filter(
+        Order.user_id == user_id,
+        Order.status == OrderStatus.PENDING_PAYMENT,
+        or_(Order.reservation_expires_at.is_(None), Order.reservation_expires_at > now)
+    ).update({'reservation_expires_at': now, 'reconcile_claimed_at': None}, synchronize_session=False)
+    db.session.commit()
+    if handed_over:
+        payment_reconciler.wake()
+    return handed_over
+
+
+def _unclaimed(now, lease_seconds):
+    return or_(Order.reconcile_claimed_at.is_(None),
+               Order.reconcile_claimed_at < now - timedelta(seconds=lease_seconds))
+
+
+def stale_orders(after_seconds, limit, lease_seconds=DEFAULT_INTERVAL_SECONDS):
+    """(id, checkout_url, expired) for unclaimed unpaid orders due a check, oldest first"""
+    now = datetime.utcnow()
+    rows = db.session.query(
+        Order.id, Order.checkout_url, Order.reservation_expires_at, Order.created_at
+    ).filter(
+        Order.status == OrderStatus.PENDING_PAYMENT,
+        or_(Order.created_at < now - timedelta(seconds=after_seconds),
+            Order.reservation_expires_at <= now),
+        _unclaimed(now, lease_seconds)
+    ).order_by(Order.created_at).limit(limit).all()
+    oldest = min((row.created_at for row in rows if row.created_at), default=None)
+    return [(row.id, row.checkout_url,
+             row.reservation_expires_at is not None and row.reservation_expires_at <= now)
+            for row in rows], oldest
+
+
+def claim_orders(order_ids, lease_seconds=DEFAULT_INTERVAL_SECONDS):
+    """
+    Take orders for this pass unless another reconciler took them within the lease
+
+    Returns:
+        set: Ids of the orders claimed
+    """
+    if not order_ids:
+        return set()
+    now = datetime.utcnow()
+    table = Order.__table__
+    claimable = (table.c.status == OrderStatus.PENDING_PAYMENT, _unclaimed(now, lease_seconds))
+    # Keep updated_at: a claim isn't a change to the order
+    values = {'reconcile_claimed_at': now, 'updated_at': table.c.updated_at}
+    connection = db.session.connection()
+    if connection.dialect.update_returning:
+        claimed = set(connection.execute(
+            table.update().where(table.c.id.in_(order_ids), *claimable).values(values).returning(table.c.id)
+        ).scalars())
+    else:
+        claimed = {order_id for order_id in order_ids if connection.execute(
+            table.update().where(table.c.id == order_id, *claimable).values(values)
+        ).rowcount}
+    db.session.commit()
+    return claimed
+
+
+class PaymentReconciler:
+    """Per-process poller settling unpaid orders with PayOS, with run metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.interval = DEFAULT_INTERVAL_SECONDS
+        self.after_seconds = DEFAULT_AFTER_SECONDS
+        self.batch = DEFAULT_BATCH
+        self.concurrency = DEFAULT_CONCURRENCY
+        self.limiter = RateLimiter(DEFAULT_RATE)
+        # Totals since the process started
+        self.runs = 0
+        self.totals = dict.fromkeys(('checked', 'paid', 'cancelled', 'pending', 'errors'), 0)
+        self.last_run = None
+        self.last_error = None
+
+    def init_app(self, app):
+        self._app = app
+        config = app.config
+        self.interval = config.get('PAYMENT_RECONCILE_SECONDS', DEFAULT_INTERVAL_SECONDS)
+        self.after_seconds = config.get('PAYMENT_RECONCILE_AFTER_SECONDS', DEFAULT_AFTER_SECONDS)
+        self.batch = config.get('PAYMENT_RECONCILE_BATCH') or DEFAULT_BATCH
+        self.concurrency = config.get('PAYMENT_RECONCILE_CONCURRENCY') or DEFAULT_CONCURRENCY
+        self.limiter = RateLimiter(config.get('PAYMENT_RECONCILE_RATE', DEFAULT_RATE))
+
+    def _check(self, api, order_id, cancel_if_pending):
+        """Ask PayOS about one order; runs in the pool, without the database"""
+        with self._app.app_context():
+            self.limiter.acquire()
+            info = api.get_payment_info(str(order_id))
+            if not info.get('success'):
+                return None, None, info.get('error', 'Payment information request failed')
+            data = info.get('data') or {}
+            outcome = PAYOS_OUTCOMES.get(data.get('status'))
+            if outcome is None and cancel_if_pending:
+                self.limiter.acquire()
+                cancelled = api.cancel_payment(str(order_id))
+                if not cancelled.get('success'):
+                    # Maybe paid in the meantime; the next pass asks again
+                    return None, None, cancelled.get('error', 'Payment cancellation failed')
+                outcome = 'cancel'
+            transactions = data.get('transactions') or [{}]
+            return outcome, transactions[-1].get('reference'), None
+
+    def _settle(self, order_id, outcome, transaction_id):
+        """Apply a PayOS outcome in its own transaction; True if the order changed"""
+        try:
+            order, _ = apply_payment_status(order_id, outcome, transaction_id)
+            if order is None:
+                db.session.rollback()
+                return False
+            if order.status == OrderStatus.CANCELLED:
+                order.notes = ((order.notes + '\n') if order.notes else '') + CANCEL_NOTE
+            user_id = order.user_id if order.status == OrderStatus.PAID else None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if user_id is not None:
+            Cart.clear_cart(user_id)
+        return True
+
+    def run_once(self):
+        """
+        One reconciliation pass; call inside an application context
+
+        Returns:
+            dict: Metrics of this pass
+        """
+        from payment_providers.payos import get_payos_api
+        started = time.monotonic()
+        lease = self.interval or DEFAULT_INTERVAL_SECONDS
+        orders, oldest = stale_orders(self.after_seconds, self.batch, lease)
+        # Commits, so no transaction stays open while PayOS answers
+        claimed = claim_orders([order_id for order_id, _, _ in orders], lease)
+        orders = [order for order in orders if order[0] in claimed]
+        run = dict.fromkeys(('checked', 'paid', 'cancelled', 'pending', 'errors'), 0)
+        run['lag_seconds'] = round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0.0
+
+        # Without a payment link there is nothing to ask PayOS about
+        outcomes = [(order_id, 'cancel' if expired else None, None, None)
+                    for order_id, checkout_url, expired in orders if not checkout_url]
+        polled = [(order_id, expired) for order_id, checkout_url, expired in orders if checkout_url]
+        if polled:
+            api = get_payos_api()
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='payment-reconcile') as pool:
+                results = pool.map(lambda order: self._check(api, *order), polled)
+                outcomes.extend((order_id, *result) for (order_id, _), result in zip(polled, results))
+
+        for order_id, outcome, transaction_id, error in outcomes:
+            run['checked'] += 1
+            if error is not None:
+                run['errors'] += 1
+                self.last_error = f"Order {order_id}: {error}"
+                continue
+            if outcome is None:
+                run['pending'] += 1
+                continue
+            try:
+                if self._settle(order_id, outcome, transaction_id):
+                    run['paid' if outcome == 'success' else 'cancelled'] += 1
+            except Exception as e:
+                run['errors'] += 1
+                self.last_error = f"Order {order_id}: {e}"
+                logger.warning("Payment reconciliation failed for order %s: %s", order_id, e)
+
+        run['seconds'] = round(time.monotonic() - started, 3)
+        run['throughput'] = round(run['checked'] / run['seconds'], 2) if run['seconds'] else 0.0
+        run['finished_at'] = datetime.utcnow().isoformat()
+        with self._lock:
+            self.runs += 1
+            for name in self.totals:
+                self.totals[name] += run[name]
+            self.last_run = run
+        if run['paid'] or run['cancelled'] or run['errors']:
+            logger.info("Payment reconciliation: %s", run)
+        return run
+
+    def stats(self):
+        """Lag, throughput and error rate of the last pass, plus totals"""
+        with self._lock:
+            checked = self.totals['checked']
+            return {
+                'runs': self.runs,
+                'interval_seconds': self.interval,
+                'last_run': dict(self.last_run) if self.last_run else None,
+                'totals': dict(self.totals),
+                'error_rate': round(self.totals['errors'] / checked, 4) if checked else 0.0,
+                'last_error': self.last_error,
+                'running': self._thread is not None
+            }
+
+    def start(self):
+        """Start the background passes once per process; a no-op when disabled"""
+        if self._thread is not None or self._app is None or not self.interval:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='payment-reconciler', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """Run a pass now instead of at the end of the interval"""
+        self.start()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            with self._app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    # Orders stay pending; the next pass picks them up
+                    self.last_error = str(e)
+                    logger.warning("Payment reconciliation pass failed: %s", e)
+                finally:
+                    db.session.remove()
+
+
+payment_reconciler = PaymentReconciler()
+
+
+def init_payment_reconciler(app):
+    """Start the reconciler with the first request and register its CLI command"""
+    payment_reconciler.init_app(app)
+    app.before_request(payment_reconciler.start)
+
+    @app.cli.command('reconcile-payments')
+    def reconcile_payments_command():
+        """Settle unpaid PayOS orders that are due a check, once."""
+        run = payment_reconciler.run_once()
+        click.echo(f"Checked {run['checked']} orders: {run['paid']} paid, {run['cancelled']} cancelled, "
+                   f"{run['pending']} still pending, {run['errors']} errors "
+                   f"(lag {run['lag_seconds']}s, {run['throughput']} orders/s).")
@@ -0,0 +1,292 @@
+"""
+Popular products ranking for the e-commerce application
+
+Sales are added to the product_popularity table once per order, in the same
+transaction that moves the order to PAID or DELIVERED, so the home page reads
+the top N products from an index instead of aggregating order history.
+
+With POPULARITY_HALF_LIFE_DAYS set, each sale is weighted by
+2 ** (half-lives since DECAY_EPOCH), so newer sales weigh more without
+rescaling every score as time passes. Unbounded weights would overflow a
+float, so a score is kept on the scale of an epoch that moves forward every
+EPOCH_HALF_LIVES half-lives and carries its epoch in score_epoch. Scores are
+moved to the current epoch when they are next added to, and all at once by
+the first sale recorded in a new epoch.
+
+Orders that are cancelled, refunded or deleted after being recorded are
+taken back out of the ranking, as in the sales rollups.
+"""
+import math
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import event, func, or_, and_, case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from extensions import db
+from models.product import Product
+from models.order import Order, OrderItem, OrderStatus
+from models.popularity import ProductPopularity
+from services.sales_rollup import NOT_SOLD
+
+DECAY_EPOCH = datetime(2025, 1, 1)
+
+# Weights within an epoch stay below 2 ** EPOCH_HALF_LIVES; a score one
+# epoch behind is multiplied by 2 ** -EPOCH_HALF_LIVES to catch up, and one
+# further behind than that counts as nothing
+EPOCH_HALF_LIVES = 64
+EPOCH_FACTOR = 2.0 ** -EPOCH_HALF_LIVES
+
+# Statuses that put an order's items into the ranking
+RECORD_ON = (OrderStatus.PAID, OrderStatus.DELIVERED)
+
+
+def decay_weight(at):
+    """
+    Weight of a sale made at the given time
+
+    Returns:
+        tuple: (epoch, weight on that epoch's scale)
+    """
+    half_life = current_app.config.get('POPULARITY_HALF_LIFE_DAYS')
+    if not half_life:
+        return 0, 1.0
+    half_lives = (at - DECAY_EPOCH).total_seconds() / 86400 / half_life
+    epoch = math.floor(half_lives / EPOCH_HALF_LIVES)
+    return epoch, 2 ** (half_lives - epoch * EPOCH_HALF_LIVES)
+
+
+def _rescale(score, from_epoch, to_epoch):
+    """A score moved from its epoch's scale to a later epoch's"""
+    return score * 2.0 ** (-EPOCH_HALF_LIVES * (to_epoch - from_epoch))
+
+
+def _rescaled(score, from_epoch, to_epoch):
+    """SQL for _rescale()"""
+    return case(
+        (from_epoch == to_epoch, score),
+        (from_epoch == to_epoch - 1, score * EPOCH_FACTOR),
+        else_=0.0
+    )
+
+
+def renormalize_popularity(epoch):
+    """Move every score behind the given epoch onto its scale"""
+    table = ProductPopularity.__table__
+    db.session.connection().execute(table.update().where(table.c.score_epoch < epoch).values(
+        score=_rescaled(table.c.score, table.c.score_epoch, epoch),
+        score_epoch=epoch
+    ))
+
+
+def _add_sales(connection, rows):
+    """
+    Add sales to the ranking with set-based upserts
+
+    Args:
+        rows: list of dicts with product_id, category_id, total_quantity,
+              order_count, and score to add on the scale of score_epoch
+    """
+    if not rows:
+        return
+    table = ProductPopularity.__table__
+    now = datetime.utcnow()
+    for row in rows:
+        row['updated_at'] = now
+
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        stmt = insert(table)
+        epoch = case((table.c.score_epoch > stmt.excluded.score_epoch, table.c.score_epoch),
+                     else_=stmt.excluded.score_epoch)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.product_id],
+            set_={
+                'category_id': stmt.excluded.category_id,
+                'total_quantity': table.c.total_quantity + stmt.excluded.total_quantity,
+                'order_count': table.c.order_count + stmt.excluded.order_count,
+                'score': _rescaled(table.c.score, table.c.score_epoch, epoch)
+                         + _rescaled(stmt.excluded.score, stmt.excluded.score_epoch, epoch),
+                'score_epoch': epoch,
+                'updated_at': stmt.excluded.updated_at
+            }
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        epoch = case((table.c.score_epoch > row['score_epoch'], table.c.score_epoch), else_=row['score_epoch'])
+        updated = connection.execute(table.update().where(table.c.product_id == row['product_id']).values(
+            category_id=row['category_id'],
+            total_quantity=table.c.total_quantity + row['total_quantity'],
+            order_count=table.c.order_count + row['order_count'],
+            score=_rescaled(table.c.score, table.c.score_epoch, epoch) + _rescaled(row['score'], row['score_epoch'], epoch),
+            score_epoch=epoch,
+            updated_at=now
+        ))
+        if not updated.rowcount:
+            connection.execute(table.insert(), [row])
+
+
+def _order_sales(connection, order_id):
+    """(product_id, category_id, quantity) of an order's items"""
+    return connection.execute(db.select(
+        OrderItem.product_id,
+        Product.category_id,
+        func.sum(OrderItem.quantity)
+    ).join(
+        Product, Product.id == OrderItem.product_id
+    ).where(
+        OrderItem.order_id == order_id
+    ).group_by(OrderItem.product_id, Product.category_id)).all()
+
+
+def record_order(order):
+    """
+    Add an order's items to the ranking when it reaches PAID or DELIVERED
+
+    Each order is recorded at most once; the caller commits.
+
+    Returns:
+        bool: True if the order was recorded by this call
+    """
+    if order.popularity_recorded_at is not None or order.status not in RECORD_ON:
+        return False
+
+    now = datetime.utcnow()
+    epoch, weight = decay_weight(now)
+    connection = db.session.connection()
+    renormalize_popularity(epoch)
+    _add_sales(connection, [{
+        'product_id': product_id,
+        'category_id': category_id,
+        'total_quantity': int(quantity),
+        'order_count': 1,
+        'score': int(quantity) * weight,
+        'score_epoch': epoch
+    } for product_id, category_id, quantity in _order_sales(connection, order.id)])
+    order.popularity_recorded_at = now
+    return True
+
+
+@event.listens_for(db.session, 'before_flush')
+def remove_unsold_orders(session, flush_context, instances):
+    """Take recorded orders that are cancelled, refunded or deleted back out"""
+    removing = [obj for obj in session.deleted
+                if isinstance(obj, Order) and obj.popularity_recorded_at is not None]
+    for obj in session.dirty:
+        if isinstance(obj, Order) and obj.popularity_recorded_at is not None and obj.status in NOT_SOLD \
+                and db.inspect(obj).attrs.status.history.has_changes():
+            removing.append(obj)
+    if not removing:
+        return
+
+    connection = session.connection()
+    for order in removing:
+        epoch, weight = decay_weight(order.popularity_recorded_at)
+        _add_sales(connection, [{
+            'product_id': product_id,
+            'category_id': category_id,
+            'total_quantity': -int(quantity),
+            'order_count': -1,
+            'score': -int(quantity) * weight,
+            'score_epoch': epoch
+        } for product_id, category_id, quantity in _order_sales(connection, order.id)])
+        # Recorded again if it is ever paid after all
+        order.popularity_recorded_at = None
+
+
+def _sold_filter():
+    """Orders that count as sold when rebuilding from history"""
+    return and_(Order.status.notin_(NOT_SOLD), or_(
+        Order.popularity_recorded_at.isnot(None),
+        Order.status.in_(RECORD_ON),
+        # Online payments already moved past PAID
+        and_(Order.status.in_([OrderStatus.PROCESSING, OrderStatus.SHIPPED]),
+             Order.payment_method != 'cod')
+    ))
+
+
+def rebuild_popularity():
+    """
+    Recompute the whole ranking from order history
+
+    Used to backfill the table and after changing the decay half-life.
+    """
+    ProductPopularity.query.delete()
+    epoch, _ = decay_weight(datetime.utcnow())
+    recorded_at = func.coalesce(Order.popularity_recorded_at, Order.updated_at, Order.created_at)
+
+    totals = {}
+    rows = db.session.query(
+        OrderItem.product_id,
+        Product.category_id,
+        OrderItem.order_id,
+        OrderItem.quantity,
+        recorded_at.label('recorded_at')
+    ).join(Order, Order.id == OrderItem.order_id)\
+        .join(Product, Product.id == OrderItem.product_id)\
+        .filter(_sold_filter())\
+        .yield_per(5000)
+
+    for row in rows:
+        entry = totals.setdefault(row.product_id, {
+            'product_id': row.product_id,
+            'category_id': row.category_id,
+            'total_quantity': 0,
+            'order_ids': set(),
+            'score': 0.0,
+            'score_epoch': epoch
+        })
+        entry['total_quantity'] += row.quantity
+        entry['order_ids'].add(row.order_id)
+        sale_epoch, weight = decay_weight(row.recorded_at or DECAY_EPOCH)
+        entry['score'] += _rescale(row.quantity * weight, sale_epoch, epoch)
+
+    for entry in totals.values():
+        entry['order_count'] = len(entry.pop('order_ids'))
+    _add_sales(db.session.connection(), list(totals.values()))
+
+    Order.query.filter(_sold_filter(), Order.popularity_recorded_at.is_(None))\
+        .update({Order.popularity_recorded_at: recorded_at}, synchronize_session=False)
+    db.session.commit()
+    return len(totals)
+
+
+def get_popular_products(category_id=None, limit=8):
+    """Top selling active products, optionally within one category"""
+    query = Product.query.join(
+        ProductPopularity, ProductPopularity.product_id == Product.id
+    ).filter(
+        Product.is_active == True,
+        # Rows stay behind at zero once every order for them is cancelled
+        ProductPopularity.total_quantity > 0
+    )
+
+    if category_id:
+        query = query.filter(ProductPopularity.category_id == category_id)
+
+    return query.order_by(
+        ProductPopularity.score.desc(),
+        ProductPopularity.order_count.desc()
+    ).limit(limit).all()
+
+
+@event.listens_for(Product, 'after_update')
+def move_popularity_category(mapper, connection, target):
+    """Keep the denormalized category in step with the product"""
+    if db.inspect(target).attrs.category_id.history.has_changes():
+        table = ProductPopularity.__table__
+        connection.execute(
+            table.update().where(table.c.product_id == target.id).values(category_id=target.category_id)
+        )
+
+
+def init_popularity(app):
+    """Register the popularity CLI command"""
+    @app.cli.command('rebuild-popularity')
+    def rebuild_popularity_command():
+        """Recompute the popular products ranking from order history."""
+        count = rebuild_popularity()
+        click.echo(f'Popularity ranking rebuilt for {count} products.')
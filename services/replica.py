@@ -0,0 +1,157 @@
+"""
+Read replica routing for the e-commerce application
+
+With a 'replica' entry in SQLALCHEMY_BINDS, read-only pages (the main
+blueprint, product listings, reviews, admin analytics) send their plain
+SELECTs to the replica engine so they don't compete with checkout writes
+on the primary. Everything else, and any request that writes, stays on
+the primary.
+
+Replicas lag behind, so a user who has just written reads from the primary
+for REPLICA_STICKY_SECONDS afterwards (read-your-writes). The mark lives
+in the Flask session, so it follows the user across requests and workers.
+
+Shared per-process caches are filled with primary_reads(): a commit drops
+them, and refilling them from a replica that hasn't caught up yet would
+keep serving the old data for the whole TTL.
+
+For development and tests SQLiteReplicator stands in for replication by
+copying the primary SQLite file to the replica file every
+REPLICA_SYNC_INTERVAL seconds.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import click
+from flask import current_app, has_request_context, session as flask_session
+from sqlalchemy import event
+from extensions import db
+from services.session_hooks import on_commit, mark
+
+DEFAULT_STICKY_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+# Flask session key holding the time until which the user reads the primary
+_STICKY_KEY = '_primary_until'
+
+
+def replica_enabled():
+    return 'replica' in current_app.config.get('SQLALCHEMY_BINDS', {})
+
+
+def use_replica():
+    """
+    Send this request's plain SELECTs to the replica unless the user wrote
+    recently; usable as a before_request hook
+    """
+    if replica_enabled() and flask_session.get(_STICKY_KEY, 0) <= time.time():
+        db.session.info['read_replica'] = True
+
+
+def replica_reads(view):
+    """Decorator for read-only views that may be served from the replica"""
+    @wraps(view)
+    def decorated_view(*args, **kwargs):
+        use_replica()
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. to fill a shared cache"""
+    replica = db.session.info.pop('read_replica', None)
+    try:
+        yield
+    finally:
+        if replica:
+            db.session.info['read_replica'] = replica
+
+
+@event.listens_for(db.session, 'after_flush')
+def note_write(session, flush_context):
+    mark(session, 'replica_write')
+
+
+@on_commit('replica_write')
+def stick_to_primary(session, wrote):
+    """Keep the user on the primary until the replica has caught up"""
+    if has_request_context() and replica_enabled():
+        sticky = current_app.config.get('REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+        flask_session[_STICKY_KEY] = time.time() + sticky
+        # The rest of this request mustn't read past its own write either
+        session.info.pop('read_replica', None)
+
+
+class SQLiteReplicator:
+    """Copies the primary SQLite file to the replica file in the background"""
+
+    def __init__(self, primary_path, replica_path, interval):
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.copies = 0
+
+    def sync(self):
+        """Copy the primary's committed state to the replica"""
+        source = sqlite3.connect(self.primary_path, timeout=30)
+        target = sqlite3.connect(self.replica_path, timeout=30)
+        try:
+            source.backup(target)
+            self.copies += 1
+        finally:
+            target.close()
+            source.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sqlite-replicator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                # Try again on the next tick; the replica just lags a little more
+                logger.warning(f"Replica sync failed: {e}")
+
+
+def _sqlite_replicator(app):
+    with app.app_context():
+        primary = db.engines[None]
+        replica = db.engines.get('replica')
+    if replica is None or primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        return None
+    return SQLiteReplicator(primary.url.database, replica.url.database,
+                            app.config.get('REPLICA_SYNC_INTERVAL') or 1.0)
+
+
+def init_replica(app):
+    """Start the SQLite replication stand-in if configured and register its CLI command"""
+    if 'replica' in app.config.get('SQLALCHEMY_BINDS', {}) and app.config.get('REPLICA_SYNC_INTERVAL'):
+        replicator = _sqlite_replicator(app)
+        if replicator is not None:
+            replicator.sync()
+            replicator.start()
+            app.extensions['sqlite_replicator'] = replicator
+
+    @app.cli.command('sync-replica')
+    def sync_replica_command():
+        """Copy the primary SQLite database to the replica file once."""
+        replicator = _sqlite_replicator(app)
+        if replicator is None:
+            click.echo('No SQLite replica bind is configured.')
+            return
+        replicator.sync()
+        click.echo(f'Copied {replicator.primary_path} to {replicator.replica_path}.')
@@ -0,0 +1,235 @@
+"""
+Daily sales rollups for the admin analytics
+
+daily_sales holds orders and revenue per day and daily_product_sales holds
+units and revenue per product per day. Both are kept in step with the
+orders in the same flush that creates, re-prices, cancels or deletes them.
+Analytics charts then read one row per day, however long the order history
+gets.
+
+An order counts from the day it was placed until it is cancelled or
+refunded; moving back out of those statuses counts it again.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import event, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from extensions import db
+from models.product import Product
+from models.order import Order, OrderItem, OrderStatus
+from models.daily_sales import DailySales, DailyProductSales
+
+# Statuses that take an order out of the sales figures
+NOT_SOLD = (OrderStatus.CANCELLED, OrderStatus.REFUNDED)
+
+# Longest history a report looks back over
+MAX_DAYS = 3650
+
+
+def is_sold(status):
+    # New orders flushed without a status get the PENDING_PAYMENT default
+    return status not in NOT_SOLD
+
+
+def _sold_filter():
+    return Order.status.notin_(NOT_SOLD)
+
+
+def _add(connection, table, keys, values, rows):
+    """
+    Add to rollup rows with set-based upserts
+
+    Args:
+        keys: primary key column names
+        values: names of the columns to add to
+        rows: list of dicts with the keys and the amounts to add
+    """
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c[key] for key in keys],
+            set_={name: table.c[name] + stmt.excluded[name] for name in values}
+        )
+        connection.execute(stmt, rows)
+        return
+
+    for row in rows:
+        match = [table.c[key] == row[key] for key in keys]
+        updated = connection.execute(table.update().where(*match).values(
+            {name: table.c[name] + row[name] for name in values}
+        ))
+        if not updated.rowcount:
+            connection.execute(table.insert(), [row])
+
+
+def _day(order):
+    if order.created_at is None:
+        # Set the column default here so the rollup and the order agree on the day
+        order.created_at = datetime.utcnow()
+    return order.created_at.date()
+
+
+def committed_value(connection, order, attr):
+    """Value of an order attribute before this flush"""
+    history = db.inspect(order).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if not history.has_changes() or order.id is None:
+        return getattr(order, attr)
+    # Set without having been loaded first; read what the database holds
+    return connection.execute(
+        db.select(getattr(Order, attr)).where(Order.id == order.id)
+    ).scalar()
+
+
+def _order_lines(connection, order_id):
+    return connection.execute(db.select(
+        OrderItem.product_id,
+        func.sum(OrderItem.quantity),
+        func.sum(OrderItem.quantity * OrderItem.price)
+    ).where(OrderItem.order_id == order_id).group_by(OrderItem.product_id)).all()
+
+
+@event.listens_for(db.session, 'before_flush')
+def roll_up_sales(session, flush_context, instances):
+    """Apply this flush's order changes to the daily rollups"""
+    if not any(isinstance(obj, (Order, OrderItem))
+               for obj in (*session.new, *session.dirty, *session.deleted)):
+        return
+
+    connection = session.connection()
+    days = defaultdict(lambda: [0, 0])
+    products = defaultdict(lambda: [0, 0])
+
+    def add_lines(order, lines, sign):
+        day = _day(order)
+        for product_id, quantity, revenue in lines:
+            products[(day, product_id)][0] += sign * int(quantity or 0)
+            products[(day, product_id)][1] += sign * int(revenue or 0)
+
+    deleted_orders = {obj for obj in session.deleted if isinstance(obj, Order)}
+
+    for obj in session.new:
+        if isinstance(obj, Order) and is_sold(obj.status):
+            days[_day(obj)][0] += 1
+            days[_day(obj)][1] += obj.total_amount or 0
+
+    for obj in session.dirty:
+        if not isinstance(obj, Order) or not session.is_modified(obj):
+            continue
+        attrs = db.inspect(obj).attrs
+        if not (attrs.status.history.has_changes() or attrs.total_amount.history.has_changes()):
+            continue
+        was = is_sold(committed_value(connection, obj, 'status'))
+        now = is_sold(obj.status)
+        old_total = committed_value(connection, obj, 'total_amount') or 0
+        days[_day(obj)][0] += now - was
+        days[_day(obj)][1] += ((obj.total_amount or 0) if now else 0) - (old_total if was else 0)
+        if was != now:
+            # Lines already in the database; new lines are added below
+            add_lines(obj, _order_lines(connection, obj.id), 1 if now else -1)
+
+    for obj in deleted_orders:
+        if is_sold(committed_value(connection, obj, 'status')):
+            days[_day(obj)][0] -= 1
+            days[_day(obj)][1] -= committed_value(connection, obj, 'total_amount') or 0
+            add_lines(obj, _order_lines(connection, obj.id), -1)
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(obj, OrderItem):
+            continue
+        order = obj.order or (session.get(Order, obj.order_id) if obj.order_id else None)
+        if order is None or order in deleted_orders or not is_sold(order.status):
+            continue
+        if obj in session.new:
+            add_lines(order, [(obj.product_id, obj.quantity, (obj.quantity or 0) * (obj.price or 0))], 1)
+            continue
+        attrs = db.inspect(obj).attrs
+        old_quantity = attrs.quantity.history.deleted[0] if attrs.quantity.history.deleted else obj.quantity
+        old_price = attrs.price.history.deleted[0] if attrs.price.history.deleted else obj.price
+        add_lines(order, [(obj.product_id, old_quantity, (old_quantity or 0) * (old_price or 0))], -1)
+        if obj not in session.deleted:
+            add_lines(order, [(obj.product_id, obj.quantity, (obj.quantity or 0) * (obj.price or 0))], 1)
+
+    _add(connection, DailySales.__table__, ['date'], ['order_count', 'revenue'], [
+        {'date': day, 'order_count': count, 'revenue': revenue}
+        for day, (count, revenue) in days.items() if count or revenue
+    ])
+    _add(connection, DailyProductSales.__table__, ['date', 'product_id'], ['quantity', 'revenue'], [
+        {'date': day, 'product_id': product_id, 'quantity': quantity, 'revenue': revenue}
+        for (day, product_id), (quantity, revenue) in products.items() if quantity or revenue
+    ])
+
+
+def rebuild_sales_rollup():
+    """
+    Recompute both rollups from order history
+
+    Used to backfill the tables after upgrading.
+
+    Returns:
+        tuple: number of day rows and of product-day rows written
+    """
+    day = func.date(Order.created_at)
+    DailyProductSales.query.delete()
+    DailySales.query.delete()
+
+    db.session.execute(DailySales.__table__.insert().from_select(
+        ['date', 'order_count', 'revenue'],
+        db.select(day, func.count(Order.id), func.coalesce(func.sum(Order.total_amount), 0))
+        .where(_sold_filter(), Order.created_at.isnot(None))
+        .group_by(day)
+    ))
+    db.session.execute(DailyProductSales.__table__.insert().from_select(
+        ['date', 'product_id', 'quantity', 'revenue'],
+        db.select(day, OrderItem.product_id, func.sum(OrderItem.quantity),
+                  func.sum(OrderItem.quantity * OrderItem.price))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(_sold_filter(), Order.created_at.isnot(None))
+        .group_by(day, OrderItem.product_id)
+    ))
+    db.session.commit()
+    return DailySales.query.count(), DailyProductSales.query.count()
+
+
+def _since(days):
+    return (datetime.utcnow() - timedelta(days=min(max(days, 1), MAX_DAYS))).date()
+
+
+def sales_by_day(days=30):
+    """Order count and revenue for each day with sales in the last N days"""
+    return DailySales.query.filter(
+        DailySales.date >= _since(days),
+        DailySales.order_count > 0
+    ).order_by(DailySales.date).all()
+
+
+def top_products(days=30, limit=10):
+    """Best selling products by units over the last N days"""
+    quantity = func.sum(DailyProductSales.quantity)
+    return db.session.query(
+        Product.name,
+        quantity.label('total_quantity'),
+        func.sum(DailyProductSales.revenue).label('total_revenue')
+    ).join(
+        Product, Product.id == DailyProductSales.product_id
+    ).filter(
+        DailyProductSales.date >= _since(days)
+    ).group_by(
+        Product.id, Product.name
+    ).having(quantity > 0).order_by(quantity.desc()).limit(limit).all()
+
+
+def init_sales_rollup(app):
+    """Register the sales rollup CLI command"""
+    @app.cli.command('backfill-sales-rollup')
+    def backfill_sales_rollup_command():
+        """Recompute the daily sales rollups from order history."""
+        day_rows, product_rows = rebuild_sales_rollup()
+        click.echo(f'Sales rollup rebuilt: {day_rows} days, {product_rows} product days.')
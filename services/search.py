@@ -0,0 +1,188 @@
+"""
+Full-text product search for the e-commerce application
+
+SQLite databases get an FTS5 virtual table kept in sync with the products
+table through SQLAlchemy mapper events. PostgreSQL uses a GIN expression
+index over a tsvector, which the database maintains on its own. Any other
+dialect falls back to per-term ILIKE filters.
+"""
+import re
+import click
+from sqlalchemy import event, text, func, or_, and_, false, literal_column
+from extensions import db
+from models.product import Product
+
+FTS_TABLE = 'products_fts'
+
+# Name matches weigh more than description matches when ranking
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+PG_VECTOR = ("to_tsvector('simple', coalesce(products.name, '') || ' ' || "
+             "coalesce(products.description, ''))")
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# unicode61 strips Vietnamese tone marks but keeps đ, which has no decomposition
+_FOLD_TABLE = str.maketrans({'đ': 'd', 'Đ': 'D'})
+
+# Engine URLs whose search index is known to exist
+_ready_engines = set()
+
+
+def fold(value):
+    """Fold characters the FTS tokenizer does not strip itself"""
+    return (value or '').translate(_FOLD_TABLE)
+
+
+def search_terms(search):
+    """Split a raw search string into index terms"""
+    return _TERM_RE.findall(fold(search))
+
+
+def _fts5_match(terms):
+    """Build an FTS5 MATCH expression where every term is a prefix match"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _pg_tsquery(terms):
+    """Build a PostgreSQL tsquery where every term is a prefix match"""
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _fts_table_exists(connection):
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first() is not None
+
+
+def _create_index(connection):
+    """
+    Create the search index for the connection's dialect if it is missing
+
+    A freshly created SQLite index is backfilled from the products table.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        if _fts_table_exists(connection):
+            return
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "name, description, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        rows = connection.execute(text("SELECT id, name, description FROM products")).fetchall()
+        if rows:
+            connection.execute(
+                text(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (:id, :name, :description)"),
+                [{'id': row.id, 'name': fold(row.name), 'description': fold(row.description)} for row in rows]
+            )
+    elif dialect == 'postgresql':
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_products_search ON products USING GIN ({PG_VECTOR})"
+        ))
+
+
+def ensure_search_index():
+    """Make sure the search index exists on the current engine"""
+    key = str(db.engine.url)
+    if key in _ready_engines:
+        return
+    with db.engine.begin() as connection:
+        _create_index(connection)
+    _ready_engines.add(key)
+
+
+def rebuild_search_index():
+    """Drop and rebuild the search index from the products table"""
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+        elif connection.dialect.name == 'postgresql':
+            connection.execute(text("DROP INDEX IF EXISTS ix_products_search"))
+        _create_index(connection)
+    _ready_engines.add(str(db.engine.url))
+
+
+def apply_search(query, search):
+    """
+    Restrict a Product query to full-text matches, best matches first
+
+    Args:
+        query: Product query to filter; other filters and pagination still apply
+        search: Raw search string entered by the user
+
+    Returns:
+        The filtered and ranked query, or the original query for a blank search
+    """
+    if not (search or '').strip():
+        return query
+    terms = search_terms(search)
+    if not terms:
+        # Nothing indexable, e.g. punctuation only
+        return query.filter(false())
+
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        ensure_search_index()
+        hits = text(
+            f"SELECT rowid AS product_id, "
+            f"bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS rank "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        ).bindparams(match=_fts5_match(terms)).columns(
+            product_id=db.Integer, rank=db.Float
+        ).subquery('search_hits')
+        # bm25() is lower for better matches
+        return query.join(hits, hits.c.product_id == Product.id)\
+            .order_by(hits.c.rank, Product.id)
+
+    if dialect == 'postgresql':
+        ensure_search_index()
+        vector = literal_column(PG_VECTOR)
+        tsquery = func.to_tsquery('simple', _pg_tsquery(terms))
+        return query.filter(vector.op('@@')(tsquery))\
+            .order_by(func.ts_rank(vector, tsquery).desc(), Product.id)
+
+    return query.filter(and_(*[
+        or_(Product.name.ilike(f'%{term}%'), Product.description.ilike(f'%{term}%'))
+        for term in terms
+    ])).order_by(Product.name, Product.id)
+
+
+def _sync_product(connection, product, deleted=False):
+    """Mirror one product row into the SQLite FTS table"""
+    if connection.dialect.name != 'sqlite':
+        return
+    _create_index(connection)
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': product.id})
+    if not deleted:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (:id, :name, :description)"),
+            {'id': product.id, 'name': fold(product.name), 'description': fold(product.description)}
+        )
+
+
+@event.listens_for(Product, 'after_insert')
+def index_new_product(mapper, connection, target):
+    _sync_product(connection, target)
+
+
+@event.listens_for(Product, 'after_update')
+def reindex_product(mapper, connection, target):
+    state = db.inspect(target)
+    if state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes():
+        _sync_product(connection, target)
+
+
+@event.listens_for(Product, 'after_delete')
+def unindex_product(mapper, connection, target):
+    _sync_product(connection, target, deleted=True)
+
+
+def init_search(app):
+    """Register the search index CLI command"""
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Rebuild the full-text product search index."""
+        rebuild_search_index()
+        click.echo('Search index rebuilt.')
@@ -0,0 +1,75 @@
+"""
+Work deferred until the session commits
+
+Caches, counters and socket emits act on what a transaction changed, but
+only once it has committed. Listeners gather that state with collect() or
+mark() while flushing, and the handler registered for the key with
+@on_commit gets it after the commit.
+
+Rolling back the whole transaction discards everything gathered. Rolling
+back a savepoint only discards what was gathered inside it: changes
+flushed before the savepoint still commit.
+"""
+import copy
+from sqlalchemy import event
+from extensions import db
+
+PENDING = 'on_commit'
+SAVEPOINTS = 'on_commit_savepoints'
+
+# key -> handler(session, payload), run in registration order
+_handlers = {}
+
+
+def on_commit(key):
+    """Register the decorated handler(session, payload) for a key"""
+    def decorator(handler):
+        _handlers[key] = handler
+        return handler
+    return decorator
+
+
+def collect(session, key, factory=set):
+    """What this transaction has gathered under a key, created with factory() on first use"""
+    pending = session.info.setdefault(PENDING, {})
+    if key not in pending:
+        pending[key] = factory()
+    return pending[key]
+
+
+def mark(session, key):
+    """Flag a key; its handler gets True after the commit"""
+    session.info.setdefault(PENDING, {})[key] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def run_commit_handlers(session):
+    if session.in_nested_transaction():
+        # Releasing a savepoint; the outer transaction may still roll back
+        return
+    session.info.pop(SAVEPOINTS, None)
+    pending = session.info.pop(PENDING, None)
+    if not pending:
+        return
+    for key, handler in _handlers.items():
+        if pending.get(key):
+            handler(session, pending[key])
+
+
+@event.listens_for(db.session, 'after_transaction_create')
+def remember_savepoint(session, transaction):
+    if transaction.nested:
+        pending = session.info.get(PENDING, {})
+        session.info.setdefault(SAVEPOINTS, {})[transaction] = {
+            key: copy.copy(payload) for key, payload in pending.items()}
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_pending(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(PENDING, None)
+        session.info.pop(SAVEPOINTS, None)
+    elif previous_transaction.nested:
+        saved = session.info.get(SAVEPOINTS, {}).pop(previous_transaction, None)
+        if saved is not None:
+            session.info[PENDING] = saved
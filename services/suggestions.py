@@ -0,0 +1,274 @@
+"""
+In-memory search suggestion index for the e-commerce application
+
+Every worker process keeps a sorted prefix index over the names of active
+products so autocomplete requests are answered without a database query.
+The index is loaded on first use and then patched from committed sessions.
+Other processes' commits don't reach it, so it is also reloaded once
+RELOAD_TTL has passed, while the old index keeps answering.
+"""
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from sqlalchemy import event
+from extensions import db
+from models.product import Product
+from models.product_image import ProductImage
+from services.session_hooks import on_commit, collect
+from services.replica import primary_reads
+
+SUGGESTION_LIMIT = 10
+RELOAD_TTL = 60  # seconds
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(value):
+    """
+    Lowercase text and strip diacritics so "Điện Thoại" matches "dien thoai"
+
+    Returns:
+        list: Normalized words
+    """
+    value = (value or '').lower().replace('đ', 'd')
+    value = ''.join(ch for ch in unicodedata.normalize('NFD', value)
+                    if unicodedata.category(ch) != 'Mn')
+    return _WORD_RE.findall(value)
+
+
+def load_suggestions(session, product_ids=None):
+    """
+    Build the suggestion payloads served to search.js, reading only the
+    columns they show
+
+    Args:
+        product_ids: Only these products (default: every active one)
+
+    Returns:
+        dict: product_id -> suggestion dict, for active products
+    """
+    products = Product.__table__
+    images = ProductImage.__table__
+    query = db.select(products.c.id, products.c.name, products.c.price,
+                      products.c.discount_price, products.c.image_url)\
+        .where(products.c.is_active == True)
+    # Primary image first, as Product.images is ordered
+    image_query = db.select(images.c.product_id, images.c.image_url)\
+        .join(products, products.c.id == images.c.product_id)\
+        .where(products.c.is_active == True)\
+        .order_by(images.c.is_primary.desc(), images.c.id)
+    if product_ids is not None:
+        query = query.where(products.c.id.in_(product_ids))
+        image_query = image_query.where(images.c.product_id.in_(product_ids))
+
+    image_urls = {}
+    for product_id, image_url in session.execute(image_query):
+        image_urls.setdefault(product_id, image_url)
+
+    suggestions = {}
+    for row in session.execute(query):
+        # Same as Product.price_display and Product.image_url_or_placeholder
+        price = row.discount_price if row.discount_price is not None else row.price
+        if row.id in image_urls:
+            image = image_urls[row.id]
+        else:
+            image = row.image_url or 'images/placeholder.jpg'
+        suggestions[row.id] = {
+            'id': row.id,
+            'name': row.name,
+            'price': "{:,.0f}".format(price),
+            'image': image,
+            'url': f'/products/{row.id}'
+        }
+    return suggestions
+
+
+class SuggestionIndex:
+    """Sorted word-start index over active product names"""
+
+    def __init__(self, ttl=RELOAD_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._reloading = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0
+        # Changes committed while a load is reading, applied again on top of it
+        self._replay = None
+        self._entries = {}  # product_id -> suggestion dict
+        self._keys = {}     # product_id -> (leading key, [inner keys])
+        # Sorted (key, product_id) pairs. A key is the normalized name from
+        # one word onwards, so a prefix lookup matches any word start.
+        self._leading = []
+        self._inner = []
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """Build the index from all active products in two queries"""
+        with self._reloading:
+            self._load()
+
+    def _load(self):
+        with self._lock:
+            self._replay = []
+        try:
+            with primary_reads():
+                suggestions = load_suggestions(db.session)
+            # Build aside, so lookups keep using the current index meanwhile
+            fresh = SuggestionIndex(self.ttl)
+            for entry in suggestions.values():
+                fresh._add(entry)
+            fresh._leading.sort()
+            fresh._inner.sort()
+            with self._lock:
+                self._entries = fresh._entries
+                self._keys = fresh._keys
+                self._leading = fresh._leading
+                self._inner = fresh._inner
+                self._loaded = True
+                self._loaded_at = time.monotonic()
+                for changes in self._replay:
+                    self._apply(changes)
+        finally:
+            with self._lock:
+                self._replay = None
+
+    def _refresh(self):
+        """Load on first use, and reload once the TTL has passed"""
+        if self._loaded:
+            # One thread reloads; the others answer from the current index
+            if time.monotonic() - self._loaded_at < self.ttl or not self._reloading.acquire(blocking=False):
+                return
+        else:
+            self._reloading.acquire()
+            if self._loaded:
+                # Another thread loaded it while this one waited
+                self._reloading.release()
+                return
+        try:
+            self._load()
+        finally:
+            self._reloading.release()
+
+    def reset(self):
+        """Drop the index; it is rebuilt on next use"""
+        with self._lock:
+            self._loaded = False
+            self._entries.clear()
+            self._keys.clear()
+            self._leading = []
+            self._inner = []
+
+    def _add(self, entry, keep_sorted=False):
+        words = normalize(entry['name'])
+        if not words:
+            return
+        product_id = entry['id']
+        leading = ' '.join(words)
+        inner = [' '.join(words[i:]) for i in range(1, len(words))]
+        self._entries[product_id] = entry
+        self._keys[product_id] = (leading, inner)
+        if keep_sorted:
+            insort(self._leading, (leading, product_id))
+            for key in inner:
+                insort(self._inner, (key, product_id))
+        else:
+            self._leading.append((leading, product_id))
+            self._inner.extend((key, product_id) for key in inner)
+
+    def _remove(self, product_id):
+        self._entries.pop(product_id, None)
+        keys = self._keys.pop(product_id, None)
+        if not keys:
+            return
+        leading, inner = keys
+        for sorted_keys, key in [(self._leading, leading)] + [(self._inner, k) for k in inner]:
+            i = bisect_left(sorted_keys, (key, product_id))
+            if i < len(sorted_keys) and sorted_keys[i] == (key, product_id):
+                del sorted_keys[i]
+
+    def apply(self, changes):
+        """
+        Apply committed product changes
+
+        Args:
+            changes: dict of product_id -> suggestion dict, or None to remove
+        """
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(changes)
+            if self._loaded:
+                self._apply(changes)
+
+    def _apply(self, changes):
+        for product_id, entry in changes.items():
+            self._remove(product_id)
+            if entry is not None:
+                self._add(entry, keep_sorted=True)
+
+    def suggest(self, query, limit=SUGGESTION_LIMIT):
+        """
+        Get suggestions for a search prefix
+
+        Products whose name starts with the query come first, followed by
+        products with a later word starting with it.
+        """
+        prefix = ' '.join(normalize(query))
+        if not prefix:
+            return []
+        self._refresh()
+
+        results = []
+        seen = set()
+        with self._lock:
+            for sorted_keys in (self._leading, self._inner):
+                i = bisect_left(sorted_keys, (prefix,))
+                while i < len(sorted_keys) and sorted_keys[i][0].startswith(prefix):
+                    product_id = sorted_keys[i][1]
+                    if product_id not in seen:
+                        seen.add(product_id)
+                        results.append(self._entries[product_id])
+                        if len(results) >= limit:
+                            return results
+                    i += 1
+        return results
+
+
+suggestion_index = SuggestionIndex()
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_suggestion_changes(session, flush_context):
+    """Remember which products a flush touched"""
+    touched = session.info.setdefault('suggestion_touched', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            touched[obj.id] = touched.get(obj.id, False) or obj in session.deleted
+        elif isinstance(obj, ProductImage) and obj.product_id:
+            touched.setdefault(obj.product_id, False)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def snapshot_suggestion_changes(session, flush_context):
+    """Snapshot touched products once the flush has settled"""
+    touched = session.info.pop('suggestion_touched', None)
+    if not touched:
+        return
+    changes = collect(session, 'suggestions', dict)
+    # Read from the rows this flush wrote, not from objects in the session
+    kept = [product_id for product_id, deleted in touched.items() if not deleted]
+    suggestions = load_suggestions(session, kept) if kept else {}
+    for product_id in touched:
+        changes[product_id] = suggestions.get(product_id)
+
+
+@on_commit('suggestions')
+def apply_suggestion_changes(session, changes):
+    suggestion_index.apply(changes)
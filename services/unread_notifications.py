@@ -0,0 +1,182 @@
+"""
+Unread notification counters for the e-commerce application
+
+users.unread_notifications is adjusted in the same flush that adds, reads
+or deletes a notification, so the bell badge is a primary key lookup
+instead of a COUNT(*) over the user's notifications.
+
+After commit, the users whose count changed get a 'notification' socket
+event. Events are coalesced per user over NOTIFICATION_EMIT_WINDOW
+seconds, so a burst of notifications sends one event carrying the final
+count.
+"""
+import logging
+import threading
+import click
+from sqlalchemy import event, func
+from extensions import db, socketio
+from models.user import User
+from models.notification import Notification
+from services.session_hooks import on_commit, collect
+
+DEFAULT_EMIT_WINDOW = 0.25  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+def unread_count(user_id):
+    count = db.session.execute(
+        db.select(User.unread_notifications).where(User.id == user_id)
+    ).scalar()
+    return max(count or 0, 0)
+
+
+def _add_unread(connection, changes):
+    users = User.__table__
+    for user_id, delta in changes.items():
+        if delta:
+            # Keep updated_at: a notification isn't a change to the user
+            connection.execute(users.update().where(users.c.id == user_id).values(
+                unread_notifications=users.c.unread_notifications + delta,
+                updated_at=users.c.updated_at
+            ))
+
+
+def _touch(session, user_ids):
+    collect(session, 'unread_notifications').update(user_ids)
+
+
+@event.listens_for(db.session, 'before_flush')
+def count_unread_changes(session, flush_context, instances):
+    """Apply this flush's new, read and deleted notifications to the counters"""
+    changes = {}
+    for obj in session.new:
+        if isinstance(obj, Notification) and not obj.is_read:
+            changes[obj.user_id] = changes.get(obj.user_id, 0) + 1
+    for obj in session.deleted:
+        if isinstance(obj, Notification):
+            history = db.inspect(obj).attrs.is_read.history
+            if not (history.deleted[0] if history.deleted else obj.is_read):
+                changes[obj.user_id] = changes.get(obj.user_id, 0) - 1
+    for obj in session.dirty:
+        if isinstance(obj, Notification):
+            history = db.inspect(obj).attrs.is_read.history
+            if not history.has_changes():
+                continue
+            if history.deleted:
+                was_read = history.deleted[0]
+            else:
+                # Set without having been loaded first; read what the database holds
+                was_read = session.connection().execute(
+                    db.select(Notification.is_read).where(Notification.id == obj.id)
+                ).scalar()
+            if bool(was_read) != bool(obj.is_read):
+                changes[obj.user_id] = changes.get(obj.user_id, 0) + (-1 if obj.is_read else 1)
+
+    changes = {user_id: delta for user_id, delta in changes.items() if delta}
+    if changes:
+        _add_unread(session.connection(), changes)
+        _touch(session, changes)
+
+
+def mark_all_read(user_id):
+    """
+    Mark every unread notification of a user as read with one UPDATE
+
+    Returns:
+        int: number of notifications marked
+    """
+    marked = db.session.execute(
+        db.update(Notification)
+        .where(Notification.user_id == user_id, Notification.is_read == False)
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    # Take off only what was marked: a notification committed in between
+    # is still unread and still counted
+    _add_unread(db.session.connection(), {user_id: -marked})
+    _touch(db.session, [user_id])
+    db.session.commit()
+    return marked
+
+
+def recount_unread():
+    """Set every user's counter from the notifications table"""
+    users = User.__table__
+    unread = db.select(func.count(Notification.id)).where(
+        Notification.user_id == users.c.id, Notification.is_read == False
+    ).scalar_subquery()
+    updated = db.session.execute(users.update().values(
+        unread_notifications=unread, updated_at=users.c.updated_at
+    )).rowcount
+    db.session.commit()
+    return updated
+
+
+class UnreadEmitter:
+    """Sends each user's latest unread count once per window"""
+
+    def __init__(self, window=DEFAULT_EMIT_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._scheduled = False
+        self._app = None
+        self.emitted = 0
+
+    def init_app(self, app):
+        self._app = app
+        self.window = app.config.get('NOTIFICATION_EMIT_WINDOW', DEFAULT_EMIT_WINDOW)
+
+    def notify(self, user_ids):
+        """Queue users for the next emit"""
+        if self._app is None:
+            return
+        with self._lock:
+            self._pending.update(user_ids)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        socketio.start_background_task(self._flush_later)
+
+    def _flush_later(self):
+        socketio.sleep(self.window)
+        with self._lock:
+            user_ids, self._pending = self._pending, set()
+            self._scheduled = False
+        if not user_ids:
+            return
+        with self._app.app_context():
+            try:
+                counts = dict(db.session.execute(
+                    db.select(User.id, User.unread_notifications).where(User.id.in_(user_ids))
+                ).all())
+            except Exception as e:
+                logger.warning(f"Unread notification emit failed: {e}")
+                return
+            finally:
+                db.session.remove()
+        for user_id in user_ids:
+            socketio.emit('notification', {
+                'unreadCount': max(counts.get(user_id) or 0, 0)
+            }, room=f'user_{user_id}')
+            self.emitted += 1
+
+
+unread_emitter = UnreadEmitter()
+
+
+@on_commit('unread_notifications')
+def emit_unread_counts(session, user_ids):
+    unread_emitter.notify(user_ids)
+
+
+def init_unread_notifications(app):
+    """Start coalesced socket emits and register the recount CLI command"""
+    unread_emitter.init_app(app)
+
+    @app.cli.command('recount-unread-notifications')
+    def recount_unread_command():
+        """Recompute every user's unread notification counter."""
+        count = recount_unread()
+        click.echo(f'Unread notification counters recounted for {count} users.')
@@ -0,0 +1,331 @@
+"""
+Inbox for PayOS payment webhooks
+
+/payment/webhook only verifies the signature, stores the delivery in
+webhook_events and answers. Deliveries are unique on (orderCode, status,
+transactionId), so PayOS retries and duplicates land on the row already
+stored instead of running the work again.
+
+A pool of worker threads per process applies stored events to their
+orders. Claiming an event, changing its order and marking the event done
+commit together, so each event takes effect once however many workers or
+processes pick it up. apply_payment_status() only moves orders out of
+PENDING_PAYMENT, so /payment/success and the webhook can't both apply the
+same payment either.
+
+Events left pending by a restart, and failed ones, are picked up again by
+a periodic sweep, which starts with the first request a process serves. `flask replay-webhooks` re-runs chosen events by hand.
+"""
+import json
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from extensions import db
+from models.order import Order, OrderStatus
+from models.cart import Cart
+from models.webhook_event import WebhookEvent
+from services.popularity import record_order
+
+DEFAULT_WORKERS = 4
+DEFAULT_SWEEP_SECONDS = 60
+MAX_ATTEMPTS = 5
+
+# Webhook status -> what it makes of an order still waiting for payment
+TRANSITIONS = {
+    'success': OrderStatus.PAID,
+    'failed': OrderStatus.CANCELLED,
+    'cancel': OrderStatus.CANCELLED
+}
+
+# States a worker may claim
+CLAIMABLE = (WebhookEvent.PENDING, WebhookEvent.FAILED)
+
+logger = logging.getLogger(__name__)
+
+
+def _delivery_key(data):
+    """Unique key of a delivery; raises ValueError for a malformed orderCode"""
+    return {
+        'order_code': int(data['orderCode']),
+        'status': str(data['status']),
+        'transaction_id': str(data.get('transactionId') or '')
+    }
+
+
+def record_event(data, payload=None):
+    """
+    Store a verified webhook delivery, or count it against the stored one
+
+    Args:
+        data: Parsed webhook body
+        payload: Raw body as received (default: data re-encoded)
+
+    Returns:
+        tuple: (event id, True if this was the first delivery)
+    """
+    key = _delivery_key(data)
+    row = dict(key, amount=data.get('amount'), payload=payload or json.dumps(data),
+               state=WebhookEvent.PENDING, attempts=0, deliveries=1, received_at=datetime.utcnow())
+    table = WebhookEvent.__table__
+    connection = db.session.connection()
+
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        stmt = insert(table).values(row)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.order_code, table.c.status, table.c.transaction_id],
+            set_={'deliveries': table.c.deliveries + 1}
+        ).returning(table.c.id, table.c.deliveries)
+        event_id, deliveries = connection.execute(stmt).one()
+    else:
+        match = [table.c[name] == value for name, value in key.items()]
+        updated = connection.execute(table.update().where(*match).values(deliveries=table.c.deliveries + 1))
+        if not updated.rowcount:
+            connection.execute(table.insert(), [row])
+        event_id, deliveries = connection.execute(db.select(table.c.id, table.c.deliveries).where(*match)).one()
+
+    db.session.commit()
+    return event_id, deliveries == 1
+
+
+def apply_payment_status(order_id, status, transaction_id=None):
+    """
+    Move an order waiting for payment to PAID or CANCELLED; the caller commits
+
+    Orders that have already left PENDING_PAYMENT are left alone, so a
+    payment is applied once whichever of /payment/success, the webhook or a
+    replay gets there first.
+
+    Returns:
+        tuple: (order if it changed, else None; reason it didn't change)
+    """
+    target = TRANSITIONS.get(status)
+    if target is None:
+        return None, f"Unhandled webhook status {status!r}"
+
+    # Write-lock the order before reading it: a SELECT ... FOR UPDATE is
+    # ignored by SQLite, whose driver also reads outside the transaction
+    # until the first write. Matches only while the order is still pending.
+    locked = db.session.execute(
+        Order.__table__.update()
+        .where(Order.id == order_id, Order.status == OrderStatus.PENDING_PAYMENT)
+        .values(status=Order.status)
+    ).rowcount
+    order = Order.query.filter_by(id=order_id).populate_existing().first()
+    if order is None:
+        return None, 'Order not found'
+    if not locked or order.status != OrderStatus.PENDING_PAYMENT:
+        return None, f"Order is already {order.status.value}"
+
+    order.status = target
+    if target == OrderStatus.PAID:
+        order.payment_id = transaction_id or order.payment_id
+        record_order(order)
+    return order, None
+
+
+def process_event(event_id):
+    """
+    Apply one stored event to its order
+
+    Returns:
+        str: The event's new state, or None if it was no longer claimable
+             (another worker handled it, or it was already done)
+    """
+    try:
+        claimed = db.session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == event_id, WebhookEvent.state.in_(CLAIMABLE))
+            .values(attempts=WebhookEvent.attempts + 1)
+        ).rowcount
+        if not claimed:
+            db.session.rollback()
+            return None
+
+        event = db.session.get(WebhookEvent, event_id, populate_existing=True)
+        order, reason = apply_payment_status(event.order_code, event.status, event.transaction_id)
+        event.state = WebhookEvent.PROCESSED if order is not None else WebhookEvent.SKIPPED
+        event.last_error = reason
+        event.processed_at = datetime.utcnow()
+        paid_by = order.user_id if order is not None and order.status == OrderStatus.PAID else None
+        state = event.state
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        # Conditional, so a worker that lost a race can't undo the winner's result
+        db.session.execute(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == event_id, WebhookEvent.state.in_(CLAIMABLE))
+            .values(state=WebhookEvent.FAILED, attempts=WebhookEvent.attempts + 1, last_error=str(e))
+        )
+        db.session.commit()
+        logger.warning("Webhook event %s failed: %s", event_id, e)
+        return WebhookEvent.FAILED
+
+    if state == WebhookEvent.SKIPPED:
+        logger.info("Webhook event %s skipped: %s", event_id, reason)
+    if paid_by is not None:
+        Cart.clear_cart(paid_by)
+    return state
+
+
+def due_events(older_than=None, limit=500):
+    """Ids of pending events older than the given age, and failed ones still to retry"""
+    query = db.session.query(WebhookEvent.id).filter(
+        WebhookEvent.state.in_(CLAIMABLE),
+        WebhookEvent.attempts < MAX_ATTEMPTS
+    )
+    if older_than is not None:
+        query = query.filter(WebhookEvent.received_at < datetime.utcnow() - older_than)
+    return [event_id for event_id, in query.order_by(WebhookEvent.received_at).limit(limit)]
+
+
+class WebhookWorkers:
+    """Per-process threads applying stored webhook events, plus a periodic sweep"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, sweep_seconds=DEFAULT_SWEEP_SECONDS):
+        self.workers = workers
+        self.sweep_seconds = sweep_seconds
+        self._app = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+        self.outcomes = dict.fromkeys((WebhookEvent.PROCESSED, WebhookEvent.SKIPPED, WebhookEvent.FAILED), 0)
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = app.config.get('WEBHOOK_WORKERS', DEFAULT_WORKERS)
+        self.sweep_seconds = app.config.get('WEBHOOK_SWEEP_SECONDS') or DEFAULT_SWEEP_SECONDS
+
+    def submit(self, event_id):
+        """Queue an event, starting the workers if no request has yet"""
+        self.start()
+        self._queue.put(event_id)
+
+    def join(self):
+        """Wait until every queued event has been handled"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.outcomes, queued=self._queue.qsize(), workers=len(self._threads))
+
+    def start(self):
+        """Start the workers and the sweep once per process"""
+        if self._threads or self._app is None:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [threading.Thread(target=self._work, name=f'webhook-worker-{n}', daemon=True)
+                             for n in range(max(self.workers, 1))]
+            self._threads.append(threading.Thread(target=self._sweep, name='webhook-sweep', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            if thread.name != 'webhook-sweep':
+                self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        while True:
+            event_id = self._queue.get()
+            try:
+                if event_id is None:
+                    return
+                with self._app.app_context():
+                    try:
+                        state = process_event(event_id)
+                    except Exception as e:
+                        # Recording the failure failed too; the sweep retries it
+                        logger.warning("Webhook event %s could not be processed: %s", event_id, e)
+                        state = None
+                    finally:
+                        db.session.remove()
+                if state is not None:
+                    with self._lock:
+                        self.outcomes[state] += 1
+            finally:
+                self._queue.task_done()
+
+    def _sweep(self):
+        # The first pass runs at start, for events a restart left behind
+        while True:
+            with self._app.app_context():
+                try:
+                    # Fresh pending events are still in some worker's queue
+                    for event_id in due_events(older_than=timedelta(seconds=self.sweep_seconds)):
+                        self._queue.put(event_id)
+                except Exception as e:
+                    logger.warning("Webhook sweep failed: %s", e)
+                finally:
+                    db.session.remove()
+            if self._stop.wait(self.sweep_seconds):
+                return
+
+
+webhook_workers = WebhookWorkers()
+
+
+def replay_events(event_ids=None, state=WebhookEvent.FAILED, order_code=None, since=None):
+    """
+    Re-run stored events in this process
+
+    Chosen events go back to pending with a fresh attempt count and are
+    applied one by one. Orders that already left PENDING_PAYMENT stay as
+    they are, so replaying processed events only marks them skipped.
+
+    Returns:
+        list: (event id, new state) for each event replayed
+    """
+    query = WebhookEvent.query
+    if event_ids:
+        query = query.filter(WebhookEvent.id.in_(event_ids))
+    elif state:
+        query = query.filter(WebhookEvent.state == state)
+    if order_code is not None:
+        query = query.filter(WebhookEvent.order_code == order_code)
+    if since is not None:
+        query = query.filter(WebhookEvent.received_at >= since)
+    ids = [event.id for event in query.order_by(WebhookEvent.received_at)]
+    if not ids:
+        return []
+
+    db.session.execute(update(WebhookEvent).where(WebhookEvent.id.in_(ids)).values(
+        state=WebhookEvent.PENDING, attempts=0, last_error=None, processed_at=None))
+    db.session.commit()
+    return [(event_id, process_event(event_id)) for event_id in ids]
+
+
+def init_webhook_inbox(app):
+    """Start the webhook workers with the first request and register the replay CLI command"""
+    webhook_workers.init_app(app)
+    # Not at import: threads started before a preforking server forks don't
+    # survive into the workers
+    app.before_request(webhook_workers.start)
+
+    @app.cli.command('replay-webhooks')
+    @click.option('--id', 'event_ids', type=int, multiple=True, help='Event id; repeat for several.')
+    @click.option('--state', default=WebhookEvent.FAILED, show_default=True,
+                  type=click.Choice(['pending', 'processed', 'skipped', 'failed']),
+                  help='Replay events in this state when no --id is given.')
+    @click.option('--order', 'order_code', type=int, help='Only events for this order code.')
+    @click.option('--hours', type=float, help='Only events received in the last N hours.')
+    def replay_webhooks_command(event_ids, state, order_code, hours):
+        """Re-run stored PayOS webhook events."""
+        since = datetime.utcnow() - timedelta(hours=hours) if hours else None
+        results = replay_events(event_ids, state, order_code, since)
+        for event_id, new_state in results:
+            click.echo(f'Event {event_id}: {new_state or "already handled"}')
+        click.echo(f'Replayed {len(results)} webhook events.')
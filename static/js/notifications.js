@@ -3,6 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const notificationDropdown = document.getElementById('notification-dropdown');
     const notificationBadge = document.getElementById('notification-badge');
     const notificationList = document.getElementById('notification-list');
+    const readAllButton = document.getElementById('notification-read-all');
 
     // Initialize Socket.IO
     const socket = io({
@@ -91,16 +92,36 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                // Get updated unread count
-                fetch('/api/notifications/unread')
-                    .then(response => response.json())
-                    .then(data => updateNotificationBadge(data.count));
+                updateNotificationBadge(data.unreadCount);
             }
             return data;
         })
         .catch(error => console.error('Error marking notification as read:', error));
     }
 
+    // Mark every notification as read in one request
+    if (readAllButton) {
+        readAllButton.addEventListener('click', function(e) {
+            e.preventDefault();
+            const csrfToken = document.querySelector('meta[name="csrf-token"]').content;
+            fetch('/api/notifications/read-all', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRF-Token': csrfToken
+                }
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    updateNotificationBadge(data.unreadCount);
+                    loadNotifications();
+                }
+            })
+            .catch(error => console.error('Error marking notifications as read:', error));
+        });
+    }
+
     // Toggle dropdown on bell click
     if (notificationBell) {
         notificationBell.addEventListener('click', function(e) {
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Concurrency stress test for checkout stock reservation
+
+Many threads reserve the same stock rows at once against SQLite in WAL mode.
+Every reservation takes one unit of a regular product and one unit of a
+size/color variant, so a short variant must also roll back the product line.
+
+Usage: python stress_stock_reservation.py [threads] [attempts_per_thread]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+PRODUCT_STOCK = 100
+VARIANT_STOCK = 60
+
+
+def run(thread_count, attempts):
+    db_path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    from config import TestingConfig
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    TestingConfig.SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30, 'check_same_thread': False}}
+
+    from sqlalchemy import event
+    from sqlalchemy.exc import OperationalError
+    from app import create_app
+    from extensions import db
+    from models import Category, Product, ProductSize, ProductColor, ProductVariant
+    from services.inventory import reserve_lines, InsufficientStockError
+
+    app = create_app('testing')
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
+        db.engine.dispose()
+        db.create_all()
+        category = Category(name='Stress', slug='stress')
+        db.session.add(category)
+        db.session.flush()
+        regular = Product(name='Regular', price=1000, category_id=category.id,
+                          stock=PRODUCT_STOCK, sku='STRESS-R', inventory_type='regular')
+        shirt = Product(name='Shirt', price=1000, category_id=category.id,
+                        stock=VARIANT_STOCK, sku='STRESS-V', inventory_type='both')
+        db.session.add_all([regular, shirt])
+        db.session.flush()
+        size = ProductSize(product_id=shirt.id, size='M', stock=VARIANT_STOCK)
+        color = ProductColor(product_id=shirt.id, color_name='Red', stock=VARIANT_STOCK)
+        db.session.add_all([size, color])
+        db.session.flush()
+        variant = ProductVariant(product_id=shirt.id, size_id=size.id, color_id=color.id, stock=VARIANT_STOCK)
+        db.session.add(variant)
+        db.session.commit()
+        lines = [
+            {'product_id': regular.id, 'quantity': 1},
+            {'product_id': shirt.id, 'quantity': 1, 'variant_id': variant.id}
+        ]
+        regular_id, shirt_id, variant_id = regular.id, shirt.id, variant.id
+
+    counts = {'reserved': 0, 'short': 0, 'busy': 0}
+    counts_lock = threading.Lock()
+    start_gate = threading.Barrier(thread_count)
+
+    def worker():
+        start_gate.wait()
+        for _ in range(attempts):
+            with app.app_context():
+                while True:
+                    try:
+                        reserve_lines(lines)
+                        db.session.commit()
+                        outcome = 'reserved'
+                    except InsufficientStockError:
+                        db.session.rollback()
+                        outcome = 'short'
+                    except OperationalError:
+                        # Lock wait timed out; try the same checkout again
+                        db.session.rollback()
+                        with counts_lock:
+                            counts['busy'] += 1
+                        continue
+                    break
+                db.session.remove()
+            with counts_lock:
+                counts[outcome] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        regular_stock = db.session.get(Product, regular_id).stock
+        shirt_stock = db.session.get(Product, shirt_id).stock
+        variant_stock = db.session.get(ProductVariant, variant_id).stock
+
+    print(f"Threads: {thread_count}, attempts: {thread_count * attempts}, {elapsed:.2f}s")
+    print(f"Reserved: {counts['reserved']}, out of stock: {counts['short']}, lock retries: {counts['busy']}")
+    print(f"Regular stock: {regular_stock}, shirt stock: {shirt_stock}, variant stock: {variant_stock}")
+
+    expected_reserved = min(VARIANT_STOCK, PRODUCT_STOCK, thread_count * attempts)
+    ok = (counts['reserved'] == expected_reserved
+          and regular_stock == PRODUCT_STOCK - expected_reserved
+          and variant_stock == VARIANT_STOCK - expected_reserved
+          and shirt_stock == VARIANT_STOCK - expected_reserved)
+    print('OK: no overselling' if ok else 'FAILED: stock does not add up')
+    return ok
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    attempts = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    sys.exit(0 if run(threads, attempts) else 1)